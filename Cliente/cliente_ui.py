@@ -10,6 +10,7 @@ ws_connection = None
 is_authenticated = False
 user_permissions = []
 current_user = None
+last_seq = None  # Último evento do change feed recebido (mantido entre reconexões)
 
 def get_input():
     """Recolhe e valida os dados de entrada do formulário"""
@@ -116,11 +117,16 @@ def update_user_info(user_info):
 
 def on_message(ws, message):
     """Processa mensagens recebidas através do WebSocket"""
-    global is_authenticated, user_permissions, current_user
+    global is_authenticated, user_permissions, current_user, last_seq
     
     try:
         data = json.loads(message)
         
+        # Regista a posição no change feed (eventos e respostas de retoma)
+        seq = data.get("seq", data.get("last_seq")) if isinstance(data, dict) else None
+        if isinstance(seq, int) and (last_seq is None or seq > last_seq):
+            last_seq = seq
+        
         # Processa resposta de token OAuth2
         if "access_token" in data and "token_type" in data:
             # Autenticação OAuth2 bem-sucedida
@@ -141,6 +147,10 @@ def on_message(ws, message):
                 "expires_in": f"{data.get('expires_in', 0)} seconds"
             })
             
+            # Após reconexão pede apenas os eventos perdidos desde o último recebido
+            if last_seq is not None:
+                send_ws_request("resume", {"resume_from": last_seq})
+            
         # Processa erros de permissão/âmbito OAuth2 (para TODOS os serviços)
         elif "error" in data and data.get("error") == "insufficient_scope":
             # Permissão negada mas utilizador continua autenticado
@@ -0,0 +1,387 @@
+"""
+Benchmark do caminho de eventos de produtos:
+publicador RabbitMQ -> consumidor do gateway -> notify_clients -> clientes WebSocket
+
+Corre contra um RabbitMQ local (--broker amqp, usar um contentor descartável:
+a fila product_updates é esvaziada) ou contra um broker em memória que imita
+um exchange topic (--broker inprocess, por omissão). Os clientes WebSocket são
+simulados, pelo que mede-se o gateway sem o custo da rede.
+
+Uso (a partir da pasta Servidor):
+    python Benchmarks/messaging_benchmark.py --broker inprocess --output bench_results.json
+    RABBITMQ_HOST=localhost python Benchmarks/messaging_benchmark.py --broker amqp
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+
+# O benchmark usa os módulos do gateway e os módulos partilhados tal como estão no repositório
+SERVIDOR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [SERVIDOR_DIR, os.path.join(SERVIDOR_DIR, 'WebSockets')]
+
+import produtos_pb2
+import websocket_server as gateway
+from client_send_queue import ClientSendQueue
+from common.events import build_event, encode_event, PROTOBUF_CONTENT_TYPE
+from common.topics import ALL_PRODUCT_EVENTS, routing_key_for, topic_matches
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+# O gateway regista cada ligação/desligação em INFO: silenciado para não pesar na medição
+logging.getLogger(gateway.__name__).setLevel(logging.WARNING)
+
+DEFAULT_FANOUT_CLIENTS = '1,10,100,1000,10000'
+AMQP_CONSUMER_WARMUP = 2.0  # Segundos até o consumidor do gateway estar ligado à fila
+
+
+class StandInMessage:
+    """Mensagem entregue pelo broker em memória (subconjunto da interface do aio_pika)"""
+
+    def __init__(self, broker, body, content_type, routing_key, delivery_tag):
+        self.broker = broker
+        self.body = body
+        self.content_type = content_type
+        self.routing_key = routing_key
+        self.delivery_tag = delivery_tag
+
+    async def ack(self, multiple=False):
+        self.broker.ack(self.delivery_tag, multiple)
+
+
+class InProcessBroker:
+    """Substituto em memória de um exchange topic do RabbitMQ, com filas asyncio"""
+
+    def __init__(self):
+        self.bindings = []  # Pares (padrão, nome da fila)
+        self.queues = {}
+        self.delivery_tag = 0
+        self.unacked = 0
+
+    def declare_queue(self, name, binding_key):
+        self.queues.setdefault(name, asyncio.Queue())
+        self.bindings.append((binding_key, name))
+
+    def publish(self, routing_key, body, content_type=PROTOBUF_CONTENT_TYPE):
+        """Entrega a mensagem a todas as filas cujo binding corresponde à routing key"""
+        for binding_key, name in self.bindings:
+            if topic_matches(binding_key, routing_key):
+                self.delivery_tag += 1
+                self.unacked += 1
+                self.queues[name].put_nowait(
+                    StandInMessage(self, body, content_type, routing_key, self.delivery_tag)
+                )
+
+    def ack(self, delivery_tag, multiple):
+        # Etiquetas sequenciais: um ack múltiplo confirma tudo o que ainda estava pendente
+        self.unacked = 0 if multiple else max(0, self.unacked - 1)
+
+    async def consume(self, name, handler):
+        queue = self.queues[name]
+        while True:
+            await handler(await queue.get())
+
+
+class DeliveryTracker:
+    """Conta (e opcionalmente guarda) as entregas aos clientes simulados"""
+
+    def __init__(self, record=False):
+        self.count = 0
+        self.target = 0
+        self.done = asyncio.Event()
+        self.deliveries = [] if record else None
+
+    def expect(self, target):
+        self.count = 0
+        self.target = target
+        self.done.clear()
+
+    def received(self, data):
+        self.count += 1
+        if self.deliveries is not None:
+            self.deliveries.append((time.perf_counter(), data))
+        if self.count >= self.target:
+            self.done.set()
+
+
+class SimulatedClient:
+    """Cliente WebSocket autenticado e subscrito, sem socket real"""
+
+    def __init__(self, index, subprotocol, tracker):
+        self.remote_address = ('bench', index)
+        self.subprotocol = subprotocol
+        self.tracker = tracker
+
+    async def send(self, data):
+        self.tracker.received(data)
+
+    async def close(self, code=1000, reason=''):
+        pass
+
+
+def attach_clients(count, subprotocol, tracker, pattern=ALL_PRODUCT_EVENTS):
+    """Regista clientes simulados directamente no estado do gateway"""
+    clients = []
+    for index in range(count):
+        client = SimulatedClient(index, subprotocol, tracker)
+        gateway.connected_clients[client] = {'authenticated': True, 'user_id': f"bench-{index}"}
+        gateway.client_queues[client] = ClientSendQueue(client, gateway.CLIENT_QUEUE_SIZE, gateway.SLOW_CLIENT_POLICY)
+        gateway.add_subscriptions(client, [pattern])
+        clients.append(client)
+    return clients
+
+
+async def detach_clients(clients):
+    for client in clients:
+        await gateway.unregister(client)
+
+
+def reset_gateway():
+    """Limpa o change feed para que cada medição comece com sequências novas"""
+    gateway.change_feed.clear()
+    gateway.last_seq = 0
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return round(sorted_values[index], 4)
+
+
+def summarize(values_ms):
+    """Percentis de uma lista de durações em milissegundos"""
+    values = sorted(values_ms)
+    return {
+        "samples": len(values),
+        "mean_ms": round(sum(values) / len(values), 4) if values else None,
+        "p50_ms": percentile(values, 0.50),
+        "p95_ms": percentile(values, 0.95),
+        "p99_ms": percentile(values, 0.99),
+        "max_ms": round(values[-1], 4) if values else None
+    }
+
+
+def bench_event(index, seq=None):
+    event = build_event('update', produto_id=index % 1000, user_id='bench')
+    if seq is not None:
+        event['seq'] = seq
+    return event
+
+
+def sequence_of(data):
+    """Obtém o seq de um evento tal como foi enviado ao cliente (protobuf ou JSON)"""
+    if isinstance(data, bytes):
+        return produtos_pb2.ProductEvent.FromString(data).seq
+    return json.loads(data)['seq']
+
+
+def amqp_publisher():
+    from common.rabbitmq_publisher import RabbitMQPublisher
+    return RabbitMQPublisher()
+
+
+def purge_amqp_queue():
+    """Esvazia product_updates para que eventos antigos não contaminem a medição"""
+    import pika
+    from common.rabbitmq_publisher import RABBITMQ_HOST, RABBITMQ_USER, RABBITMQ_PASS, PRODUCT_UPDATES_QUEUE
+    connection = pika.BlockingConnection(pika.ConnectionParameters(
+        RABBITMQ_HOST, credentials=pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
+    ))
+    try:
+        connection.channel().queue_purge(PRODUCT_UPDATES_QUEUE)
+    finally:
+        connection.close()
+
+
+async def bench_publish_rate(broker_type, events, batch_size):
+    """Eventos por segundo aceites pelo broker (sem consumidor activo)"""
+    messages = [bench_event(index) for index in range(events)]
+    results = {}
+
+    if broker_type == 'inprocess':
+        broker = InProcessBroker()
+        broker.declare_queue('product_updates', ALL_PRODUCT_EVENTS)
+        start = time.perf_counter()
+        for message in messages:
+            broker.publish(routing_key_for(message), encode_event(message))
+        elapsed = time.perf_counter() - start
+        results['publish'] = {"events": events, "seconds": round(elapsed, 4),
+                              "events_per_sec": round(events / elapsed, 1)}
+        return results
+
+    publisher = amqp_publisher()
+    try:
+        def publish_confirmed():
+            start = time.perf_counter()
+            for message in messages:
+                publisher.publish(message)
+            return time.perf_counter() - start
+
+        def publish_batched():
+            start = time.perf_counter()
+            for offset in range(0, events, batch_size):
+                publisher.publish_batch(messages[offset:offset + batch_size])
+            return time.perf_counter() - start
+
+        for name, run in (('publish_confirm', publish_confirmed), ('publish_batch', publish_batched)):
+            elapsed = await asyncio.to_thread(run)
+            results[name] = {"events": events, "seconds": round(elapsed, 4),
+                             "events_per_sec": round(events / elapsed, 1)}
+        results['publish_batch']['batch_size'] = batch_size
+    finally:
+        publisher.close()
+        await asyncio.to_thread(purge_amqp_queue)
+    return results
+
+
+async def bench_end_to_end(broker_type, events, clients, rate, subprotocol, timeout):
+    """Latência entre a publicação de um evento e a sua entrega a cada cliente simulado"""
+    reset_gateway()
+    tracker = DeliveryTracker(record=True)
+    attached = attach_clients(clients, subprotocol, tracker)
+    tracker.expect(events * clients)
+    # Sequências sempre crescentes entre execuções: eventos antigos são descartados como duplicados
+    seq_base = int(time.time() * 1000) * 1000
+    published = {}
+    interval = 1.0 / rate if rate > 0 else 0
+
+    if broker_type == 'inprocess':
+        broker = InProcessBroker()
+        broker.declare_queue('product_updates', ALL_PRODUCT_EVENTS)
+        consumer = asyncio.create_task(broker.consume('product_updates', gateway.handle_rabbitmq_message))
+        start = time.perf_counter()
+        for index in range(events):
+            if interval:
+                delay = start + index * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            seq = seq_base + index + 1
+            message = bench_event(index, seq)
+            published[seq] = time.perf_counter()
+            broker.publish(routing_key_for(message), encode_event(message))
+            if not interval:
+                await asyncio.sleep(0)
+    else:
+        consumer = asyncio.create_task(gateway.start_rabbitmq_consumer())
+        await asyncio.sleep(AMQP_CONSUMER_WARMUP)
+        publisher = amqp_publisher()
+
+        def publish_paced():
+            start = time.perf_counter()
+            for index in range(events):
+                if interval:
+                    delay = start + index * interval - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                seq = seq_base + index + 1
+                published[seq] = time.perf_counter()
+                publisher.publish(bench_event(index, seq))
+
+        try:
+            await asyncio.to_thread(publish_paced)
+        finally:
+            publisher.close()
+
+    try:
+        await asyncio.wait_for(tracker.done.wait(), timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Timed out with {tracker.count}/{tracker.target} deliveries")
+    finally:
+        consumer.cancel()
+        await asyncio.gather(consumer, return_exceptions=True)
+        await gateway.ack_pending_messages()
+        await detach_clients(attached)
+
+    latencies = [(received_at - published[sequence_of(data)]) * 1000
+                 for received_at, data in tracker.deliveries]
+    return {
+        "events": events,
+        "clients": clients,
+        "rate": rate,
+        "subprotocol": 'protobuf' if subprotocol else 'json',
+        "delivered": tracker.count,
+        "expected": tracker.target,
+        **summarize(latencies)
+    }
+
+
+async def bench_fanout(client_counts, events, subprotocol):
+    """Tempo entre notify_clients e a entrega de um evento ao último cliente"""
+    results = []
+    message = bench_event(0)
+    routing_key = routing_key_for(message)
+    protobuf_data = encode_event(message)
+    for count in client_counts:
+        reset_gateway()
+        tracker = DeliveryTracker()
+        attached = attach_clients(count, subprotocol, tracker)
+        durations = []
+        try:
+            for _ in range(events):
+                tracker.expect(count)
+                start = time.perf_counter()
+                await gateway.notify_clients(message, routing_key, protobuf_data=protobuf_data)
+                await tracker.done.wait()
+                durations.append((time.perf_counter() - start) * 1000)
+        finally:
+            await detach_clients(attached)
+        results.append({"clients": count, "events": events, **summarize(durations)})
+        print(f"fan-out {count:>6} clients: p50 {results[-1]['p50_ms']:.3f} ms, "
+              f"p99 {results[-1]['p99_ms']:.3f} ms")
+    return results
+
+
+async def run(args):
+    subprotocol = gateway.PROTOBUF_SUBPROTOCOL if args.subprotocol == 'protobuf' else None
+    results = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat() + 'Z',
+            "broker": args.broker,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "slow_client_policy": gateway.SLOW_CLIENT_POLICY,
+            "client_queue_size": gateway.CLIENT_QUEUE_SIZE,
+            "ack_batch": gateway.RABBITMQ_ACK_BATCH
+        }
+    }
+    results.update(await bench_publish_rate(args.broker, args.events, args.batch_size))
+    print(f"publish: {json.dumps({k: v for k, v in results.items() if k.startswith('publish')})}")
+
+    results['end_to_end'] = await bench_end_to_end(
+        args.broker, args.events, args.latency_clients, args.rate, subprotocol, args.timeout
+    )
+    print(f"end-to-end: p50 {results['end_to_end']['p50_ms']} ms, p99 {results['end_to_end']['p99_ms']} ms")
+
+    client_counts = [int(count) for count in args.fanout_clients.split(',')]
+    results['fanout'] = await bench_fanout(client_counts, args.fanout_events, subprotocol)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark do caminho RabbitMQ -> gateway WebSocket')
+    parser.add_argument('--broker', choices=('inprocess', 'amqp'), default='inprocess')
+    parser.add_argument('--events', type=int, default=5000, help='Eventos publicados por medição')
+    parser.add_argument('--batch-size', type=int, default=100, help='Eventos por publish_batch (amqp)')
+    parser.add_argument('--rate', type=float, default=1000, help='Eventos/s na medição de latência (0 = sem limite)')
+    parser.add_argument('--latency-clients', type=int, default=10, help='Clientes simulados na medição de latência')
+    parser.add_argument('--fanout-clients', default=DEFAULT_FANOUT_CLIENTS, help='Lista de números de clientes')
+    parser.add_argument('--fanout-events', type=int, default=50, help='Eventos por número de clientes')
+    parser.add_argument('--subprotocol', choices=('protobuf', 'json'), default='protobuf')
+    parser.add_argument('--timeout', type=float, default=60, help='Espera máxima pelas entregas (s)')
+    parser.add_argument('--output', default='bench_results.json')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""
+Benchmark das respostas SOAP: read_all (JSON dentro de uma string) vs
+read_all_produtos (Array(Produto) tipado)
+
+Para cada tamanho de catálogo mede o tamanho do envelope (sem compressão e
+com gzip), o tempo do pedido HTTP (consulta, serialização e transferência) e
+o tempo de descodificação no cliente até obter a lista de dicionários que o
+gateway envia aos clientes (zeep + json.loads ou zeep + conversão dos objectos).
+
+Por omissão corre o serviço SOAP do repositório num servidor local com uma
+colecção em memória (--target inprocess); com --wsdl mede um serviço já em
+execução, com o catálogo que este tiver.
+
+Uso (a partir da pasta Servidor):
+    python Benchmarks/soap_payload_benchmark.py --sizes 100,1000,10000 --output soap_results.json
+    python Benchmarks/soap_payload_benchmark.py --wsdl http://localhost:8002/?wsdl
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import platform
+import sys
+import threading
+import time
+from datetime import datetime
+from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+SERVIDOR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [SERVIDOR_DIR, os.path.join(SERVIDOR_DIR, 'SOAP'), os.path.join(SERVIDOR_DIR, 'WebSockets')]
+
+from zeep import Client as SoapClient
+
+from common.serialization import loads
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = '100,1000,10000'
+OPERATIONS = ('read_all', 'read_all_produtos')
+
+
+class InMemoryCursor:
+    """Subconjunto do cursor do pymongo usado pelo serviço SOAP"""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction):
+        self.docs = sorted(self.docs, key=lambda doc: doc[key], reverse=direction < 0)
+        return self
+
+    def limit(self, count):
+        self.docs = self.docs[:count]
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def __iter__(self):
+        return iter(self.docs)
+
+
+class InMemoryCollection:
+    """Colecção de produtos em memória (só find com filtro vazio, como as operações medidas)"""
+
+    def __init__(self, size):
+        self.docs = [{'id': i, 'name': f'Produto {i}', 'price': round(1 + i * 0.37, 2), 'stock': i % 500}
+                     for i in range(1, size + 1)]
+
+    def find(self, filtro, projecao=None):
+        return InMemoryCursor(list(self.docs))
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def start_inprocess_service():
+    """Arranca o serviço SOAP do repositório num servidor local; devolve (módulo, url do WSDL)"""
+    import app as soap
+    # Sem RabbitMQ: as notificações read_all não pesam na medição
+    soap.notify_read_all = lambda count: None
+    # Mede-se a serialização de cada pedido, não o cache de read_all
+    soap.CATALOG_CACHE_ENABLED = False
+    server = make_server('127.0.0.1', 0, soap.wsgi_app, handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return soap, f'http://127.0.0.1:{server.server_port}/?wsdl'
+
+
+def decode(operation, result):
+    """Resposta do zeep -> lista de dicionários, tal como no gateway"""
+    from websocket_server import produtos_from_soap
+    if operation == 'read_all':
+        return loads(result)
+    return produtos_from_soap(result)
+
+
+def call(client, operation):
+    """
+    Executa a operação separando o pedido HTTP da descodificação no cliente
+
+    Returns:
+        tuple: (bytes do envelope, ms do pedido, ms da descodificação, produtos)
+    """
+    binding = client.service._binding
+    address = client.service._binding_options['address']
+    envelope = client.create_message(client.service, operation)
+    headers = {'Content-Type': 'text/xml; charset=utf-8', 'SOAPAction': f'"{operation}"',
+               'Accept-Encoding': 'identity'}
+
+    start = time.perf_counter()
+    response = client.transport.post_xml(address, envelope, headers)
+    fetched = time.perf_counter()
+    produtos = decode(operation, binding.process_reply(client, binding.get(operation), response))
+    decoded = time.perf_counter()
+    return response.content, (fetched - start) * 1000, (decoded - fetched) * 1000, produtos
+
+
+def median(values):
+    values = sorted(values)
+    return round(values[len(values) // 2], 4)
+
+
+def bench_operation(client, operation, repetitions):
+    body, _, _, produtos = call(client, operation)  # Aquecimento (e tamanho do envelope)
+    fetch_ms, decode_ms = [], []
+    for _ in range(repetitions):
+        _, fetch, decode_time, _ = call(client, operation)
+        fetch_ms.append(fetch)
+        decode_ms.append(decode_time)
+    return {
+        "produtos": len(produtos),
+        "bytes": len(body),
+        "gzip_bytes": len(gzip.compress(body, compresslevel=6)),
+        "fetch_ms": median(fetch_ms),
+        "decode_ms": median(decode_ms),
+        "total_ms": median([f + d for f, d in zip(fetch_ms, decode_ms)]),
+    }
+
+
+def bench_size(client, repetitions):
+    results = {}
+    for operation in OPERATIONS:
+        results[operation] = bench_operation(client, operation, repetitions)
+        r = results[operation]
+        print(f"  {operation:<18} {r['produtos']:>7} produtos  {r['bytes']:>10} B  gzip {r['gzip_bytes']:>9} B  "
+              f"pedido {r['fetch_ms']:.2f} ms  descodificação {r['decode_ms']:.2f} ms")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark das respostas SOAP JSON-em-string vs tipadas')
+    parser.add_argument('--wsdl', help='WSDL de um serviço em execução (omissão: serviço local em memória)')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='Tamanhos do catálogo em memória')
+    parser.add_argument('--repetitions', type=int, default=10, help='Chamadas medidas por operação')
+    parser.add_argument('--output', default='soap_results.json')
+    args = parser.parse_args()
+
+    results = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat() + 'Z',
+            "target": args.wsdl or 'inprocess',
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repetitions": args.repetitions
+        },
+        "sizes": {}
+    }
+    if args.wsdl:
+        client = SoapClient(args.wsdl)
+        print(f"{args.wsdl}:")
+        results['sizes']['service'] = bench_size(client, args.repetitions)
+    else:
+        soap, wsdl = start_inprocess_service()
+        client = SoapClient(wsdl)
+        for size in [int(size) for size in args.sizes.split(',')]:
+            soap.collection = InMemoryCollection(size)
+            print(f"{size} produtos:")
+            results['sizes'][str(size)] = bench_size(client, args.repetitions)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
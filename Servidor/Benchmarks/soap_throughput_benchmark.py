@@ -0,0 +1,193 @@
+"""
+Benchmark do débito de leituras SOAP em função dos workers do servidor
+
+Para cada configuração arranca o serviço SOAP do repositório num processo à
+parte (catálogo em memória, sem MongoDB nem RabbitMQ) e mede, com vários
+clientes concorrentes e ligações keep-alive, os pedidos por segundo e os
+percentis de latência de read_page (ou read_all). Uma configuração é
+'wsgiref' (servidor de desenvolvimento) ou '<processos>x<threads>' (gunicorn).
+
+Uso (a partir da pasta Servidor):
+    python Benchmarks/soap_throughput_benchmark.py --configs wsgiref,1x1,1x4,2x4,4x4 --output soap_throughput.json
+"""
+import argparse
+import json
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+SERVIDOR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [SERVIDOR_DIR, os.path.join(SERVIDOR_DIR, 'SOAP'), os.path.join(SERVIDOR_DIR, 'WebSockets'),
+                BENCHMARKS_DIR]
+
+DEFAULT_CONFIGS = 'wsgiref,1x1,1x4,2x4,4x4'
+TNS = 'spyne.examples.readproduto'
+STARTUP_TIMEOUT = 30  # Segundos à espera que o servidor responda ao WSDL
+
+
+def envelope(operation, limit):
+    """Envelope SOAP do pedido, construído uma vez (o custo do zeep não entra na medição)"""
+    args = f'<tns:limit>{limit}</tns:limit>' if operation == 'read_page' else ''
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" '
+        f'xmlns:tns="{TNS}"><soapenv:Body><tns:{operation}>{args}</tns:{operation}>'
+        '</soapenv:Body></soapenv:Envelope>'
+    ).encode('utf-8')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_server(config, port, catalog):
+    """Modo --serve: corre o serviço SOAP com o catálogo em memória (processo filho)"""
+    import app as soap
+    from soap_payload_benchmark import InMemoryCollection
+    soap.collection = InMemoryCollection(catalog)
+    soap.notify_read_all = lambda count: None
+    soap.CATALOG_CACHE_ENABLED = False  # Sem MongoDB não há versão da colecção
+    if config == 'wsgiref':
+        soap.serve('127.0.0.1', port, server='wsgiref')
+    else:
+        workers, threads = (int(value) for value in config.split('x'))
+        soap.serve('127.0.0.1', port, server='gunicorn', workers=workers, threads=threads)
+
+
+def start_server(config, catalog):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve', config, '--port', str(port), '--catalog', str(catalog)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f'http://127.0.0.1:{port}/'
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url + '?wsdl', timeout=1).status_code == 200:
+                return process, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"SOAP server ({config}) did not start")
+
+
+def stop_server(process):
+    """SIGTERM, como o docker stop: o servidor termina os pedidos em curso"""
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return round(sorted_values[index], 3)
+
+
+def load(url, body, operation, clients, duration):
+    """Clientes concorrentes, cada um com a sua sessão keep-alive, durante duration segundos"""
+    latencies = [[] for _ in range(clients)]
+    errors = [0] * clients
+    stop_at = time.monotonic() + duration
+    headers = {'Content-Type': 'text/xml; charset=utf-8', 'SOAPAction': f'"{operation}"',
+               'Accept-Encoding': 'identity'}
+
+    def client(index):
+        session = requests.Session()
+        while time.monotonic() < stop_at:
+            start = time.perf_counter()
+            try:
+                response = session.post(url, data=body, headers=headers, timeout=30)
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            if ok:
+                latencies[index].append((time.perf_counter() - start) * 1000)
+            else:
+                errors[index] += 1
+        session.close()
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    values = sorted(value for client_latencies in latencies for value in client_latencies)
+    return {
+        "requests": len(values),
+        "errors": sum(errors),
+        "requests_per_s": round(len(values) / elapsed, 1),
+        "p50_ms": percentile(values, 0.50),
+        "p99_ms": percentile(values, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark do débito SOAP por número de workers')
+    parser.add_argument('--configs', default=DEFAULT_CONFIGS, help="Lista de 'wsgiref' e '<processos>x<threads>'")
+    parser.add_argument('--operation', choices=('read_page', 'read_all'), default='read_page')
+    parser.add_argument('--limit', type=int, default=100, help='Produtos por página (read_page)')
+    parser.add_argument('--catalog', type=int, default=1000, help='Produtos no catálogo em memória')
+    parser.add_argument('--clients', type=int, default=16, help='Clientes concorrentes')
+    parser.add_argument('--duration', type=float, default=10, help='Segundos de carga por configuração')
+    parser.add_argument('--output', default='soap_throughput.json')
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        run_server(args.serve, args.port, args.catalog)
+        return
+
+    body = envelope(args.operation, args.limit)
+    results = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat() + 'Z',
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "operation": args.operation,
+            "limit": args.limit,
+            "catalog": args.catalog,
+            "clients": args.clients,
+            "duration_s": args.duration
+        },
+        "configs": {}
+    }
+    for config in args.configs.split(','):
+        process, url = start_server(config, args.catalog)
+        try:
+            load(url, body, args.operation, 2, 1)  # Aquecimento
+            result = load(url, body, args.operation, args.clients, args.duration)
+        finally:
+            stop_server(process)
+        results['configs'][config] = result
+        print(f"{config:>8}: {result['requests_per_s']:>8} req/s  p50 {result['p50_ms']} ms  "
+              f"p99 {result['p99_ms']} ms  erros {result['errors']}")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
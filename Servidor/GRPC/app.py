@@ -1,40 +1,87 @@
 import grpc
+import logging
+import os
+import time
 from concurrent import futures
 import produtos_pb2
 import produtos_pb2_grpc
-from pymongo import MongoClient
-from bson import ObjectId
-import json
-import pika
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+from common.admission import AdmissionController, Overloaded, ADMISSION_MAX_QUEUE
+from common.events import build_event
+from common.idempotency import (
+    IDEMPOTENCY_METADATA, IdempotencyKeyReused, InvalidIdempotencyKey, RequestInProgress,
+    claim, release, request_fingerprint, store_or_release
+)
+from common.indexes import ensure_indexes
+from common.mongo_outbox import outbox_session, record_event
+from common.versioning import bump_version
+from common.validation import load_schemas, validate_produto, validate_produtos, ProdutoInvalido
 
 # Ligação à base de dados MongoDB
 client = MongoClient('mongodb://mongodb:27017/')
 db = client['produtos_db']
 collection = db['produtos']
 
-def send_rabbitmq_notification(message):
-    """Envia notificação para o RabbitMQ após operação de actualização"""
-    try:
-        # Configura credenciais de autenticação para RabbitMQ
-        credentials = pika.PlainCredentials('admin', 'admin')
-        connection = pika.BlockingConnection(
-            pika.ConnectionParameters('rabbitmq', credentials=credentials)
-        )
-        channel = connection.channel()
-        
-        # Declara fila durável para actualizações de produtos
-        channel.queue_declare(queue='product_updates', durable=True)
-        
-        # Publica mensagem na fila com persistência
-        channel.basic_publish(
-            exchange='',
-            routing_key='product_updates',
-            body=json.dumps(message),
-            properties=pika.BasicProperties(delivery_mode=2)  # Torna a mensagem persistente
-        )
-        connection.close()
-    except Exception as e:
-        print(f"Error sending RabbitMQ notification: {e}")
+logger = logging.getLogger(__name__)
+
+# Threads do servidor; acima de GRPC_MAX_WORKERS + ADMISSION_MAX_QUEUE chamadas
+# o próprio gRPC rejeita com RESOURCE_EXHAUSTED em vez de as pôr em fila
+GRPC_MAX_WORKERS = int(os.getenv('GRPC_MAX_WORKERS', '10'))
+
+# Actualização em massa: produtos do stream escritos por cada bulk_write
+BULK_UPDATE_BATCH_SIZE = int(os.getenv('BULK_UPDATE_BATCH_SIZE', '1000'))
+# Falhas detalhadas no resumo; sem limite um stream com muitos ids inválidos
+# excederia o tamanho máximo de uma mensagem gRPC (4 MB) e o resumo perdia-se
+BULK_UPDATE_MAX_FAILURES = int(os.getenv('BULK_UPDATE_MAX_FAILURES', '1000'))
+
+class AdmissionInterceptor(grpc.ServerInterceptor):
+    """Rejeita com RESOURCE_EXHAUSTED as chamadas que esperaram demasiado na fila do servidor
+
+    intercept_service corre na thread do servidor quando a chamada chega, antes
+    de entrar na fila do ThreadPoolExecutor: o tempo até a chamada começar a
+    executar é o tempo de espera em fila, devolvido nos metadados queue-wait-ms.
+    """
+
+    def __init__(self, controller):
+        self.controller = controller
+
+    def intercept_service(self, continuation, handler_call_details):
+        enqueued_at = time.monotonic()
+        handler = continuation(handler_call_details)
+        if handler is None:
+            return handler
+
+        def admitted(behavior):
+            def wrapper(request, context):
+                try:
+                    queue_wait = self.controller.acquire(enqueued_at)
+                except Overloaded as e:
+                    logger.debug(str(e))
+                    context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "Servico sobrecarregado, tente novamente")
+                try:
+                    context.send_initial_metadata((('queue-wait-ms', f"{queue_wait * 1000:.3f}"),))
+                    return behavior(request, context)
+                finally:
+                    self.controller.release()
+            return wrapper
+
+        # Só as chamadas com resposta única: numa resposta em stream o lugar seria libertado antes do envio
+        if handler.unary_unary is not None:
+            return handler._replace(unary_unary=admitted(handler.unary_unary))
+        if handler.stream_unary is not None:
+            return handler._replace(stream_unary=admitted(handler.stream_unary))
+        return handler
+
+admission = AdmissionController('grpc', max_concurrency=GRPC_MAX_WORKERS)
+
+def registar_falha(resumo, index, produto_id, motivo, detalhe):
+    """Regista no resumo um produto do stream que não foi actualizado (contadores sempre completos)"""
+    resumo.falhados += 1
+    if len(resumo.falhas) >= BULK_UPDATE_MAX_FAILURES:
+        resumo.falhas_truncadas = True
+        return
+    resumo.falhas.add(index=index, id=produto_id, motivo=motivo, detalhe=detalhe or '')
 
 class ProdutoService(produtos_pb2_grpc.ProdutoServiceServicer):
     """Classe de serviço gRPC que implementa as operações de produtos"""
@@ -54,42 +101,192 @@ class ProdutoService(produtos_pb2_grpc.ProdutoServiceServicer):
         metadata = dict(context.invocation_metadata())
         user_id = metadata.get('user_id', 'grpc_user')
         
-        # Prepara dados para actualização no MongoDB
-        update_data = {
-            'id': request.id,
-            'name': request.name,
-            'price': request.price,
-            'stock': request.stock,
-            'updated_by': user_id  # Regista quem fez a actualização
-        }
+        # Com idempotency-key nos metadados, uma repetição devolve a resposta guardada
+        key = metadata.get(IDEMPOTENCY_METADATA)
+        if key is None:
+            return self._update_produto(request, user_id)
         
-        # Executa actualização na base de dados
-        result = collection.update_one(
-            {'id': request.id},  # Critério de pesquisa pelo ID
-            {'$set': update_data}  # Dados a actualizar
-        )
+        scope = 'grpc:UpdateProduto'
+        # A chave fica associada à mensagem do pedido: reutilizá-la com outro produto é um erro
+        fingerprint = request_fingerprint(scope, request.SerializeToString(deterministic=True))
+        try:
+            guardada = claim(db, scope, key, fingerprint)
+        except (InvalidIdempotencyKey, IdempotencyKeyReused) as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+        except RequestInProgress:
+            context.abort(grpc.StatusCode.ABORTED, "Pedido com a mesma idempotency-key em curso")
+        if guardada is not None:
+            context.set_trailing_metadata((('idempotent-replayed', 'true'),))
+            return produtos_pb2.Resposta(mensagem=guardada['body']['mensagem'])
         
-        # Verifica se algum documento foi encontrado e actualizado
-        if result.matched_count == 0:
-            return produtos_pb2.Resposta(mensagem="Produto com ID não encontrado.")
+        try:
+            resposta = self._update_produto(request, user_id)
+        except Exception:
+            release(db, scope, key)
+            raise
+        store_or_release(db, scope, key, grpc.StatusCode.OK.value[0], {'mensagem': resposta.mensagem}, fingerprint)
+        return resposta
+    
+    def _update_produto(self, request, user_id):
+        """Valida e actualiza o produto, registando a notificação na outbox"""
+        # Valida o produto contra o schema partilhado com REST e SOAP
+        produto = {'id': request.id, 'name': request.name, 'price': request.price, 'stock': request.stock}
+        try:
+            validate_produto(produto)
+        except ProdutoInvalido as e:
+            return produtos_pb2.Resposta(mensagem=f"Dados invalidos: {e.message}")
         
-        # Prepara notificação para enviar ao sistema de mensagens
-        notification = {
-            'action': 'update',
-            'produto_id': request.id,
-            'user_id': user_id,
-            'timestamp': str(ObjectId())  # Timestamp baseado em ObjectId do MongoDB
-        }
+        # Prepara dados para actualização no MongoDB
+        update_data = dict(produto, updated_by=user_id)  # Regista quem fez a actualização
         
-        # Envia notificação assíncrona via RabbitMQ
-        send_rabbitmq_notification(notification)
+        with outbox_session(client) as session:
+            # Executa actualização na base de dados
+            result = collection.update_one(
+                {'id': request.id},  # Critério de pesquisa pelo ID
+                {'$set': update_data},  # Dados a actualizar
+                session=session
+            )
+            
+            # Verifica se algum documento foi encontrado e actualizado
+            if result.matched_count == 0:
+                return produtos_pb2.Resposta(mensagem="Produto com ID não encontrado.")
+            
+            # Prepara notificação para enviar ao sistema de mensagens
+            notification = build_event('update', produto_id=request.id, user_id=user_id)
+            
+            # Regista notificação na outbox (publicada no RabbitMQ pelo relay)
+            record_event(db, notification, session=session)
         
+        bump_version(db)
         return produtos_pb2.Resposta(mensagem=f"Produto atualizado com sucesso por {user_id}.")
+    
+    def BulkUpdateProdutos(self, request_iterator, context):
+        """
+        Actualiza os produtos recebidos em stream, em lotes de BULK_UPDATE_BATCH_SIZE
+        
+        Args:
+            request_iterator: Stream de produtos enviado pelo cliente
+            context: Contexto da chamada gRPC (contém metadados)
+            
+        Returns:
+            produtos_pb2.ResumoBulkUpdate: Contadores e, em falhas, a posição, id e motivo
+                dos primeiros BULK_UPDATE_MAX_FAILURES produtos não actualizados
+        """
+        metadata = dict(context.invocation_metadata())
+        user_id = metadata.get('user_id', 'grpc_user')
+        
+        resumo = produtos_pb2.ResumoBulkUpdate()
+        lote = []
+        for request in request_iterator:
+            produto = {'id': request.id, 'name': request.name, 'price': request.price, 'stock': request.stock}
+            lote.append((resumo.recebidos, produto))
+            resumo.recebidos += 1
+            if len(lote) >= BULK_UPDATE_BATCH_SIZE:
+                self._atualizar_lote(lote, user_id, resumo)
+                lote = []
+        if lote:
+            self._atualizar_lote(lote, user_id, resumo)
+        
+        resumo.mensagem = f"{resumo.atualizados} de {resumo.recebidos} produtos atualizados por {user_id}."
+        return resumo
+    
+    def _atualizar_lote(self, lote, user_id, resumo):
+        """
+        Valida e actualiza um lote de pares (posição no stream, produto)
+        
+        Os produtos válidos são escritos com um único bulk_write não ordenado,
+        pelo que um produto inválido ou inexistente não impede a actualização
+        dos outros. É registada uma única notificação bulk_update por lote.
+        """
+        pendentes = []
+        for (index, produto), erro in zip(lote, validate_produtos([produto for _, produto in lote])):
+            if erro:
+                registar_falha(resumo, index, produto['id'], 'rejeitado', f"Dados invalidos: {erro}")
+            else:
+                pendentes.append((index, produto))
+        
+        while pendentes:
+            try:
+                pendentes = self._atualizar_pendentes(pendentes, user_id, resumo)
+            except Exception as e:
+                for index, produto in pendentes:
+                    registar_falha(resumo, index, produto['id'], 'erro', str(e))
+                return
+    
+    def _atualizar_pendentes(self, pendentes, user_id, resumo):
+        """
+        Escreve o lote com bulk_write e regista a notificação dos produtos actualizados
+        
+        Os ids inexistentes são retirados antes da escrita com uma consulta ao
+        índice único em id: numa transacção o bulk_write pára no primeiro erro
+        e cada erro custaria uma transacção abortada e repetida.
+        
+        Returns:
+            list: Produtos a escrever de novo; só não é vazia quando uma transacção
+                (MONGO_TRANSACTIONS=1) foi abortada por um erro de escrita, cujo
+                produto é retirado antes da nova tentativa
+        """
+        with outbox_session(client) as session:
+            ids = [produto['id'] for _, produto in pendentes]
+            existentes = {doc['id'] for doc in collection.find({'id': {'$in': ids}}, {'_id': 0, 'id': 1}, session=session)}
+            for index, produto in pendentes:
+                if produto['id'] not in existentes:
+                    registar_falha(resumo, index, produto['id'], 'nao_encontrado', "Produto com ID não encontrado.")
+            # Na própria lista: se a escrita falhar, os inexistentes já registados não são contados de novo
+            pendentes[:] = [(index, produto) for index, produto in pendentes if produto['id'] in existentes]
+            if not pendentes:
+                return []
+            
+            operacoes = [
+                UpdateOne({'id': produto['id']}, {'$set': dict(produto, updated_by=user_id)})
+                for _, produto in pendentes
+            ]
+            falhados = set()
+            try:
+                matched = collection.bulk_write(operacoes, ordered=False, session=session).matched_count
+            except BulkWriteError as e:
+                write_errors = e.details.get('writeErrors', [])
+                if not write_errors:
+                    raise
+                for write_error in write_errors:
+                    index, produto = pendentes[write_error['index']]
+                    falhados.add(write_error['index'])
+                    registar_falha(resumo, index, produto['id'], 'erro', write_error.get('errmsg'))
+                if session is not None:
+                    # Numa transacção o erro anula todo o lote: repete só com os restantes
+                    session.abort_transaction()
+                    return [item for position, item in enumerate(pendentes) if position not in falhados]
+                matched = e.details.get('nMatched', 0)
+            
+            atualizados = [produto['id'] for position, (_, produto) in enumerate(pendentes) if position not in falhados]
+            if matched < len(atualizados):
+                # Sem transacção um produto pode ter sido removido depois da consulta
+                removidos = set(atualizados) - {doc['id'] for doc in collection.find({'id': {'$in': atualizados}}, {'_id': 0, 'id': 1})}
+                for index, produto in pendentes:
+                    if produto['id'] in removidos:
+                        registar_falha(resumo, index, produto['id'], 'nao_encontrado', "Produto com ID não encontrado.")
+                atualizados = [produto_id for produto_id in atualizados if produto_id not in removidos]
+            if atualizados:
+                notification = build_event('bulk_update', count=len(atualizados), produto_ids=atualizados, user_id=user_id)
+                record_event(db, notification, session=session)
+            resumo.atualizados += len(atualizados)
+        
+        if atualizados:
+            bump_version(db)
+        return []
 
 def serve():
     """Inicia o servidor gRPC e configura o serviço de produtos"""
-    # Cria servidor gRPC com pool de threads para concorrência
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    # Compila os schemas de validação e garante os índices, antes de aceitar pedidos
+    load_schemas()
+    ensure_indexes(db)
+    
+    # Cria servidor gRPC com pool de threads para concorrência e fila limitada
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=GRPC_MAX_WORKERS),
+        interceptors=[AdmissionInterceptor(admission)],
+        maximum_concurrent_rpcs=GRPC_MAX_WORKERS + ADMISSION_MAX_QUEUE
+    )
     
     # Regista o serviço de produtos no servidor
     produtos_pb2_grpc.add_ProdutoServiceServicer_to_server(ProdutoService(), server)
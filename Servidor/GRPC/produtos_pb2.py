@@ -24,7 +24,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0eprodutos.proto\"A\n\x07Produto\x12\n\n\x02id\x18\x01 \x01(\x05\x12\x0c\n\x04name\x18\x02 \x01(\t\x12\r\n\x05price\x18\x03 \x01(\x02\x12\r\n\x05stock\x18\x04 \x01(\x05\"\x1c\n\x08Resposta\x12\x10\n\x08mensagem\x18\x01 \x01(\t26\n\x0eProdutoService\x12$\n\rUpdateProduto\x12\x08.Produto\x1a\t.Respostab\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0eprodutos.proto\"A\n\x07Produto\x12\n\n\x02id\x18\x01 \x01(\x05\x12\x0c\n\x04name\x18\x02 \x01(\t\x12\r\n\x05price\x18\x03 \x01(\x02\x12\r\n\x05stock\x18\x04 \x01(\x05\"\x1c\n\x08Resposta\x12\x10\n\x08mensagem\x18\x01 \x01(\t\"M\n\x0f\x46\x61lhaBulkUpdate\x12\r\n\x05index\x18\x01 \x01(\r\x12\n\n\x02id\x18\x02 \x01(\x05\x12\x0e\n\x06motivo\x18\x03 \x01(\t\x12\x0f\n\x07\x64\x65talhe\x18\x04 \x01(\t\"\x9a\x01\n\x10ResumoBulkUpdate\x12\x11\n\trecebidos\x18\x01 \x01(\r\x12\x13\n\x0b\x61tualizados\x18\x02 \x01(\r\x12\x10\n\x08\x66\x61lhados\x18\x03 \x01(\r\x12 \n\x06\x66\x61lhas\x18\x04 \x03(\x0b\x32\x10.FalhaBulkUpdate\x12\x10\n\x08mensagem\x18\x05 \x01(\t\x12\x18\n\x10\x66\x61lhas_truncadas\x18\x06 \x01(\x08\"\xe3\x01\n\x0cProductEvent\x12\x0f\n\x07version\x18\x01 \x01(\r\x12\x0e\n\x06\x61\x63tion\x18\x02 \x01(\t\x12\x17\n\nproduto_id\x18\x03 \x01(\x05H\x00\x88\x01\x01\x12\x19\n\x07produto\x18\x04 \x01(\x0b\x32\x08.Produto\x12\x0f\n\x07user_id\x18\x05 \x01(\t\x12\x11\n\ttimestamp\x18\x06 \x01(\t\x12\x12\n\x05\x63ount\x18\x07 \x01(\x05H\x01\x88\x01\x01\x12\x10\n\x03seq\x18\x08 \x01(\x04H\x02\x88\x01\x01\x12\x13\n\x0bproduto_ids\x18\t \x03(\x05\x42\r\n\x0b_produto_idB\x08\n\x06_countB\x06\n\x04_seq2k\n\x0eProdutoService\x12$\n\rUpdateProduto\x12\x08.Produto\x1a\t.Resposta\x12\x33\n\x12\x42ulkUpdateProdutos\x12\x08.Produto\x1a\x11.ResumoBulkUpdate(\x01\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -35,6 +35,12 @@ if not _descriptor._USE_C_DESCRIPTORS:
   _globals['_PRODUTO']._serialized_end=83
   _globals['_RESPOSTA']._serialized_start=85
   _globals['_RESPOSTA']._serialized_end=113
-  _globals['_PRODUTOSERVICE']._serialized_start=115
-  _globals['_PRODUTOSERVICE']._serialized_end=169
+  _globals['_FALHABULKUPDATE']._serialized_start=115
+  _globals['_FALHABULKUPDATE']._serialized_end=192
+  _globals['_RESUMOBULKUPDATE']._serialized_start=195
+  _globals['_RESUMOBULKUPDATE']._serialized_end=349
+  _globals['_PRODUCTEVENT']._serialized_start=352
+  _globals['_PRODUCTEVENT']._serialized_end=579
+  _globals['_PRODUTOSERVICE']._serialized_start=581
+  _globals['_PRODUTOSERVICE']._serialized_end=688
 # @@protoc_insertion_point(module_scope)
@@ -39,6 +39,11 @@ class ProdutoServiceStub(object):
                 request_serializer=produtos__pb2.Produto.SerializeToString,
                 response_deserializer=produtos__pb2.Resposta.FromString,
                 _registered_method=True)
+        self.BulkUpdateProdutos = channel.stream_unary(
+                '/ProdutoService/BulkUpdateProdutos',
+                request_serializer=produtos__pb2.Produto.SerializeToString,
+                response_deserializer=produtos__pb2.ResumoBulkUpdate.FromString,
+                _registered_method=True)
 
 
 class ProdutoServiceServicer(object):
@@ -50,6 +55,13 @@ class ProdutoServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def BulkUpdateProdutos(self, request_iterator, context):
+        """Actualização em massa: o cliente envia os produtos em stream e recebe um resumo no fim
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_ProdutoServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -58,6 +70,11 @@ def add_ProdutoServiceServicer_to_server(servicer, server):
                     request_deserializer=produtos__pb2.Produto.FromString,
                     response_serializer=produtos__pb2.Resposta.SerializeToString,
             ),
+            'BulkUpdateProdutos': grpc.stream_unary_rpc_method_handler(
+                    servicer.BulkUpdateProdutos,
+                    request_deserializer=produtos__pb2.Produto.FromString,
+                    response_serializer=produtos__pb2.ResumoBulkUpdate.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'ProdutoService', rpc_method_handlers)
@@ -95,3 +112,30 @@ class ProdutoService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def BulkUpdateProdutos(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(
+            request_iterator,
+            target,
+            '/ProdutoService/BulkUpdateProdutos',
+            produtos__pb2.Produto.SerializeToString,
+            produtos__pb2.ResumoBulkUpdate.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
@@ -1,40 +1,22 @@
 import strawberry
 import uvicorn
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from strawberry.fastapi import GraphQLRouter
 from pymongo import MongoClient
-from bson import ObjectId
-import json
-import pika
+from common.admission import AsyncAdmissionController, ASGIAdmissionMiddleware
+from common.compression import ASGICompressionMiddleware
+from common.events import build_event
+from common.indexes import ensure_indexes
+from common.mongo_outbox import outbox_session, record_event, pending_event_count
+from common.serialization import dumps_bytes
+from common.versioning import bump_version, pending_version_bumps
 
 # Ligação à base de dados MongoDB
 client = MongoClient('mongodb://mongodb:27017/')
 db = client['produtos_db']
 collection = db['produtos']
-
-def send_rabbitmq_notification(message):
-    """Envia notificação para o RabbitMQ após operação de eliminação"""
-    try:
-        # Configura credenciais de autenticação para RabbitMQ
-        credentials = pika.PlainCredentials('admin', 'admin')
-        connection = pika.BlockingConnection(
-            pika.ConnectionParameters('rabbitmq', credentials=credentials)
-        )
-        channel = connection.channel()
-        
-        # Declara fila durável para actualizações de produtos
-        channel.queue_declare(queue='product_updates', durable=True)
-        
-        # Publica mensagem na fila com persistência
-        channel.basic_publish(
-            exchange='',
-            routing_key='product_updates',
-            body=json.dumps(message),
-            properties=pika.BasicProperties(delivery_mode=2)  # Torna a mensagem persistente
-        )
-        connection.close()
-    except Exception as e:
-        print(f"Error sending RabbitMQ notification: {e}")
+ensure_indexes(db)  # Índice único em id: delete_one deixa de percorrer a colecção
 
 @strawberry.type
 class Query:
@@ -56,41 +38,53 @@ class Mutation:
         Returns:
             str: Mensagem de confirmação ou erro
         """
-        # Tenta eliminar produto do MongoDB pelo ID fornecido
-        result = collection.delete_one({'id': id})
-        
-        # Verifica se algum documento foi eliminado
-        if result.deleted_count == 0:
-            return f"Produto com ID {id} não encontrado."
-        
-        # Prepara notificação para enviar ao sistema de mensagens
-        notification = {
-            'action': 'delete',
-            'produto_id': id,
-            'timestamp': str(ObjectId())  # Timestamp baseado em ObjectId do MongoDB
-        }
-        
-        # Envia notificação assíncrona via RabbitMQ
-        send_rabbitmq_notification(notification)
+        with outbox_session(client) as session:
+            # Tenta eliminar produto do MongoDB pelo ID fornecido
+            result = collection.delete_one({'id': id}, session=session)
+            
+            # Verifica se algum documento foi eliminado
+            if result.deleted_count == 0:
+                return f"Produto com ID {id} não encontrado."
+            
+            # Prepara notificação para enviar ao sistema de mensagens
+            notification = build_event('delete', produto_id=id)
+            
+            # Regista notificação na outbox (publicada no RabbitMQ pelo relay)
+            record_event(db, notification, session=session)
         
+        bump_version(db)
         return f"Produto com ID {id} removido com sucesso."
 
 # Cria schema GraphQL com queries e mutations definidas
 schema = strawberry.Schema(query=Query, mutation=Mutation)
 
+class FastGraphQLRouter(GraphQLRouter):
+    """Router GraphQL que serializa as respostas com o serializador partilhado (orjson quando disponível)"""
+
+    def encode_json(self, data):
+        return dumps_bytes(data)
+
 # Configura router GraphQL para integração com FastAPI
-graphql_app = GraphQLRouter(schema)
+graphql_app = FastGraphQLRouter(schema)
 
-# Inicializa aplicação FastAPI
+# Inicializa aplicação FastAPI (respostas acima de COMPRESSION_MIN_SIZE comprimidas)
 app = FastAPI()
+app.add_middleware(ASGICompressionMiddleware)
+# Controlo de admissão: o excesso de pedidos recebe 429 em vez de se acumular em fila
+admission = AsyncAdmissionController('graphql')
+app.add_middleware(ASGIAdmissionMiddleware, controller=admission, exempt_paths=('/',))
 
 # Integra router GraphQL no endpoint /graphql
 app.include_router(graphql_app, prefix="/graphql")
 
 @app.get("/")
 def health_check():
-    """Endpoint de verificação de estado do serviço"""
-    return {"status": "GraphQL service is running", "port": 8004}
+    """Endpoint de verificação de estado do serviço (503 com incrementos de versão por aplicar)"""
+    version_bumps = pending_version_bumps()
+    return JSONResponse({"status": "GraphQL service is degraded" if version_bumps else "GraphQL service is running",
+                         "port": 8004, "pending_events": pending_event_count(db),
+                         "pending_version_bumps": version_bumps, "admission": admission.stats()},
+                        status_code=503 if version_bumps else 200)
 
 if __name__ == "__main__":
     print("GraphQL server online em http://localhost:8004/graphql")
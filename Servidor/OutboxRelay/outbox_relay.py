@@ -0,0 +1,132 @@
+import logging
+import os
+import time
+from datetime import datetime
+
+from pymongo import MongoClient, ASCENDING, ReturnDocument, UpdateOne
+from common.indexes import ensure_indexes as ensure_shared_indexes
+from common.mongo_outbox import OUTBOX_COLLECTION
+from common.rabbitmq_publisher import get_publisher
+
+# Configuração de logging para monitorização do relay
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Configuração do relay (sobreponível por variáveis de ambiente)
+RELAY_BATCH_SIZE = int(os.getenv('RELAY_BATCH_SIZE', '500'))
+RELAY_POLL_INTERVAL = float(os.getenv('RELAY_POLL_INTERVAL', '0.2'))
+RELAY_SENT_TTL = int(os.getenv('RELAY_SENT_TTL', str(7 * 24 * 3600)))  # Retenção dos eventos enviados
+
+# Ligação à base de dados MongoDB
+client = MongoClient('mongodb://mongodb:27017/')
+db = client['produtos_db']
+outbox = db[OUTBOX_COLLECTION]
+counters = db['counters']
+
+
+def ensure_indexes():
+    """Cria os índices usados pelo relay (idempotente)"""
+    # Inclui o índice (status, _id) que suporta a pesquisa de pendentes por ordem de inserção
+    ensure_shared_indexes(db)
+    # Remove automaticamente eventos já enviados após o período de retenção
+    outbox.create_index('sent_at', expireAfterSeconds=RELAY_SENT_TTL)
+    # Pendentes que já receberam sequência (publicação falhada), retomados por ordem de seq
+    outbox.create_index([('status', ASCENDING), ('seq', ASCENDING)])
+
+
+def assign_sequence(docs):
+    """
+    Atribui números de sequência consecutivos aos eventos que ainda não têm
+
+    A sequência é reservada em bloco num contador do MongoDB e gravada no
+    documento antes da publicação, pelo que um reenvio mantém o mesmo número.
+    Os números novos são sempre maiores do que os já atribuídos, e por isso
+    só podem ser publicados depois deles (ver pending_batch). Pressupõe um
+    único relay activo.
+    """
+    missing = [doc for doc in docs if 'seq' not in doc]
+    if not missing:
+        return
+    counter = counters.find_one_and_update(
+        {'_id': 'product_events'},
+        {'$inc': {'seq': len(missing)}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    first_seq = counter['seq'] - len(missing) + 1
+    operations = []
+    for offset, doc in enumerate(missing):
+        doc['seq'] = first_seq + offset
+        operations.append(UpdateOne({'_id': doc['_id']}, {'$set': {'seq': doc['seq']}}))
+    outbox.bulk_write(operations, ordered=False)
+
+
+def pending_batch():
+    """
+    Lote de eventos pendentes pela ordem em que têm de ser publicados
+
+    Primeiro os que já têm sequência (de uma publicação que falhou), por
+    ordem de seq, e só depois os restantes por ordem de _id. Uma transacção
+    confirmada tarde pode ter um _id menor do que eventos já sequenciados;
+    se fosse publicada antes deles, o seq maior faria o change feed do
+    gateway descartar os seguintes como duplicados.
+    """
+    projection = {'message': 1, 'seq': 1}
+    docs = list(outbox.find({'status': 'pending', 'seq': {'$exists': True}}, projection)
+                .sort('seq', ASCENDING)
+                .limit(RELAY_BATCH_SIZE))
+    if len(docs) < RELAY_BATCH_SIZE:
+        docs += list(outbox.find({'status': 'pending', 'seq': {'$exists': False}}, projection)
+                     .sort('_id', ASCENDING)
+                     .limit(RELAY_BATCH_SIZE - len(docs)))
+    return docs
+
+
+def relay_batch(publisher):
+    """
+    Publica um lote de eventos pendentes e marca-os como enviados
+
+    A marcação só acontece depois de o broker confirmar o lote; se o relay
+    falhar entre as duas operações o lote é reenviado (at-least-once).
+
+    Returns:
+        int: Número de eventos publicados
+    """
+    docs = pending_batch()
+    if not docs:
+        return 0
+
+    assign_sequence(docs)
+    publisher.publish_batch([dict(doc['message'], seq=doc['seq']) for doc in docs])
+    outbox.update_many(
+        {'_id': {'$in': [doc['_id'] for doc in docs]}},
+        {'$set': {'status': 'sent', 'sent_at': datetime.utcnow()}}
+    )
+    return len(docs)
+
+
+def run_relay():
+    """Ciclo principal: acompanha a outbox e publica os eventos em lotes"""
+    ensure_indexes()
+    publisher = get_publisher()
+    retry_count = 0
+    logger.info('Outbox relay started, waiting for events...')
+
+    while True:
+        try:
+            sent = relay_batch(publisher)
+            retry_count = 0
+            if sent:
+                logger.info(f"Relayed {sent} events to RabbitMQ")
+            # Lote incompleto significa que a outbox foi esvaziada: espera por novos eventos
+            if sent < RELAY_BATCH_SIZE:
+                time.sleep(RELAY_POLL_INTERVAL)
+        except Exception as e:
+            retry_count += 1
+            wait_time = min(30, retry_count * 2)
+            logger.error(f"Outbox relay error (attempt {retry_count}): {str(e)}. Retrying in {wait_time} seconds...")
+            time.sleep(wait_time)
+
+
+if __name__ == '__main__':
+    run_relay()
@@ -1,79 +1,294 @@
+from functools import wraps
 from flask import Flask, request, jsonify
-import json
-import os
-from jsonschema import validate, ValidationError
-from pymongo import MongoClient
+from flask.json.provider import JSONProvider
+from pymongo import MongoClient, ASCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from bson import ObjectId
-import pika
+from common.admission import AdmissionController, WSGIAdmissionMiddleware
+from common.compression import WSGICompressionMiddleware
+from common.idempotency import (
+    IDEMPOTENCY_HEADER, HashingReader, IdempotencyKeyReused, InvalidIdempotencyKey, RequestInProgress,
+    claim, release, request_hasher, store_or_release, verify_fingerprint
+)
+from common.indexes import ensure_indexes
+from common.mongo_outbox import outbox_session, record_event, pending_event_count
+from common.serialization import dumps, loads
+from common.versioning import VersaoIndisponivel, bump_version, current_version, pending_version_bumps
+from common.validation import load_schemas, validate_produto, ProdutoInvalido
+from produtos_api import (
+    BULK_CHUNK_SIZE, NDJSON_MIMETYPES, notificacao_create, resposta_create, ler_linha_ndjson,
+    ler_array_json, novo_resultado, rejeitar, validar_lote, filtro_existentes, retirar_duplicados,
+    registar_falhas, notificacao_lote, concluir_resultado, ler_pagina, ler_projecao, filtro_pagina,
+    corpo_pagina, ler_id_produto, etag_versao, etag_corresponde
+)
+
+class FastJSONProvider(JSONProvider):
+    """jsonify e request.json com o serializador partilhado (orjson quando disponível)"""
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return loads(s)
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
+# Respostas acima de COMPRESSION_MIN_SIZE comprimidas com gzip/brotli, conforme o Accept-Encoding
+# Acima de ADMISSION_MAX_CONCURRENCY pedidos em curso o excesso espera pouco e recebe 429
+admission = AdmissionController('rest')
+app.wsgi_app = WSGIAdmissionMiddleware(WSGICompressionMiddleware(app.wsgi_app), admission, exempt_paths=('/',))
 
 # MongoDB connection
 client = MongoClient('mongodb://mongodb:27017/')
 db = client['produtos_db']
 collection = db['produtos']
+# Índice único em id: a inserção falha com DuplicateKeyError em vez de uma verificação prévia
+ensure_indexes(db)
 
-SCHEMA_FILE = os.path.join(os.path.dirname(__file__), 'schema.json')
-
-def carregar_schema():
-    """Carrega o schema JSON para validação."""
-    with open(SCHEMA_FILE, 'r') as f:
-        return json.load(f)
-
-def send_rabbitmq_notification(message):
-    """Send notification to RabbitMQ"""
-    try:
-        credentials = pika.PlainCredentials('admin', 'admin')
-        connection = pika.BlockingConnection(
-            pika.ConnectionParameters('rabbitmq', credentials=credentials)
-        )
-        channel = connection.channel()
-        channel.queue_declare(queue='product_updates', durable=True)
-        channel.basic_publish(
-            exchange='',
-            routing_key='product_updates',
-            body=json.dumps(message),
-            properties=pika.BasicProperties(delivery_mode=2)
-        )
-        connection.close()
-    except Exception as e:
-        print(f"Error sending RabbitMQ notification: {e}")
+# Schemas compilados uma vez no arranque (partilhados com SOAP e gRPC)
+load_schemas()
 
 @app.route('/', methods=['GET'])
 def health_check():
-    """Health check endpoint."""
-    return jsonify({'status': 'REST service is running', 'port': 8001})
+    """Health check endpoint (503 enquanto houver incrementos de versão por aplicar)."""
+    version_bumps = pending_version_bumps()
+    return jsonify({'status': 'REST service is degraded' if version_bumps else 'REST service is running',
+                    'port': 8001, 'pending_events': pending_event_count(db),
+                    'pending_version_bumps': version_bumps, 'admission': admission.stats()}), 503 if version_bumps else 200
+
+def idempotente(view):
+    """
+    Torna a rota idempotente quando o cliente envia o cabeçalho Idempotency-Key
+
+    A primeira execução guarda a resposta; pedidos repetidos com a mesma chave
+    recebem essa resposta sem repetir a escrita nem a notificação. A chave fica
+    associada ao hash do corpo, calculado à medida que a rota o lê (o NDJSON
+    continua a ser lido em streaming); uma repetição com outro corpo recebe 422.
+    Erros 5xx libertam a chave para que a repetição volte a executar o pedido.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return view(*args, **kwargs)
+
+        scope = f'rest:{request.path}'
+        hasher = request_hasher(scope)
+        corpo = HashingReader(request.stream, hasher)
+        request.stream = corpo  # A rota lê o corpo através do hash
+        try:
+            guardada = claim(db, scope, key)
+        except InvalidIdempotencyKey as e:
+            return jsonify({'erro': str(e)}), 400
+        except RequestInProgress:
+            return jsonify({'erro': 'Pedido com a mesma Idempotency-Key em curso'}), 409
+        if guardada is not None:
+            corpo.drain()
+            try:
+                verify_fingerprint(guardada, hasher.hexdigest())
+            except IdempotencyKeyReused:
+                return jsonify({'erro': 'Idempotency-Key ja usada num pedido diferente'}), 422
+            response = jsonify(guardada['body'])
+            response.status_code = guardada['status_code']
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = app.make_response(view(*args, **kwargs))
+            corpo.drain()
+        except Exception:
+            release(db, scope, key)
+            raise
+        if response.status_code >= 500:
+            release(db, scope, key)
+        else:
+            store_or_release(db, scope, key, response.status_code, response.get_json(), hasher.hexdigest())
+        return response
+    return wrapper
 
 @app.route('/create', methods=['POST'])
+@idempotente
 def create_produto():
     """Cria um novo produto no MongoDB."""
     try:
         produto = request.json
         
         # Validar o produto contra o schema
-        schema = carregar_schema()
-        validate(instance=produto, schema=schema)
+        validate_produto(produto)
         
-        # Verificar se já existe produto com mesmo ID
-        if collection.find_one({'id': produto['id']}):
-            return jsonify({'erro': 'ID ja existente'}), 400
-
-        # Inserir produto no MongoDB
-        result = collection.insert_one(produto)
+        with outbox_session(client) as session:
+            # Inserir produto no MongoDB
+            result = collection.insert_one(produto, session=session)
+            
+            # Record RabbitMQ notification in the outbox (published by the relay)
+            # Only the schema fields: insert_one also added the ObjectId '_id' to produto
+            record_event(db, notificacao_create(produto), session=session)
         
-        # Send RabbitMQ notification
-        notification = {
-            'action': 'create',
-            'produto': produto,
-            'timestamp': str(result.inserted_id)
-        }
-        send_rabbitmq_notification(notification)
-        
-        return jsonify({'mensagem': f"Produto {produto['name']} criado com sucesso!", 'mongodb_id': str(result.inserted_id)})
-    except ValidationError as e:
+        bump_version(db)
+        return jsonify(resposta_create(produto, result.inserted_id))
+    except ProdutoInvalido as e:
         return jsonify({'erro': f'Dados invalidos: {e.message}'}), 400
+    except DuplicateKeyError:
+        # O índice único em id garante a unicidade mesmo com pedidos concorrentes
+        return jsonify({'erro': 'ID ja existente'}), 400
     except Exception as e:
         return jsonify({'erro': str(e)}), 500
 
+def ler_itens_bulk():
+    """
+    Gera pares (produto, erro) a partir do corpo do pedido
+
+    Aceita um array JSON ou NDJSON (um produto por linha); o NDJSON é lido
+    linha a linha do stream, sem carregar o corpo inteiro em memória.
+    """
+    if request.mimetype in NDJSON_MIMETYPES:
+        for line in request.stream:
+            item = ler_linha_ndjson(line)
+            if item is not None:
+                yield item
+        return
+
+    yield from ler_array_json(request.get_json(silent=True))
+
+def inserir_lote(lote, resultado):
+    """
+    Valida e insere um lote de produtos, acumulando os resultados por item
+
+    Os duplicados (já existentes ou repetidos no lote) são retirados com uma
+    consulta ao índice único em id antes de inserir, e os restantes produtos
+    são inseridos com um único insert_many não ordenado. É registada uma
+    única notificação agregada por lote.
+    """
+    pendentes = validar_lote(lote, resultado)
+    while pendentes:
+        try:
+            pendentes = inserir_pendentes(pendentes, resultado)
+        except Exception as e:
+            for index, produto in pendentes:
+                rejeitar(resultado, index, produto, 'rejeitados', str(e))
+            return
+
+def inserir_pendentes(pendentes, resultado):
+    """
+    Insere os produtos e regista a notificação do lote
+
+    Returns:
+        list: Produtos a inserir de novo; só não é vazia quando uma transacção
+            (MONGO_TRANSACTIONS=1) foi abortada por um erro de escrita (ex.: id
+            inserido por um pedido concorrente depois da consulta), cujo
+            produto é retirado antes da nova tentativa
+    """
+    with outbox_session(client) as session:
+        filtro, projecao = filtro_existentes(pendentes)
+        existentes = [doc['id'] for doc in collection.find(filtro, projecao, session=session)]
+        # Na própria lista: se a inserção falhar, os duplicados já registados não são contados de novo
+        pendentes[:] = retirar_duplicados(pendentes, existentes, resultado)
+        if not pendentes:
+            return []
+        falhados = set()
+        try:
+            collection.insert_many([produto for _, produto in pendentes], ordered=False, session=session)
+        except BulkWriteError as e:
+            falhados = registar_falhas(e, pendentes, resultado)
+            if session is not None:
+                # Numa transacção o erro anula todo o lote: repete só com os restantes
+                session.abort_transaction()
+                return [item for position, item in enumerate(pendentes) if position not in falhados]
+
+        inseridos = [produto['id'] for position, (_, produto) in enumerate(pendentes) if position not in falhados]
+        if inseridos:
+            record_event(db, notificacao_lote(inseridos), session=session)
+        resultado['inseridos'] += len(inseridos)
+    if inseridos:
+        bump_version(db)
+    return []
+
+@app.route('/create/bulk', methods=['POST'])
+@idempotente
+def create_produtos_bulk():
+    """Cria vários produtos a partir de um array JSON ou de NDJSON, em lotes."""
+    resultado = novo_resultado()
+    try:
+        lote = []
+        for index, (produto, erro) in enumerate(ler_itens_bulk()):
+            resultado['recebidos'] += 1
+            lote.append((index, produto, erro))
+            if len(lote) >= BULK_CHUNK_SIZE:
+                inserir_lote(lote, resultado)
+                lote = []
+        if lote:
+            inserir_lote(lote, resultado)
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    except Exception as e:
+        return jsonify({'erro': str(e), **resultado}), 500
+
+    return jsonify(concluir_resultado(resultado))
+
+def resposta_condicional(gerar):
+    """
+    Responde com ETag derivado da versão da colecção
+
+    Se o cliente enviar If-None-Match com a versão actual devolve 304 sem
+    consultar os produtos. A versão é lida antes dos dados, pelo que uma
+    escrita concorrente nunca fica escondida atrás de um ETag antigo. O 304
+    repete a etiqueta enviada pelo cliente, que pode ter o sufixo da
+    codificação da representação que tem em cache.
+    """
+    try:
+        etag = etag_versao(current_version(db))
+    except VersaoIndisponivel as e:
+        # Sem a versão correcta um 304 esconderia as últimas escritas
+        return jsonify({'erro': str(e)}), 503
+    correspondente = etag_corresponde(request.headers.get('If-None-Match'), etag)
+    if correspondente:
+        response = app.response_class(status=304)
+        response.headers['ETag'] = correspondente
+    else:
+        corpo = gerar()
+        if isinstance(corpo, tuple):
+            # Erros (ex.: 404) não são condicionais
+            return corpo
+        response = jsonify(corpo)
+        response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/produtos', methods=['GET'])
+def listar_produtos():
+    """Lista produtos por ordem de id, com paginação keyset (after, limit) e projecção (fields)."""
+    try:
+        after, limit = ler_pagina(request.args)
+        projecao = ler_projecao(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+
+    def gerar():
+        # Usa o índice único em id: cada página custa o mesmo, qualquer que seja a posição
+        produtos = list(collection.find(filtro_pagina(after), projecao).sort('id', ASCENDING).limit(limit))
+        return corpo_pagina(produtos, limit)
+
+    return resposta_condicional(gerar)
+
+@app.route('/produtos/<produto_id>', methods=['GET'])
+def obter_produto(produto_id):
+    """Devolve um produto pelo id."""
+    # Id não numérico: o mesmo 404 de um id inexistente, nas duas variantes
+    produto_id = ler_id_produto(produto_id)
+    if produto_id is None:
+        return jsonify({'erro': 'Produto nao encontrado'}), 404
+    try:
+        projecao = ler_projecao(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+
+    def gerar():
+        produto = collection.find_one({'id': produto_id}, projecao)
+        if produto is None:
+            return jsonify({'erro': 'Produto nao encontrado'}), 404
+        return produto
+
+    return resposta_condicional(gerar)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8001)
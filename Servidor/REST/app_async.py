@@ -0,0 +1,311 @@
+"""
+Variante assíncrona da API REST (ASGI)
+
+Mesmas rotas e respostas que app.py, mas com FastAPI sobre uvicorn e o
+driver assíncrono do MongoDB (AsyncMongoClient): um pedido à espera da base
+de dados não ocupa uma thread, pelo que a concorrência cresce com o número
+de ligações. Corre REST_WORKERS processos, cada um com o seu event loop.
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from functools import wraps
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from pymongo import AsyncMongoClient, MongoClient, ASCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from common.admission import AsyncAdmissionController, ASGIAdmissionMiddleware
+from common.compression import ASGICompressionMiddleware
+from common.idempotency import (
+    IDEMPOTENCY_HEADER, HashingReceive, IdempotencyKeyReused, InvalidIdempotencyKey, RequestInProgress,
+    claim_async, release_async, request_hasher, store_or_release_async, verify_fingerprint
+)
+from common.indexes import ensure_indexes
+from common.mongo_outbox import outbox_session_async, record_event_async, pending_event_count_async
+from common.serialization import dumps_bytes, loads
+from common.versioning import VersaoIndisponivel, bump_version_async, current_version_async, pending_version_bumps
+from common.validation import load_schemas, validate_produto, ProdutoInvalido
+from produtos_api import (
+    BULK_CHUNK_SIZE, NDJSON_MIMETYPES, notificacao_create, resposta_create, ler_linha_ndjson,
+    ler_array_json, novo_resultado, rejeitar, validar_lote, filtro_existentes, retirar_duplicados,
+    registar_falhas, notificacao_lote, concluir_resultado, ler_pagina, ler_projecao, filtro_pagina,
+    corpo_pagina, ler_id_produto, etag_versao, etag_corresponde
+)
+
+MONGO_URI = 'mongodb://mongodb:27017/'
+REST_WORKERS = int(os.getenv('REST_WORKERS', '4'))  # Processos uvicorn
+
+# MongoDB connection (assíncrona)
+client = AsyncMongoClient(MONGO_URI)
+db = client['produtos_db']
+collection = db['produtos']
+
+
+def criar_indices():
+    """Índices criados com o driver síncrono (uma vez no arranque, fora do event loop)"""
+    sync_client = MongoClient(MONGO_URI)
+    try:
+        ensure_indexes(sync_client['produtos_db'])
+    finally:
+        sync_client.close()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await asyncio.to_thread(criar_indices)
+    # Schemas compilados uma vez no arranque (partilhados com SOAP e gRPC)
+    load_schemas()
+    yield
+    await client.close()
+
+
+class FastJSONResponse(JSONResponse):
+    """Resposta JSON com o serializador partilhado (orjson quando disponível)"""
+
+    def render(self, content):
+        return dumps_bytes(content)
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+# Respostas acima de COMPRESSION_MIN_SIZE comprimidas com gzip/brotli, conforme o Accept-Encoding
+app.add_middleware(ASGICompressionMiddleware)
+# Controlo de admissão por processo: o excesso de pedidos recebe 429 em vez de esperar
+admission = AsyncAdmissionController('rest')
+app.add_middleware(ASGIAdmissionMiddleware, controller=admission, exempt_paths=('/',))
+
+
+def erro(mensagem, status_code, **extra):
+    return FastJSONResponse({'erro': mensagem, **extra}, status_code=status_code)
+
+
+@app.get('/')
+async def health_check():
+    """Health check endpoint (503 enquanto houver incrementos de versão por aplicar)."""
+    version_bumps = pending_version_bumps()
+    return FastJSONResponse({'status': 'REST service is degraded' if version_bumps else 'REST service is running',
+                         'port': 8001, 'pending_events': await pending_event_count_async(db),
+                         'pending_version_bumps': version_bumps, 'admission': admission.stats()},
+                        status_code=503 if version_bumps else 200)
+
+
+def idempotente(view):
+    """Respostas guardadas por Idempotency-Key (ver app.py)"""
+    @wraps(view)
+    async def wrapper(request: Request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return await view(request, *args, **kwargs)
+
+        scope = f'rest:{request.url.path}'
+        hasher = request_hasher(scope)
+        receive = HashingReceive(request.receive, hasher)
+        # A rota lê o corpo através do hash (o NDJSON continua a ser lido em streaming)
+        request = Request(request.scope, receive)
+        try:
+            guardada = await claim_async(db, scope, key)
+        except InvalidIdempotencyKey as e:
+            return erro(str(e), 400)
+        except RequestInProgress:
+            return erro('Pedido com a mesma Idempotency-Key em curso', 409)
+        if guardada is not None:
+            await receive.drain()
+            try:
+                verify_fingerprint(guardada, hasher.hexdigest())
+            except IdempotencyKeyReused:
+                return erro('Idempotency-Key ja usada num pedido diferente', 422)
+            return FastJSONResponse(guardada['body'], status_code=guardada['status_code'],
+                                    headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            response = await view(request, *args, **kwargs)
+            await receive.drain()
+        except Exception:
+            await release_async(db, scope, key)
+            raise
+        if response.status_code >= 500:
+            await release_async(db, scope, key)
+        else:
+            await store_or_release_async(db, scope, key, response.status_code, loads(response.body), hasher.hexdigest())
+        return response
+    return wrapper
+
+
+@app.post('/create')
+@idempotente
+async def create_produto(request: Request):
+    """Cria um novo produto no MongoDB."""
+    try:
+        produto = loads(await request.body())
+
+        # Validar o produto contra o schema
+        validate_produto(produto)
+
+        async with outbox_session_async(client) as session:
+            result = await collection.insert_one(produto, session=session)
+            # Record RabbitMQ notification in the outbox (published by the relay)
+            await record_event_async(db, notificacao_create(produto), session=session)
+
+        await bump_version_async(db)
+        return FastJSONResponse(resposta_create(produto, result.inserted_id))
+    except ProdutoInvalido as e:
+        return erro(f'Dados invalidos: {e.message}', 400)
+    except DuplicateKeyError:
+        # O índice único em id garante a unicidade mesmo com pedidos concorrentes
+        return erro('ID ja existente', 400)
+    except Exception as e:
+        return erro(str(e), 500)
+
+
+async def ler_itens_bulk(request):
+    """Gera pares (produto, erro) de um array JSON ou de NDJSON lido em streaming"""
+    mimetype = request.headers.get('content-type', '').split(';')[0].strip().lower()
+    if mimetype in NDJSON_MIMETYPES:
+        resto = b''
+        async for bloco in request.stream():
+            *linhas, resto = (resto + bloco).split(b'\n')
+            for line in linhas:
+                item = ler_linha_ndjson(line)
+                if item is not None:
+                    yield item
+        item = ler_linha_ndjson(resto)
+        if item is not None:
+            yield item
+        return
+
+    try:
+        produtos = loads(await request.body())
+    except ValueError:
+        produtos = None
+    for item in ler_array_json(produtos):
+        yield item
+
+
+async def inserir_lote(lote, resultado):
+    """Valida e insere um lote de produtos, acumulando os resultados por item (ver app.py)"""
+    pendentes = validar_lote(lote, resultado)
+    while pendentes:
+        try:
+            pendentes = await inserir_pendentes(pendentes, resultado)
+        except Exception as e:
+            for index, produto in pendentes:
+                rejeitar(resultado, index, produto, 'rejeitados', str(e))
+            return
+
+
+async def inserir_pendentes(pendentes, resultado):
+    """Insere os produtos e regista a notificação do lote; devolve os produtos a repetir"""
+    async with outbox_session_async(client) as session:
+        # Duplicados retirados antes de inserir: numa transacção cada erro de escrita anula o lote
+        filtro, projecao = filtro_existentes(pendentes)
+        existentes = [doc['id'] for doc in await collection.find(filtro, projecao, session=session).to_list()]
+        # Na própria lista: se a inserção falhar, os duplicados já registados não são contados de novo
+        pendentes[:] = retirar_duplicados(pendentes, existentes, resultado)
+        if not pendentes:
+            return []
+        falhados = set()
+        try:
+            await collection.insert_many([produto for _, produto in pendentes], ordered=False, session=session)
+        except BulkWriteError as e:
+            falhados = registar_falhas(e, pendentes, resultado)
+            if session is not None:
+                # Numa transacção o erro anula todo o lote: repete só com os restantes
+                await session.abort_transaction()
+                return [item for position, item in enumerate(pendentes) if position not in falhados]
+
+        inseridos = [produto['id'] for position, (_, produto) in enumerate(pendentes) if position not in falhados]
+        if inseridos:
+            await record_event_async(db, notificacao_lote(inseridos), session=session)
+        resultado['inseridos'] += len(inseridos)
+    if inseridos:
+        await bump_version_async(db)
+    return []
+
+
+@app.post('/create/bulk')
+@idempotente
+async def create_produtos_bulk(request: Request):
+    """Cria vários produtos a partir de um array JSON ou de NDJSON, em lotes."""
+    resultado = novo_resultado()
+    try:
+        lote = []
+        index = 0
+        async for produto, erro_leitura in ler_itens_bulk(request):
+            resultado['recebidos'] += 1
+            lote.append((index, produto, erro_leitura))
+            index += 1
+            if len(lote) >= BULK_CHUNK_SIZE:
+                await inserir_lote(lote, resultado)
+                lote = []
+        if lote:
+            await inserir_lote(lote, resultado)
+    except ValueError as e:
+        return erro(str(e), 400)
+    except Exception as e:
+        return erro(str(e), 500, **resultado)
+
+    return FastJSONResponse(concluir_resultado(resultado))
+
+
+async def resposta_condicional(request, gerar):
+    """Responde com ETag derivado da versão da colecção; 304 sem consultar os produtos"""
+    try:
+        etag = etag_versao(await current_version_async(db))
+    except VersaoIndisponivel as e:
+        # Sem a versão correcta um 304 esconderia as últimas escritas
+        return erro(str(e), 503)
+    correspondente = etag_corresponde(request.headers.get('if-none-match'), etag)
+    if correspondente:
+        response = Response(status_code=304, headers={'ETag': correspondente})
+    else:
+        corpo = await gerar()
+        if isinstance(corpo, Response):
+            # Erros (ex.: 404) não são condicionais
+            return corpo
+        response = FastJSONResponse(corpo)
+        response.headers['ETag'] = f'"{etag}"'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.get('/produtos')
+async def listar_produtos(request: Request):
+    """Lista produtos por ordem de id, com paginação keyset (after, limit) e projecção (fields)."""
+    try:
+        after, limit = ler_pagina(request.query_params)
+        projecao = ler_projecao(request.query_params.get('fields'))
+    except ValueError as e:
+        return erro(str(e), 400)
+
+    async def gerar():
+        cursor = collection.find(filtro_pagina(after), projecao).sort('id', ASCENDING).limit(limit)
+        return corpo_pagina(await cursor.to_list(), limit)
+
+    return await resposta_condicional(request, gerar)
+
+
+@app.get('/produtos/{produto_id}')
+async def obter_produto(produto_id: str, request: Request):
+    """Devolve um produto pelo id."""
+    # Id não numérico: o mesmo 404 de um id inexistente, nas duas variantes
+    produto_id = ler_id_produto(produto_id)
+    if produto_id is None:
+        return erro('Produto nao encontrado', 404)
+    try:
+        projecao = ler_projecao(request.query_params.get('fields'))
+    except ValueError as e:
+        return erro(str(e), 400)
+
+    async def gerar():
+        produto = await collection.find_one({'id': produto_id}, projecao)
+        if produto is None:
+            return erro('Produto nao encontrado', 404)
+        return produto
+
+    return await resposta_condicional(request, gerar)
+
+
+if __name__ == '__main__':
+    print(f"REST (ASGI) server online em http://localhost:8001 com {REST_WORKERS} workers")
+    uvicorn.run('app_async:app', host='0.0.0.0', port=8001, workers=REST_WORKERS)
@@ -0,0 +1,232 @@
+"""
+Lógica da API REST de produtos independente do framework
+
+Partilhada pela aplicação Flask (app.py) e pela variante ASGI (app_async.py),
+para que as duas tenham exactamente as mesmas rotas, validações e respostas.
+"""
+import os
+
+from common.compression import strip_encoding_suffix
+from common.events import build_event
+from common.serialization import loads
+from common.validation import validate_produtos
+
+# Importação em lote: produtos validados e inseridos por cada insert_many
+BULK_CHUNK_SIZE = int(os.getenv('BULK_CHUNK_SIZE', '1000'))
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+PRODUTO_FIELDS = ('id', 'name', 'price', 'stock')
+DUPLICATE_KEY_ERROR = 11000
+
+# Listagem paginada (keyset sobre id)
+PAGE_SIZE_DEFAULT = int(os.getenv('PAGE_SIZE_DEFAULT', '100'))
+PAGE_SIZE_MAX = int(os.getenv('PAGE_SIZE_MAX', '1000'))
+
+
+def notificacao_create(produto):
+    """Notificação de um produto criado (só os campos do schema, sem o _id do MongoDB)"""
+    return build_event(
+        'create',
+        produto_id=produto['id'],
+        produto={k: produto[k] for k in PRODUTO_FIELDS},
+        user_id=produto.get('user_id')
+    )
+
+
+def resposta_create(produto, inserted_id):
+    return {'mensagem': f"Produto {produto['name']} criado com sucesso!", 'mongodb_id': str(inserted_id)}
+
+
+def ler_linha_ndjson(line):
+    """Converte uma linha NDJSON no par (produto, erro); linhas vazias devolvem None"""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        return loads(line), None
+    except ValueError as e:
+        return None, f'JSON invalido: {e}'
+
+
+def ler_array_json(produtos):
+    """Gera pares (produto, erro) de um corpo JSON que tem de ser um array"""
+    if not isinstance(produtos, list):
+        raise ValueError('Esperado um array JSON ou NDJSON')
+    for produto in produtos:
+        yield produto, None
+
+
+def novo_resultado():
+    return {'recebidos': 0, 'inseridos': 0, 'rejeitados': 0, 'duplicados': 0, 'erros': []}
+
+
+def rejeitar(resultado, index, produto, motivo, detalhe):
+    """Regista um produto não inserido (motivo: rejeitados ou duplicados)"""
+    produto_id = produto.get('id') if isinstance(produto, dict) else None
+    resultado[motivo] += 1
+    resultado['erros'].append({'index': index, 'id': produto_id, 'motivo': motivo, 'detalhe': detalhe})
+
+
+def validar_lote(lote, resultado):
+    """
+    Valida um lote de triplos (index, produto, erro de leitura)
+
+    Returns:
+        list: Pares (index, produto) válidos, prontos a inserir
+    """
+    pendentes = []
+    erros_schema = iter(validate_produtos([produto for _, produto, erro in lote if erro is None]))
+    for index, produto, erro in lote:
+        if erro is None:
+            erro_schema = next(erros_schema)
+            erro = f'Dados invalidos: {erro_schema}' if erro_schema else None
+        if erro:
+            rejeitar(resultado, index, produto, 'rejeitados', erro)
+        else:
+            pendentes.append((index, produto))
+    return pendentes
+
+
+def filtro_existentes(pendentes):
+    """Consulta (projecção só do id) dos produtos do lote que já existem"""
+    return {'id': {'$in': [produto['id'] for _, produto in pendentes]}}, {'_id': 0, 'id': 1}
+
+
+def retirar_duplicados(pendentes, existentes, resultado):
+    """
+    Retira do lote os ids já existentes e os repetidos no próprio lote
+
+    Numa transacção o insert_many pára no primeiro erro de escrita; filtrar
+    os duplicados antes de inserir evita uma transacção abortada por cada um.
+
+    Returns:
+        list: Pares (index, produto) a inserir
+    """
+    vistos = set(existentes)
+    restantes = []
+    for index, produto in pendentes:
+        if produto['id'] in vistos:
+            rejeitar(resultado, index, produto, 'duplicados', 'ID ja existente')
+        else:
+            vistos.add(produto['id'])
+            restantes.append((index, produto))
+    return restantes
+
+
+def registar_falhas(bulk_error, pendentes, resultado):
+    """
+    Regista os produtos que o insert_many não inseriu (ex.: id duplicado)
+
+    Returns:
+        set: Posições em pendentes dos produtos falhados
+    """
+    write_errors = bulk_error.details.get('writeErrors', [])
+    if not write_errors:
+        raise bulk_error
+    falhados = set()
+    for write_error in write_errors:
+        index, produto = pendentes[write_error['index']]
+        falhados.add(write_error['index'])
+        if write_error.get('code') == DUPLICATE_KEY_ERROR:
+            rejeitar(resultado, index, produto, 'duplicados', 'ID ja existente')
+        else:
+            rejeitar(resultado, index, produto, 'rejeitados', write_error.get('errmsg'))
+    return falhados
+
+
+def notificacao_lote(inseridos):
+    """Uma notificação por lote em vez de uma por produto"""
+    return build_event('bulk_create', count=len(inseridos), produto_ids=inseridos)
+
+
+def concluir_resultado(resultado):
+    resultado['mensagem'] = f"{resultado['inseridos']} de {resultado['recebidos']} produtos criados"
+    return resultado
+
+
+def _int_ou(valor, omissao):
+    # Mesmo comportamento do request.args.get(type=int) do Flask: valor inválido usa a omissão
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return omissao
+
+
+def ler_pagina(args):
+    """
+    Lê os parâmetros after e limit da query string
+
+    Raises:
+        ValueError: Se limit não for positivo
+    """
+    after = _int_ou(args.get('after'), None)
+    limit = _int_ou(args.get('limit'), PAGE_SIZE_DEFAULT)
+    if limit < 1:
+        raise ValueError('limit deve ser positivo')
+    return after, min(limit, PAGE_SIZE_MAX)
+
+
+def ler_id_produto(valor):
+    """
+    Converte o id do caminho /produtos/<id> (só dígitos, como o conversor int do Flask)
+
+    Returns:
+        int: Id do produto, ou None se o valor não for um id (resposta 404)
+    """
+    return int(valor) if valor.isdecimal() else None
+
+
+def ler_projecao(fields):
+    """
+    Converte o parâmetro fields=name,price numa projecção MongoDB
+
+    O id é sempre incluído (é o cursor da paginação).
+
+    Raises:
+        ValueError: Se algum campo não existir no schema do produto
+    """
+    projecao = {'_id': 0}
+    if not fields:
+        return projecao
+    for field in fields.split(','):
+        field = field.strip()
+        if field not in PRODUTO_FIELDS:
+            raise ValueError(f'Campo desconhecido: {field}')
+        projecao[field] = 1
+    projecao['id'] = 1
+    return projecao
+
+
+def filtro_pagina(after):
+    return {'id': {'$gt': after}} if after is not None else {}
+
+
+def corpo_pagina(produtos, limit):
+    next_after = produtos[-1]['id'] if len(produtos) == limit else None
+    return {'produtos': produtos, 'next_after': next_after}
+
+
+def etag_versao(version):
+    """ETag derivado da versão da colecção de produtos"""
+    return f"v{version}"
+
+
+def etag_corresponde(if_none_match, etag):
+    """
+    Procura o ETag no cabeçalho If-None-Match
+
+    A comparação é fraca e ignora o sufixo de codificação (-gzip, -br) que a
+    compressão acrescenta: todas as representações da mesma versão correspondem.
+
+    Returns:
+        str: A etiqueta do cabeçalho que corresponde (enviada no 304), ou None
+    """
+    if not if_none_match:
+        return None
+    for candidato in if_none_match.split(','):
+        candidato = candidato.strip()
+        if candidato == '*':
+            return f'"{etag}"'
+        valor = candidato[2:] if candidato.startswith('W/') else candidato
+        if strip_encoding_suffix(valor.strip('"')) == etag:
+            return candidato
+    return None
@@ -1,30 +1,215 @@
-import pika
+import functools
 import json
+import logging
+import os
+import threading
+import time
+from concurrent import futures
+from datetime import datetime
+
+import pika
+from pymongo import MongoClient
+from common.events import decode_event
+from common.rabbitmq_publisher import RABBITMQ_HOST, RABBITMQ_USER, RABBITMQ_PASS
+from common.topics import PRODUCT_EXCHANGE, ALL_PRODUCT_EVENTS
+
+# Configuração de logging para monitorização dos workers
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Configuração do worker (sobreponível por variáveis de ambiente)
+WORKER_QUEUE = os.getenv('WORKER_QUEUE', 'product_worker')
+WORKER_BINDING_KEYS = os.getenv('WORKER_BINDING_KEYS', ALL_PRODUCT_EVENTS).split(',')
+WORKER_POOL_SIZE = int(os.getenv('WORKER_POOL_SIZE', '8'))
+WORKER_POOL_TYPE = os.getenv('WORKER_POOL_TYPE', 'thread')  # thread ou process
+WORKER_MAX_FAILURES = int(os.getenv('WORKER_MAX_FAILURES', '3'))
+WORKER_PREFETCH_MULTIPLIER = int(os.getenv('WORKER_PREFETCH_MULTIPLIER', '2'))
+
+RETRY_HEADER = 'x-retry-count'
+
+
+def _connection_parameters():
+    credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
+    return pika.ConnectionParameters(RABBITMQ_HOST, credentials=credentials)
+
 
 def rabbitmq_producer(message, queue='product_updates'):
-    connection = pika.BlockingConnection(pika.ConnectionParameters('rabbitmq'))
-    channel = connection.channel()
-    channel.queue_declare(queue=queue, durable=True)
-    channel.basic_publish(
-        exchange='',
-        routing_key=queue,
-        body=json.dumps(message),
-        properties=pika.BasicProperties(
-            delivery_mode=2,  # make message persistent
+    """Publica uma mensagem JSON persistente directamente numa fila (envio pontual)"""
+    connection = pika.BlockingConnection(_connection_parameters())
+    try:
+        channel = connection.channel()
+        channel.queue_declare(queue=queue, durable=True)
+        channel.basic_publish(
+            exchange='',
+            routing_key=queue,
+            body=json.dumps(message),
+            properties=pika.BasicProperties(
+                delivery_mode=2,  # make message persistent
+                content_type='application/json'
+            ))
+    finally:
+        connection.close()
+
+
+class ConsumerWorker:
+    """Consumidor RabbitMQ que processa mensagens num pool de threads ou processos.
+
+    Cada worker tem a sua fila, ligada ao exchange de eventos de produtos, para
+    não competir com o gateway WebSocket pelas mensagens de product_updates.
+    O prefetch é dimensionado ao pool para que cada worker tenha sempre a
+    próxima mensagem disponível. A mensagem só é confirmada (ack) depois de o
+    handler terminar com sucesso; em caso de erro é reenviada para a fila com
+    o contador x-retry-count e, ao fim de max_failures falhas, é movida para a
+    dead-letter queue <fila>.dead.
+
+    O handler recebe a notificação já descodificada (dict). Com pool_type
+    'process' tem de ser uma função de módulo (serializável com pickle).
+    """
+
+    def __init__(self, handler, queue=WORKER_QUEUE, binding_keys=WORKER_BINDING_KEYS,
+                 pool_size=WORKER_POOL_SIZE, pool_type=WORKER_POOL_TYPE,
+                 max_failures=WORKER_MAX_FAILURES, prefetch_multiplier=WORKER_PREFETCH_MULTIPLIER):
+        if pool_type not in ('thread', 'process'):
+            raise ValueError(f"Unknown pool type: {pool_type}")
+        self.handler = handler
+        self.queue = queue
+        self.dead_letter_queue = f"{queue}.dead"
+        self.binding_keys = binding_keys
+        self.pool_size = pool_size
+        self.pool_type = pool_type
+        self.max_failures = max_failures
+        self.prefetch_count = pool_size * prefetch_multiplier
+        self._connection = None
+        self._executor = None
+
+    def _declare(self, channel):
+        """Declara a fila de trabalho, a dead-letter queue e as ligações ao exchange"""
+        channel.exchange_declare(exchange=PRODUCT_EXCHANGE, exchange_type='topic', durable=True)
+        channel.queue_declare(queue=self.dead_letter_queue, durable=True)
+        channel.queue_declare(queue=self.queue, durable=True)
+        for binding_key in self.binding_keys:
+            channel.queue_bind(queue=self.queue, exchange=PRODUCT_EXCHANGE, routing_key=binding_key)
+        channel.basic_qos(prefetch_count=self.prefetch_count)
+
+    def _on_message(self, channel, method, properties, body):
+        """Recebe a mensagem na thread da ligação e entrega-a ao pool"""
+        try:
+            message = decode_event(body, properties.content_type)
+        except Exception as e:
+            # Mensagem impossível de descodificar: não adianta repetir
+            logger.error(f"Undecodable message, dead-lettering: {str(e)}")
+            self._dead_letter(channel, method, properties, body, {})
+            return
+
+        future = self._executor.submit(self.handler, message)
+        connection = self._connection
+        future.add_done_callback(lambda done: self._schedule_completion(
+            connection, functools.partial(self._on_done, channel, method, properties, body, done)
         ))
-    connection.close()
+
+    def _schedule_completion(self, connection, callback):
+        """O BlockingConnection não é thread-safe: ack/nack correm na thread da ligação"""
+        try:
+            connection.add_callback_threadsafe(callback)
+        except Exception as e:
+            # Ligação perdida: o broker volta a entregar a mensagem não confirmada
+            logger.error(f"Could not schedule acknowledgement: {str(e)}")
+
+    def _on_done(self, channel, method, properties, body, done):
+        """Confirma, repete ou envia para a dead-letter queue consoante o resultado do handler"""
+        if not channel.is_open:
+            return
+        error = done.exception()
+        if error is None:
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+            return
+
+        headers = dict(properties.headers or {})
+        failures = headers.get(RETRY_HEADER, 0) + 1
+        headers[RETRY_HEADER] = failures
+        if failures >= self.max_failures:
+            logger.error(f"Message failed {failures} times, dead-lettering: {str(error)}")
+            self._dead_letter(channel, method, properties, body, headers)
+            return
+
+        logger.warning(f"Handler failed (attempt {failures}/{self.max_failures}), requeueing: {str(error)}")
+        self._republish(channel, self.queue, properties, body, headers)
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+
+    def _dead_letter(self, channel, method, properties, body, headers):
+        """Move a mensagem para a dead-letter queue"""
+        self._republish(channel, self.dead_letter_queue, properties, body, headers)
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+
+    def _republish(self, channel, queue, properties, body, headers):
+        # Publicado antes do ack: se a ligação cair entre os dois, a mensagem é duplicada e não perdida
+        channel.basic_publish(
+            exchange='',
+            routing_key=queue,
+            body=body,
+            properties=pika.BasicProperties(
+                delivery_mode=2,
+                content_type=properties.content_type,
+                type=properties.type,
+                headers=headers
+            )
+        )
+
+    def _consume(self):
+        self._connection = pika.BlockingConnection(_connection_parameters())
+        channel = self._connection.channel()
+        self._declare(channel)
+        channel.basic_consume(queue=self.queue, on_message_callback=self._on_message)
+        logger.info(f"Worker consuming '{self.queue}' with {self.pool_size} {self.pool_type}s "
+                    f"(prefetch {self.prefetch_count}). To exit press CTRL+C")
+        channel.start_consuming()
+
+    def run(self):
+        """Consome mensagens até CTRL+C, reconectando automaticamente em caso de falha"""
+        executor_class = futures.ThreadPoolExecutor if self.pool_type == 'thread' else futures.ProcessPoolExecutor
+        self._executor = executor_class(max_workers=self.pool_size)
+        retry_count = 0
+        try:
+            while True:
+                try:
+                    self._consume()
+                    retry_count = 0
+                except pika.exceptions.AMQPConnectionError as e:
+                    retry_count += 1
+                    wait_time = min(30, 5 * retry_count)
+                    logger.error(f"RabbitMQ connection error (attempt {retry_count}): {str(e)}. "
+                                 f"Retrying in {wait_time} seconds...")
+                    time.sleep(wait_time)
+        except KeyboardInterrupt:
+            logger.info('Stopping worker, waiting for running handlers...')
+        finally:
+            self._executor.shutdown(wait=True)
+            if self._connection is not None and self._connection.is_open:
+                # Entrega os acks pendentes dos handlers já terminados antes de fechar
+                self._connection.process_data_events(time_limit=1)
+                self._connection.close()
+
 
 def rabbitmq_consumer(callback, queue='product_updates'):
-    connection = pika.BlockingConnection(pika.ConnectionParameters('rabbitmq'))
-    channel = connection.channel()
-    channel.queue_declare(queue=queue, durable=True)
-
-    def on_message(ch, method, properties, body):
-        message = json.loads(body)
-        callback(message)
-        ch.basic_ack(delivery_tag=method.delivery_tag)
-
-    channel.basic_qos(prefetch_count=1)
-    channel.basic_consume(queue=queue, on_message_callback=on_message)
-    print('Waiting for messages. To exit press CTRL+C')
-    channel.start_consuming()
+    """Consome a fila indicada processando uma mensagem de cada vez (compatibilidade)"""
+    ConsumerWorker(callback, queue=queue, binding_keys=[ALL_PRODUCT_EVENTS], pool_size=1).run()
+
+
+_mongo_client = None
+_mongo_lock = threading.Lock()
+
+
+def store_event_history(message):
+    """Handler por omissão: guarda cada evento de produto no histórico do MongoDB"""
+    global _mongo_client
+    # Criado em cada processo/worker na primeira utilização (MongoClient não sobrevive a fork)
+    with _mongo_lock:
+        if _mongo_client is None:
+            _mongo_client = MongoClient('mongodb://mongodb:27017/')
+    _mongo_client['produtos_db']['event_history'].insert_one(
+        dict(message, processed_at=datetime.utcnow())
+    )
+
+
+if __name__ == '__main__':
+    ConsumerWorker(store_event_history).run()
@@ -1,39 +1,111 @@
-from spyne import Application, rpc, ServiceBase, Unicode
+import base64
+import binascii
+import os
+import signal
+import sys
+from spyne import (
+    Application, rpc, ServiceBase, ComplexModel, Unicode, Integer, Integer32, Decimal, Array, Fault
+)
 from spyne.protocol.soap import Soap11
 from spyne.server.wsgi import WsgiApplication
-import json
-import pika
-from pymongo import MongoClient
-from bson import ObjectId
+from pymongo import MongoClient, ASCENDING
+from common.admission import AdmissionController, WSGIAdmissionMiddleware, server_timing
+from common.events import build_event
+from common.notification_outbox import enqueue_notification
+from common.catalog_query import search as search_catalog
+from common.compression import WSGICompressionMiddleware
+from common.indexes import ensure_indexes
+from common.serialization import dumps, loads
+from catalog_cache import CATALOG_CACHE_ENABLED, CatalogCache, ensure_listener
 
-# Ligação à base de dados MongoDB
-client = MongoClient('mongodb://mongodb:27017/')
+# Ligação à base de dados MongoDB (estabelecida no primeiro pedido: com SOAP_SERVER=gunicorn
+# cada processo worker tem a sua ligação, aberta depois do fork)
+MONGO_URI = 'mongodb://mongodb:27017/'
+client = MongoClient(MONGO_URI, connect=False)
 db = client['produtos_db']
 collection = db['produtos']
 
-def send_rabbitmq_notification(message):
-    """Envia notificação para o RabbitMQ após operação de leitura"""
+# Servidor HTTP: 'gunicorn' (produção, SOAP_WORKERS processos com SOAP_THREADS threads cada)
+# ou 'wsgiref' (desenvolvimento, um pedido de cada vez)
+SOAP_SERVER = os.getenv('SOAP_SERVER', 'gunicorn')
+SOAP_WORKERS = int(os.getenv('SOAP_WORKERS', '2'))
+SOAP_THREADS = int(os.getenv('SOAP_THREADS', '4'))
+SOAP_KEEPALIVE = int(os.getenv('SOAP_KEEPALIVE', '5'))  # Segundos que uma ligação inactiva fica aberta
+SOAP_GRACEFUL_TIMEOUT = int(os.getenv('SOAP_GRACEFUL_TIMEOUT', '30'))  # Espera pelos pedidos em curso ao terminar
+
+# Notificação read_all a cada leitura do catálogo (0: deixa de ser enviada aos clientes)
+SOAP_READ_EVENTS = os.getenv('SOAP_READ_EVENTS', '1') == '1'
+
+# Leitura paginada: produtos por página e documentos pedidos ao MongoDB por cada ida ao servidor
+SOAP_PAGE_SIZE = int(os.getenv('SOAP_PAGE_SIZE', '100'))
+SOAP_PAGE_SIZE_MAX = int(os.getenv('SOAP_PAGE_SIZE_MAX', '1000'))
+SOAP_CURSOR_BATCH_SIZE = int(os.getenv('SOAP_CURSOR_BATCH_SIZE', '500'))
+
+def encode_cursor(last_id):
+    """Token de continuação opaco a partir do último id devolvido"""
+    return base64.urlsafe_b64encode(dumps({'after': last_id}).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """
+    Obtém o último id a partir do token de continuação
+
+    Raises:
+        Fault: Se o token não tiver sido gerado por read_page
+    """
     try:
-        # Configura credenciais de autenticação para RabbitMQ
-        credentials = pika.PlainCredentials('admin', 'admin')
-        connection = pika.BlockingConnection(
-            pika.ConnectionParameters('rabbitmq', credentials=credentials)
-        )
-        channel = connection.channel()
-        
-        # Declara fila durável para actualizações de produtos
-        channel.queue_declare(queue='product_updates', durable=True)
-        
-        # Publica mensagem na fila com persistência
-        channel.basic_publish(
-            exchange='',
-            routing_key='product_updates',
-            body=json.dumps(message),
-            properties=pika.BasicProperties(delivery_mode=2)  # Torna a mensagem persistente
-        )
-        connection.close()
-    except Exception as e:
-        print(f"Error sending RabbitMQ notification: {e}")
+        after = loads(base64.urlsafe_b64decode(cursor.encode('ascii')))['after']
+    except (binascii.Error, ValueError, TypeError, KeyError, UnicodeEncodeError):
+        after = None
+    if not isinstance(after, int):
+        raise Fault(faultcode='Client.InvalidCursor', faultstring='Cursor invalido')
+    return after
+
+# Namespace do serviço, partilhado pelos tipos complexos
+TNS = 'spyne.examples.readproduto'
+PRODUTO_PROJECTION = {'_id': 0, 'id': 1, 'name': 1, 'price': 1, 'stock': 1}
+
+class Produto(ComplexModel):
+    """Produto tal como definido em schema.xsd"""
+    __namespace__ = TNS
+    _type_info = [
+        ('id', Integer32),
+        ('name', Unicode),
+        ('price', Decimal),
+        ('stock', Integer32),
+    ]
+
+class ProdutoPage(ComplexModel):
+    """Página de produtos e token de continuação (vazio na última página)"""
+    __namespace__ = TNS
+    _type_info = [
+        ('produtos', Array(Produto)),
+        ('next_cursor', Unicode),
+    ]
+
+class ProdutoFilter(ComplexModel):
+    """Critérios de pesquisa, todos opcionais e combinados com E"""
+    __namespace__ = TNS
+    _type_info = [
+        ('min_price', Decimal),
+        ('max_price', Decimal),
+        ('stock_below', Integer),
+        ('name_prefix', Unicode),
+        ('text', Unicode),
+    ]
+
+def notify_read_all(count):
+    # Prepara notificação e coloca-a na outbox (publicada no RabbitMQ em segundo plano)
+    if SOAP_READ_EVENTS:
+        enqueue_notification(build_event('read_all', count=count))
+
+def build_catalog():
+    """Lê e serializa o catálogo completo (reconstrução do cache de read_all)"""
+    # Busca todos os produtos no MongoDB excluindo o campo _id
+    produtos = list(collection.find({}, {'_id': 0}))
+    return dumps(produtos), len(produtos)
+
+# Catálogo serializado por versão da colecção, invalidado pelos eventos de escrita
+catalog_cache = CatalogCache(db, build_catalog)
 
 class ProdutoReadService(ServiceBase):
     """Classe de serviço SOAP que implementa operações de leitura de produtos"""
@@ -43,38 +115,209 @@ class ProdutoReadService(ServiceBase):
         """
         Método SOAP para retornar todos os produtos da base de dados
         
+        Mantido por compatibilidade: os novos clientes devem usar read_all_produtos,
+        que evita a codificação JSON dentro do XML.
+        
         Returns:
             Unicode: String JSON com todos os produtos ou lista vazia
         """
-        # Busca todos os produtos no MongoDB excluindo o campo _id
-        produtos = list(collection.find({}, {'_id': 0}))
-        
-        # Prepara notificação para enviar ao sistema de mensagens
-        notification = {
-            'action': 'read_all',
-            'count': len(produtos),
-            'timestamp': str(ObjectId())  # Timestamp baseado em ObjectId do MongoDB
-        }
-        
-        # Envia notificação assíncrona via RabbitMQ
-        send_rabbitmq_notification(notification)
-        
-        return json.dumps(produtos)  # Retorna os produtos em formato JSON
+        if CATALOG_CACHE_ENABLED:
+            ensure_listener(catalog_cache)
+            catalogo, count = catalog_cache.get()
+        else:
+            catalogo, count = build_catalog()
+        notify_read_all(count)
+        return catalogo  # Retorna os produtos em formato JSON
+
+    @rpc(_returns=Unicode)
+    def read_all_cache_stats(ctx):
+        """
+        Método SOAP com as métricas do cache de read_all do processo que atende o pedido
+
+        Returns:
+            Unicode: String JSON com hits, misses, invalidações, reconstruções e tempos de reconstrução
+        """
+        return dumps(catalog_cache.stats())
+
+    @rpc(_returns=Array(Produto))
+    def read_all_produtos(ctx):
+        """
+        Método SOAP para retornar todos os produtos como elementos XML tipados
+
+        Returns:
+            Array(Produto): Todos os produtos
+        """
+        produtos = list(collection.find({}, PRODUTO_PROJECTION).batch_size(SOAP_CURSOR_BATCH_SIZE))
+        notify_read_all(len(produtos))
+        return produtos
+
+    @rpc(Unicode, Integer, _returns=ProdutoPage)
+    def read_page(ctx, cursor, limit):
+        """
+        Método SOAP para ler os produtos por páginas, por ordem de id
+
+        Args:
+            cursor (Unicode): Token de continuação devolvido pela página anterior (vazio na primeira)
+            limit (Integer): Produtos por página (SOAP_PAGE_SIZE por omissão, até SOAP_PAGE_SIZE_MAX)
+
+        Returns:
+            ProdutoPage: Produtos da página e next_cursor (vazio na última)
+        """
+        if limit is None:
+            limit = SOAP_PAGE_SIZE
+        if limit < 1:
+            raise Fault(faultcode='Client.InvalidLimit', faultstring='limit deve ser positivo')
+        limit = min(limit, SOAP_PAGE_SIZE_MAX)
+        filtro = {'id': {'$gt': decode_cursor(cursor)}} if cursor else {}
+
+        # Keyset sobre o índice único em id: cada página custa o mesmo, qualquer que seja a posição
+        produtos = list(collection.find(filtro, PRODUTO_PROJECTION).sort('id', ASCENDING)
+                        .limit(limit).batch_size(min(limit, SOAP_CURSOR_BATCH_SIZE)))
+        next_cursor = encode_cursor(produtos[-1]['id']) if len(produtos) == limit else None
+        return ProdutoPage(produtos=produtos, next_cursor=next_cursor)
+
+    @rpc(ProdutoFilter, Unicode, Unicode, Integer, _returns=Array(Produto))
+    def search(ctx, filtro, fields, sort, limit):
+        """
+        Método SOAP para pesquisar produtos no servidor, com índices para cada filtro
+
+        Args:
+            filtro (ProdutoFilter): Intervalo de preço, stock abaixo de um valor, prefixo do nome e/ou texto
+            fields (Unicode): Campos devolvidos, ex.: "name,stock" (todos por omissão; id sempre incluído)
+            sort (Unicode): Campo de ordenação, "-" para descendente (ex.: "-price"); por omissão id
+                ou, numa pesquisa de texto, relevância
+            limit (Integer): Máximo de produtos (SEARCH_LIMIT_DEFAULT por omissão, até SEARCH_LIMIT_MAX)
+
+        Returns:
+            Array(Produto): Produtos encontrados (campos fora de fields vazios)
+        """
+        filtro = filtro or ProdutoFilter()
+        try:
+            produtos = search_catalog(
+                collection, min_price=filtro.min_price, max_price=filtro.max_price,
+                stock_below=filtro.stock_below, name_prefix=filtro.name_prefix, text=filtro.text,
+                fields=fields, sort=sort, limit=limit
+            )
+        except ValueError as e:
+            raise Fault(faultcode='Client.InvalidSearch', faultstring=str(e))
+        return produtos.batch_size(SOAP_CURSOR_BATCH_SIZE)
+
+    @rpc(Array(Integer), _returns=Array(Produto))
+    def read_by_ids(ctx, ids):
+        """
+        Método SOAP para ler vários produtos pelos seus ids numa só chamada
+
+        Args:
+            ids (Array(Integer)): Ids pedidos (até SOAP_PAGE_SIZE_MAX)
+
+        Returns:
+            Array(Produto): Produtos encontrados, por ordem de id
+        """
+        ids = list(ids or [])
+        if len(ids) > SOAP_PAGE_SIZE_MAX:
+            raise Fault(faultcode='Client.TooManyIds', faultstring=f'No maximo {SOAP_PAGE_SIZE_MAX} ids por pedido')
+        return (collection.find({'id': {'$in': ids}}, PRODUTO_PROJECTION).sort('id', ASCENDING)
+                .batch_size(SOAP_CURSOR_BATCH_SIZE))
 
 # Configuração da aplicação SOAP com protocolo SOAP 1.1
 application = Application([ProdutoReadService],
-    tns='spyne.examples.readproduto',  # Target namespace para o serviço SOAP
+    tns=TNS,                           # Target namespace para o serviço SOAP
     in_protocol=Soap11(),              # Protocolo de entrada SOAP 1.1
     out_protocol=Soap11(),             # Protocolo de saída SOAP 1.1
 )
 
+# Fault SOAP 1.1 devolvido aos pedidos rejeitados pelo controlo de admissão
+OVERLOADED_FAULT = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<soap11env:Envelope xmlns:soap11env="http://schemas.xmlsoap.org/soap/envelope/">'
+    '<soap11env:Body><soap11env:Fault>'
+    '<faultcode>soap11env:Server.Overloaded</faultcode>'
+    '<faultstring>Servico sobrecarregado, tente novamente</faultstring>'
+    '</soap11env:Fault></soap11env:Body></soap11env:Envelope>'
+).encode('utf-8')
+
+def reject_soap_fault(environ, start_response, error):
+    """Rejeição em formato SOAP (503 com Retry-After), para que o zeep a trate como Fault"""
+    start_response('503 Service Unavailable', [
+        ('Content-Type', 'text/xml; charset=utf-8'),
+        ('Content-Length', str(len(OVERLOADED_FAULT))),
+        ('Retry-After', '1'),
+        server_timing(error.queue_wait),
+    ])
+    return [OVERLOADED_FAULT]
+
 # Criação da aplicação WSGI para integração com servidor web
-wsgi_app = WsgiApplication(application)
+# (respostas grandes, como o catálogo completo, seguem comprimidas com gzip/brotli;
+# acima de SOAP_THREADS pedidos em curso por worker o excesso espera em fila e,
+# sem lugar a tempo, recebe um Fault)
+admission = AdmissionController('soap', max_concurrency=SOAP_THREADS)
+wsgi_app = WSGIAdmissionMiddleware(
+    WSGICompressionMiddleware(WsgiApplication(application)), admission, reject=reject_soap_fault
+)
 
-if __name__ == '__main__':
+def criar_indices():
+    """Índices criados com uma ligação própria, fechada antes de os workers serem criados"""
+    index_client = MongoClient(MONGO_URI)
+    try:
+        ensure_indexes(index_client['produtos_db'])
+    finally:
+        index_client.close()
+
+def serve_wsgiref(host, port):
+    """Servidor de desenvolvimento da biblioteca standard (um pedido de cada vez)"""
     from wsgiref.simple_server import make_server
+    server = make_server(host, port, wsgi_app)
+    # SIGTERM (docker stop) termina como Ctrl+C: fecha o socket e esvazia a outbox (atexit)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+def serve_gunicorn(host, port, workers, threads):
+    """
+    Servidor de produção gunicorn
+
+    Cada worker é um processo que executa até threads pedidos em simultâneo,
+    com keep-alive de SOAP_KEEPALIVE segundos. O worker gthread tem mais
+    ADMISSION_MAX_QUEUE threads do que isso: os pedidos em excesso chegam à
+    aplicação e esperam no semáforo do controlo de admissão (com tempo de
+    espera medido e limitado) em vez de na fila de ligações do gunicorn, onde
+    ninguém os mediria nem rejeitaria. Com SIGTERM deixa de aceitar ligações e
+    espera até SOAP_GRACEFUL_TIMEOUT segundos pelos pedidos em curso.
+    """
+    from gunicorn.app.base import BaseApplication
+
+    if threads != wsgi_app.controller.max_concurrency:
+        wsgi_app.controller = AdmissionController('soap', max_concurrency=threads)
+    gunicorn_threads = threads + wsgi_app.controller.max_queue
+
+    class SoapServer(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{host}:{port}')
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', gunicorn_threads)
+            self.cfg.set('keepalive', SOAP_KEEPALIVE)
+            self.cfg.set('graceful_timeout', SOAP_GRACEFUL_TIMEOUT)
+
+        def load(self):
+            return wsgi_app
+
+    SoapServer().run()
+
+def serve(host='0.0.0.0', port=8002, server=SOAP_SERVER, workers=SOAP_WORKERS, threads=SOAP_THREADS):
+    """Inicia o servidor SOAP escolhido (SOAP_SERVER)"""
+    if server == 'wsgiref':
+        print(f"SOAP server online em http://localhost:{port} (wsgiref)")
+        serve_wsgiref(host, port)
+    elif server == 'gunicorn':
+        print(f"SOAP server online em http://localhost:{port} ({workers} workers x {threads} threads)")
+        serve_gunicorn(host, port, workers, threads)
+    else:
+        raise ValueError(f"Unknown SOAP server: {server}")
+
+if __name__ == '__main__':
+    criar_indices()
     # Inicia o servidor SOAP na porta 8002 acessível externamente
-    server = make_server('0.0.0.0', 8002, wsgi_app)
-    print("SOAP server online em http://localhost:8002")
     # WSDL disponível em: http://localhost:8002/?wsdl
-    server.serve_forever()
+    serve()
@@ -0,0 +1,192 @@
+"""
+Cache read-through do catálogo serializado devolvido por read_all
+
+A entrada guarda a string JSON e a versão da colecção (common/versioning) com
+que foi construída. Uma thread consome os eventos de escrita do exchange
+product_events numa fila própria (exclusiva, não compete com a product_updates
+do gateway) e invalida a entrada; enquanto essa ligação estiver activa um hit
+não faz nenhuma consulta ao MongoDB. Sem ligação ao RabbitMQ cada pedido
+compara a versão guardada com a actual. CATALOG_CACHE_TTL limita a idade da
+entrada em qualquer caso (eventos perdidos, escritas fora dos serviços).
+"""
+import logging
+import os
+import threading
+import time
+
+import pika
+
+from common.rabbitmq_publisher import RABBITMQ_HOST, RABBITMQ_USER, RABBITMQ_PASS
+from common.topics import PRODUCT_EXCHANGE
+from common.versioning import current_version
+
+logger = logging.getLogger(__name__)
+
+CATALOG_CACHE_ENABLED = os.getenv('CATALOG_CACHE', '1') == '1'
+CATALOG_CACHE_TTL = float(os.getenv('CATALOG_CACHE_TTL', '60'))  # Segundos
+RECONNECT_DELAY = 5.0
+
+# Eventos que alteram o catálogo (os eventos read_all não invalidam)
+INVALIDATING_PATTERNS = (
+    'product.create.#',
+    'product.update.#',
+    'product.delete.#',
+    'product.bulk_create.#',
+    'product.bulk_update.#',
+)
+
+
+class CatalogCache:
+    """Catálogo serializado por versão da colecção, partilhado pelas threads do processo"""
+
+    def __init__(self, db, build, ttl=CATALOG_CACHE_TTL):
+        """
+        Args:
+            build: Função sem argumentos que devolve (string JSON, número de produtos)
+        """
+        self.db = db
+        self.build = build
+        self.ttl = ttl
+        self._entry = None  # (versão, json, count, instante da construção, geração)
+        self._generation = 0  # Incrementada a cada invalidação
+        self._listening = False  # Consumidor de eventos ligado: as invalidações são fiáveis
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'invalidations': 0, 'rebuilds': 0}
+        self._rebuild_ms = {'last': None, 'max': 0.0, 'total': 0.0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._counters['invalidations'] += 1
+
+    def set_listening(self, listening):
+        with self._lock:
+            self._listening = listening
+            # Eventos podem ter sido perdidos enquanto a ligação esteve em baixo
+            self._generation += 1
+
+    def _fresh(self, entry, version):
+        """Indica se a entrada pode ser servida (version None: dispensada pelo consumidor de eventos)"""
+        if entry is None or time.monotonic() - entry[3] > self.ttl:
+            return False
+        if version is None:
+            return entry[4] == self._generation
+        return entry[0] == version
+
+    def _version_if_needed(self):
+        # Com o consumidor ligado a geração basta; sem ele é preciso ler a versão
+        return None if self._listening else current_version(self.db)
+
+    def get(self):
+        """
+        Devolve o catálogo serializado, reconstruindo-o se estiver desactualizado
+
+        Returns:
+            tuple: (string JSON, número de produtos)
+        """
+        version = self._version_if_needed()
+        entry = self._entry
+        if self._fresh(entry, version):
+            self._count('hits')
+            return entry[1], entry[2]
+
+        self._count('misses')
+        # Uma só reconstrução de cada vez: as outras threads esperam e usam o resultado
+        with self._build_lock:
+            version = self._version_if_needed()
+            entry = self._entry
+            if self._fresh(entry, version):
+                return entry[1], entry[2]
+            return self._rebuild()
+
+    def _rebuild(self):
+        # Versão e geração lidas antes dos dados: uma escrita concorrente torna a entrada obsoleta
+        generation = self._generation
+        version = current_version(self.db)
+        start = time.perf_counter()
+        body, count = self.build()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._entry = (version, body, count, time.monotonic(), generation)
+        with self._lock:
+            self._counters['rebuilds'] += 1
+            self._rebuild_ms['last'] = elapsed_ms
+            self._rebuild_ms['max'] = max(self._rebuild_ms['max'], elapsed_ms)
+            self._rebuild_ms['total'] += elapsed_ms
+        return body, count
+
+    def stats(self):
+        """Contadores do cache e tempos de reconstrução (ms) deste processo"""
+        with self._lock:
+            stats = dict(self._counters)
+            rebuild_ms = dict(self._rebuild_ms)
+            stats['listening'] = self._listening
+        entry = self._entry
+        stats['version'] = entry[0] if entry else None
+        stats['produtos'] = entry[2] if entry else None
+        stats['rebuild_ms'] = {
+            'last': round(rebuild_ms['last'], 3) if rebuild_ms['last'] is not None else None,
+            'avg': round(rebuild_ms['total'] / stats['rebuilds'], 3) if stats['rebuilds'] else None,
+            'max': round(rebuild_ms['max'], 3),
+        }
+        return stats
+
+
+class InvalidationListener:
+    """Thread que invalida o cache a cada evento de escrita publicado no exchange"""
+
+    def __init__(self, cache, host=RABBITMQ_HOST, patterns=INVALIDATING_PATTERNS):
+        self.cache = cache
+        self.host = host
+        self.patterns = patterns
+        self._thread = threading.Thread(target=self._run, name='catalog-cache-invalidation', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _consume(self):
+        credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
+        connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.host, credentials=credentials))
+        try:
+            channel = connection.channel()
+            channel.exchange_declare(exchange=PRODUCT_EXCHANGE, exchange_type='topic', durable=True)
+            # Fila própria do processo, apagada quando a ligação fecha
+            queue = channel.queue_declare(queue='', exclusive=True, auto_delete=True).method.queue
+            for pattern in self.patterns:
+                channel.queue_bind(exchange=PRODUCT_EXCHANGE, queue=queue, routing_key=pattern)
+            channel.basic_consume(queue=queue, on_message_callback=lambda *args: self.cache.invalidate(),
+                                  auto_ack=True)
+            self.cache.set_listening(True)
+            logger.info(f"Catalog cache listening for product events on {queue}")
+            channel.start_consuming()
+        finally:
+            self.cache.set_listening(False)
+            if connection.is_open:
+                connection.close()
+
+    def _run(self):
+        while True:
+            try:
+                self._consume()
+            except Exception as e:
+                logger.warning(f"Catalog cache invalidation listener disconnected: {e}")
+            time.sleep(RECONNECT_DELAY)
+
+
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def ensure_listener(cache):
+    """Arranca o consumidor de eventos deste processo (uma vez; de novo em cada worker após o fork)"""
+    global _listener_pid
+    with _listener_lock:
+        if _listener_pid != os.getpid():
+            _listener_pid = os.getpid()
+            # O cache foi copiado do processo pai: o estado de ligação herdado não vale aqui
+            cache.set_listening(False)
+            InvalidationListener(cache).start()
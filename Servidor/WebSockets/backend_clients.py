@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Endereços dos serviços (sobreponíveis por variáveis de ambiente)
+REST_URL = os.getenv('REST_URL', 'http://rest:8001')
+SOAP_WSDL_URL = os.getenv('SOAP_WSDL_URL', 'http://soap:8002/?wsdl')
+GRPC_TARGET = os.getenv('GRPC_TARGET', 'grpc:8003')
+GRAPHQL_URL = os.getenv('GRAPHQL_URL', 'http://graphql:8004/graphql')
+
+# Ligações keep-alive por serviço e threads para as chamadas bloqueantes
+BACKEND_POOL_SIZE = int(os.getenv('BACKEND_POOL_SIZE', '20'))
+BACKEND_TIMEOUT = float(os.getenv('BACKEND_TIMEOUT', '10'))
+WSDL_CACHE_TTL = int(os.getenv('WSDL_CACHE_TTL', '3600'))  # Segundos
+
+
+class BackendClients:
+    """Clientes dos serviços REST, SOAP, gRPC e GraphQL, criados uma vez e partilhados.
+
+    As chamadas HTTP usam uma sessão requests com até pool_size ligações
+    keep-alive por serviço; o cliente zeep descarrega e interpreta o WSDL uma
+    única vez e o canal gRPC é reutilizado por todas as chamadas. Como os três
+    clientes são bloqueantes, run() executa-os num pool de threads próprio do
+    mesmo tamanho, fora do event loop do gateway.
+    """
+
+    def __init__(self, pool_size=BACKEND_POOL_SIZE):
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='backend')
+        self._lock = threading.Lock()
+        self._soap = None
+        self._grpc_channel = None
+        self._grpc_stub = None
+
+    async def run(self, func, *args):
+        """Executa uma chamada bloqueante no pool de threads dos clientes"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def post_json(self, url, payload, headers=None):
+        response = self.session.post(url, json=payload, headers=headers, timeout=BACKEND_TIMEOUT)
+        return response.json()
+
+    def soap(self):
+        """
+        Cliente zeep do serviço SOAP
+
+        É criado na primeira chamada (o serviço pode ainda não estar disponível
+        quando o gateway arranca); se o WSDL falhar, a chamada seguinte tenta de novo.
+        """
+        if self._soap is None:
+            with self._lock:
+                if self._soap is None:
+                    from zeep import Client as SoapClient
+                    from zeep.cache import InMemoryCache
+                    from zeep.transports import Transport
+                    transport = Transport(session=self.session, timeout=BACKEND_TIMEOUT,
+                                          operation_timeout=BACKEND_TIMEOUT, cache=InMemoryCache(timeout=WSDL_CACHE_TTL))
+                    self._soap = SoapClient(SOAP_WSDL_URL, transport=transport)
+        return self._soap
+
+    def grpc_stub(self):
+        """Stub do ProdutoService sobre um canal gRPC partilhado (o canal volta a ligar sozinho)"""
+        if self._grpc_stub is None:
+            with self._lock:
+                if self._grpc_stub is None:
+                    import grpc
+                    import produtos_pb2_grpc
+                    self._grpc_channel = grpc.insecure_channel(GRPC_TARGET)
+                    self._grpc_stub = produtos_pb2_grpc.ProdutoServiceStub(self._grpc_channel)
+        return self._grpc_stub
+
+    def warm_up(self):
+        """Cria os clientes no arranque; uma falha fica para a primeira utilização"""
+        self.grpc_stub()
+        try:
+            self.soap()
+        except Exception as e:
+            logger.warning(f"SOAP client not ready yet ({e}); will retry on first use")
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
+        if self._grpc_channel is not None:
+            self._grpc_channel.close()
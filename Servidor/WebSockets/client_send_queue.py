@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from collections import deque
+
+import websockets
+
+logger = logging.getLogger(__name__)
+
+SLOW_CLIENT_POLICIES = ('coalesce', 'drop_oldest', 'disconnect')
+
+
+class ClientSendQueue:
+    """Fila de envio limitada de um cliente WebSocket, esvaziada por uma tarefa própria.
+
+    O broadcast apenas coloca mensagens em fila, pelo que um cliente lento não
+    atrasa os restantes. Quando a fila enche aplica-se a política configurada:
+        - coalesce: substitui a mensagem em fila com a mesma chave (routing key),
+          ficando só o evento mais recente; sem chave igual descarta a mais antiga.
+          Um índice chave -> posição na fila torna a substituição O(1)
+        - drop_oldest: descarta a mensagem mais antiga
+        - disconnect: fecha a ligação do cliente (código 1013, try again later)
+    """
+
+    def __init__(self, websocket, max_size, policy):
+        if policy not in SLOW_CLIENT_POLICIES:
+            raise ValueError(f"Unknown slow client policy: {policy}")
+        self.websocket = websocket
+        self.max_size = max_size
+        self.policy = policy
+        self.dropped = 0
+        self.coalesced = 0
+        self.sent = 0
+        self._items = deque()  # Posições [chave, dados], alteráveis no lugar
+        self._slots = {}  # Chave -> posição mais recente em fila com essa chave
+        self._ready = asyncio.Event()
+        self._closing = False
+        self._task = asyncio.create_task(self._writer())
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, data, key=None):
+        """Coloca uma mensagem em fila sem esperar pelo envio"""
+        if self._closing:
+            return
+        if len(self._items) >= self.max_size:
+            if self.policy == 'disconnect':
+                self._disconnect()
+                return
+            if self.policy == 'coalesce' and key in self._slots:
+                self._slots[key][1] = data
+                self.coalesced += 1
+                return
+            self._pop()
+            self.dropped += 1
+        slot = [key, data]
+        self._items.append(slot)
+        if key is not None:
+            self._slots[key] = slot
+        self._ready.set()
+
+    def _pop(self):
+        """Retira a mensagem mais antiga, mantendo o índice de chaves"""
+        slot = self._items.popleft()
+        if self._slots.get(slot[0]) is slot:
+            del self._slots[slot[0]]
+        return slot[1]
+
+    def _disconnect(self):
+        """Fecha a ligação de um cliente que não acompanha o ritmo dos eventos"""
+        self._closing = True
+        self.dropped += len(self._items) + 1
+        self._items.clear()
+        self._slots.clear()
+        logger.warning(f"Disconnecting slow client {self.websocket.remote_address}")
+        asyncio.create_task(self.websocket.close(code=1013, reason="Slow consumer"))
+
+    async def _writer(self):
+        """Envia as mensagens em fila pela ordem de chegada"""
+        try:
+            while True:
+                await self._ready.wait()
+                while self._items:
+                    data = self._pop()
+                    await self.websocket.send(data)
+                    self.sent += 1
+                self._ready.clear()
+        except websockets.ConnectionClosed:
+            pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in client writer {self.websocket.remote_address}: {str(e)}")
+
+    def close(self):
+        """Termina a tarefa de envio do cliente"""
+        self._closing = True
+        self._task.cancel()
+
+    def metrics(self):
+        """Profundidade da fila e contadores do cliente"""
+        return {
+            "depth": len(self._items),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced
+        }
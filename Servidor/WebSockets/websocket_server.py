@@ -1,12 +1,19 @@
 import asyncio
 import websockets
 import json
-import pika
-import threading
+import aio_pika
 import logging
-import time
-import requests
+import os
+from collections import deque
 from websocket_auth import OAuth2JWTAuthenticator, OAuth2Provider
+from client_send_queue import ClientSendQueue
+from backend_clients import BackendClients, REST_URL, GRAPHQL_URL, BACKEND_TIMEOUT
+from common.topics import (
+    PRODUCT_EXCHANGE, ALL_PRODUCT_EVENTS, event_routing_keys, is_valid_pattern, matches_any, routing_key_for
+)
+from common.events import encode_event, decode_event, PROTOBUF_CONTENT_TYPE
+from common.idempotency import IDEMPOTENCY_HEADER, IDEMPOTENCY_METADATA
+from common.serialization import dumps, loads
 
 # Configuração de logging para monitorização do sistema
 logging.basicConfig(level=logging.INFO)
@@ -16,25 +23,142 @@ logger = logging.getLogger(__name__)
 jwt_auth = OAuth2JWTAuthenticator("your-super-secret-jwt-key-change-in-production")
 oauth2_provider = OAuth2Provider()
 connected_clients = {}  # Dicionário para gerir clientes conectados
+subscriptions = {}  # Índice padrão de routing key -> sockets subscritos
+MAX_SUBSCRIPTIONS_PER_CLIENT = 32
+client_queues = {}  # Fila de envio de eventos de cada socket
+backends = BackendClients()  # Clientes REST/SOAP/gRPC/GraphQL partilhados por todas as ligações
 
-async def notify_clients(message):
-    """Notifica todos os clientes autenticados sobre actualizações do sistema"""
-    if connected_clients:
-        message_data = json.dumps(message)
-        # Apenas notifica clientes autenticados por segurança
-        authenticated_clients = [ws for ws, info in connected_clients.items() 
-                               if info.get('authenticated', False)]
-        if authenticated_clients:
-            await asyncio.gather(
-                *[client.send(message_data) for client in authenticated_clients],
-                return_exceptions=True
-            )
+# Change feed: últimos eventos sequenciados, para clientes que retomam após reconexão
+CHANGE_FEED_SIZE = int(os.getenv('CHANGE_FEED_SIZE', '1000'))
+change_feed = deque(maxlen=CHANGE_FEED_SIZE)  # Pares (seq, routing_key, evento), seq contíguos
+last_seq = 0  # Última sequência recebida
+
+# Subprotocolo WebSocket em que os eventos são enviados como frames binários ProductEvent
+PROTOBUF_SUBPROTOCOL = 'produtos.protobuf.v1'
+
+# Filas de envio por cliente (sobreponível por variáveis de ambiente)
+CLIENT_QUEUE_SIZE = int(os.getenv('CLIENT_QUEUE_SIZE', '1000'))  # Eventos em fila por cliente
+SLOW_CLIENT_POLICY = os.getenv('SLOW_CLIENT_POLICY', 'coalesce')  # coalesce, drop_oldest ou disconnect
+
+# Configuração do consumidor RabbitMQ (sobreponível por variáveis de ambiente)
+RABBITMQ_HOST = os.getenv('RABBITMQ_HOST', 'rabbitmq')
+RABBITMQ_USER = os.getenv('RABBITMQ_USER', 'admin')
+RABBITMQ_PASS = os.getenv('RABBITMQ_PASS', 'admin')
+RABBITMQ_PREFETCH = int(os.getenv('RABBITMQ_PREFETCH', '256'))  # Mensagens em trânsito sem ack
+RABBITMQ_ACK_BATCH = int(os.getenv('RABBITMQ_ACK_BATCH', '64'))  # Mensagens por ack múltiplo
+RABBITMQ_ACK_INTERVAL = float(os.getenv('RABBITMQ_ACK_INTERVAL', '0.5'))  # Prazo máximo de um ack pendente (s)
+last_unacked_message = None  # Última mensagem reencaminhada ainda por confirmar
+unacked_count = 0
+
+def add_subscriptions(websocket, patterns):
+    """Adiciona padrões de subscrição ao cliente e ao índice padrão -> sockets"""
+    client_patterns = connected_clients[websocket].setdefault('patterns', set())
+    for pattern in patterns:
+        subscriptions.setdefault(pattern, set()).add(websocket)
+        client_patterns.add(pattern)
+
+def remove_subscriptions(websocket, patterns=None):
+    """Remove os padrões indicados (ou todos) do cliente e do índice"""
+    client_patterns = connected_clients.get(websocket, {}).get('patterns', set())
+    for pattern in list(client_patterns if patterns is None else patterns):
+        sockets = subscriptions.get(pattern)
+        if sockets is not None:
+            sockets.discard(websocket)
+            if not sockets:
+                del subscriptions[pattern]
+        client_patterns.discard(pattern)
+
+def matching_clients(routing_keys):
+    """Devolve os sockets com pelo menos um padrão que corresponde a uma das routing keys do evento"""
+    # Percorre os padrões distintos (não os clientes); o resultado de cada padrão fica em cache
+    targets = set()
+    for pattern, sockets in subscriptions.items():
+        if matches_any(pattern, routing_keys):
+            targets.update(sockets)
+    return targets
+
+async def notify_clients(message, routing_key=None, json_data=None, protobuf_data=None):
+    """
+    Notifica os clientes autenticados cujas subscrições correspondem ao evento
+
+    json_data e protobuf_data são o evento já serializado (ex.: o payload AMQP),
+    reencaminhado sem nova codificação; cada formato é gerado no máximo uma vez por evento.
+    """
+    if routing_key is None:
+        routing_key = routing_key_for(message)
+    # Apenas clientes autenticados estão no índice de subscrições
+    # (um evento em lote corresponde também às subscrições de cada produto)
+    targets = matching_clients(event_routing_keys(message, routing_key))
+    # Só coloca em fila: cada cliente tem a sua tarefa de envio, um cliente lento não atrasa os outros
+    for client in targets:
+        send_queue = client_queues.get(client)
+        if send_queue is None:
+            continue
+        if client.subprotocol == PROTOBUF_SUBPROTOCOL:
+            if protobuf_data is None:
+                protobuf_data = encode_event(message)
+            send_queue.put(protobuf_data, routing_key)
+        else:
+            if json_data is None:
+                json_data = dumps(message)
+            send_queue.put(json_data, routing_key)
+
+def record_change(payload, routing_key):
+    """
+    Guarda um evento sequenciado no change feed
+
+    Returns:
+        bool: False se o evento é um duplicado (reentrega at-least-once do relay)
+    """
+    global last_seq
+    seq = payload.get('seq')
+    if seq is None:
+        # Eventos sem sequência (ex.: read_all) não fazem parte do change feed
+        return True
+    if seq <= last_seq:
+        return False
+    if last_seq and seq != last_seq + 1:
+        # Falha na sequência: o buffer deixaria de permitir deltas correctos
+        logger.warning(f"Change feed gap between seq {last_seq} and {seq}, clearing buffer")
+        change_feed.clear()
+    change_feed.append((seq, routing_key, payload))
+    last_seq = seq
+    return True
+
+def select_subprotocol(connection, subprotocols):
+    """Aceita o subprotocolo binário quando oferecido; sem subprotocolo os eventos seguem em JSON"""
+    if PROTOBUF_SUBPROTOCOL in subprotocols:
+        return PROTOBUF_SUBPROTOCOL
+    return None
+
+def get_metrics():
+    """Métricas das filas de envio (profundidade por cliente)"""
+    clients = []
+    for websocket, send_queue in client_queues.items():
+        client_info = connected_clients.get(websocket, {})
+        clients.append({
+            "user_id": client_info.get('user_id'),
+            "remote_address": str(websocket.remote_address),
+            **send_queue.metrics()
+        })
+    return {
+        "connected_clients": len(connected_clients),
+        "subscription_patterns": len(subscriptions),
+        "last_seq": last_seq,
+        "change_feed_size": len(change_feed),
+        "slow_client_policy": SLOW_CLIENT_POLICY,
+        "queue_size": CLIENT_QUEUE_SIZE,
+        "total_queued": sum(client["depth"] for client in clients),
+        "max_depth": max((client["depth"] for client in clients), default=0),
+        "clients": clients
+    }
 
 async def register(websocket):
     """Regista novo cliente WebSocket e envia informações de autenticação"""
     connected_clients[websocket] = {'authenticated': False}
+    client_queues[websocket] = ClientSendQueue(websocket, CLIENT_QUEUE_SIZE, SLOW_CLIENT_POLICY)
     logger.info(f"Client connected: {websocket.remote_address}")
-    await websocket.send(json.dumps({
+    await websocket.send(dumps({
         "status": "connected",
         "message": "OAuth2 authentication required",
         "auth_endpoint": "/auth",
@@ -47,7 +171,11 @@ async def unregister(websocket):
         client_info = connected_clients[websocket]
         if client_info.get('authenticated'):
             logger.info(f"OAuth2 user {client_info.get('user_id')} disconnected")
+        remove_subscriptions(websocket)
         del connected_clients[websocket]
+    send_queue = client_queues.pop(websocket, None)
+    if send_queue is not None:
+        send_queue.close()
     logger.info(f"Client disconnected: {websocket.remote_address}")
 
 async def handle_oauth2_token_request(websocket, data):
@@ -62,7 +190,7 @@ async def handle_oauth2_token_request(websocket, data):
             scope = data.get('scope', 'read_product')  # Âmbito OAuth2
             
             if not username or not password:
-                await websocket.send(json.dumps({
+                await websocket.send(dumps({
                     "error": "invalid_request",
                     "error_description": "Missing username or password"
                 }))
@@ -80,7 +208,8 @@ async def handle_oauth2_token_request(websocket, data):
                 )
                 refresh_token = jwt_auth.generate_refresh_token(user_data['user_id'])
                 
-                # Armazena informações do cliente autenticado
+                # Armazena informações do cliente autenticado (descarta subscrições anteriores)
+                remove_subscriptions(websocket)
                 connected_clients[websocket] = {
                     'authenticated': True,
                     'user_id': user_data['user_id'],
@@ -88,11 +217,14 @@ async def handle_oauth2_token_request(websocket, data):
                     'roles': user_data['roles'],
                     'permissions': user_data['permissions'],
                     'access_token': access_token,
-                    'refresh_token': refresh_token
+                    'refresh_token': refresh_token,
+                    'default_subscription': True
                 }
+                # Por omissão o cliente recebe todos os eventos de produtos
+                add_subscriptions(websocket, [ALL_PRODUCT_EVENTS])
                 
                 # Resposta de token OAuth2 conforme RFC 6749
-                await websocket.send(json.dumps({
+                await websocket.send(dumps({
                     "access_token": access_token,
                     "token_type": "Bearer",
                     "expires_in": 86400,  # 24 horas
@@ -105,7 +237,7 @@ async def handle_oauth2_token_request(websocket, data):
                 logger.info(f"OAuth2 token issued for user {user_data['user_id']}")
                 return
             else:
-                await websocket.send(json.dumps({
+                await websocket.send(dumps({
                     "error": "invalid_grant",
                     "error_description": "Invalid username or password"
                 }))
@@ -116,7 +248,7 @@ async def handle_oauth2_token_request(websocket, data):
             refresh_token = data.get('refresh_token')
             
             if not refresh_token:
-                await websocket.send(json.dumps({
+                await websocket.send(dumps({
                     "error": "invalid_request", 
                     "error_description": "Missing refresh_token"
                 }))
@@ -136,7 +268,7 @@ async def handle_oauth2_token_request(websocket, data):
                 if websocket in connected_clients:
                     connected_clients[websocket]['access_token'] = new_access_token
                 
-                await websocket.send(json.dumps({
+                await websocket.send(dumps({
                     "access_token": new_access_token,
                     "token_type": "Bearer",
                     "expires_in": 86400,
@@ -144,13 +276,13 @@ async def handle_oauth2_token_request(websocket, data):
                 }))
                 return
             else:
-                await websocket.send(json.dumps({
+                await websocket.send(dumps({
                     "error": "invalid_grant",
                     "error_description": "Invalid refresh token"
                 }))
                 return
         else:
-            await websocket.send(json.dumps({
+            await websocket.send(dumps({
                 "error": "unsupported_grant_type",
                 "error_description": f"Grant type '{grant_type}' not supported"
             }))
@@ -158,7 +290,7 @@ async def handle_oauth2_token_request(websocket, data):
             
     except Exception as e:
         logger.error(f"OAuth2 token request error: {str(e)}")
-        await websocket.send(json.dumps({
+        await websocket.send(dumps({
             "error": "server_error",
             "error_description": "Internal server error"
         }))
@@ -184,6 +316,115 @@ async def verify_bearer_token(websocket, required_scope):
     
     return False, "invalid_token", "No access token provided"
 
+# Produtos por página pedidos ao SOAP ao montar um snapshot do catálogo
+SNAPSHOT_PAGE_SIZE = int(os.getenv('SNAPSHOT_PAGE_SIZE', '1000'))
+
+def soap_client():
+    return backends.soap()
+
+def produtos_from_soap(items):
+    """Converte um Array(Produto) devolvido pelo zeep em dicionários (price xs:decimal -> float)"""
+    if items is None:
+        return []  # Array vazio
+    if not isinstance(items, list):
+        items = items['Produto'] or []  # Array dentro de outro tipo (ex.: ProdutoPage)
+    produtos = []
+    for p in items:
+        # Campos fora da projecção (search com fields) chegam vazios e são omitidos
+        produto = {field: p[field] for field in ('id', 'name', 'price', 'stock') if p[field] is not None}
+        if 'price' in produto:
+            produto['price'] = float(produto['price'])
+        produtos.append(produto)
+    return produtos
+
+def fetch_catalog_snapshot():
+    """Obtém o catálogo completo através do serviço SOAP, página a página (chamada bloqueante)"""
+    client = soap_client()
+    produtos = []
+    cursor = None
+    while True:
+        page = client.service.read_page(cursor, SNAPSHOT_PAGE_SIZE)
+        produtos.extend(produtos_from_soap(page.produtos))
+        cursor = page.next_cursor
+        if cursor is None:
+            return produtos
+
+def fetch_catalog(data):
+    """
+    Lê produtos através do serviço SOAP conforme o pedido list_soap (chamada bloqueante)
+
+    Com ids lê só esses produtos; com cursor e/ou limit devolve uma página e o
+    token da seguinte (next_cursor); sem parâmetros devolve o catálogo completo.
+    """
+    client = soap_client()
+    if data.get('ids') is not None:
+        return {'data': produtos_from_soap(client.service.read_by_ids({'integer': data['ids']}))}
+    if 'cursor' in data or 'limit' in data:
+        page = client.service.read_page(data.get('cursor'), data.get('limit'))
+        return {'data': produtos_from_soap(page.produtos), 'next_cursor': page.next_cursor}
+    # Catálogo completo pela operação JSON: no Benchmarks/soap_payload_benchmark.py a
+    # serialização e o parsing de Array(Produto) custam dezenas de vezes mais
+    return {'data': loads(client.service.read_all())}
+
+# Critérios aceites pela acção search_soap (ProdutoFilter do serviço SOAP)
+SEARCH_FILTERS = ('min_price', 'max_price', 'stock_below', 'name_prefix', 'text')
+
+def search_catalog(data):
+    """
+    Pesquisa produtos no serviço SOAP, filtrados e ordenados no servidor (chamada bloqueante)
+
+    Ex.: {"stock_below": 5, "sort": "stock", "fields": "name,stock", "limit": 50}
+    """
+    filtro = {name: data[name] for name in SEARCH_FILTERS if data.get(name) is not None}
+    fields = data.get('fields')
+    if isinstance(fields, list):
+        fields = ','.join(fields)
+    items = soap_client().service.search(filtro, fields, data.get('sort'), data.get('limit'))
+    return {'data': produtos_from_soap(items)}
+
+async def handle_resume_request(websocket, data):
+    """Envia a um cliente que reconectou os eventos posteriores a resume_from (ou um snapshot)"""
+    authorized, error_code, error_description = await verify_bearer_token(websocket, "read_product")
+    if not authorized:
+        await websocket.send(dumps({
+            "error": error_code,
+            "error_description": error_description,
+            "required_scope": "read_product"
+        }))
+        return
+
+    resume_from = data.get("resume_from")
+    if not isinstance(resume_from, int) or resume_from < 0:
+        await websocket.send(dumps({
+            "error": "invalid_request",
+            "error_description": "resume_from must be a non-negative integer"
+        }))
+        return
+
+    if last_seq and resume_from == last_seq:
+        result = {"action": "resume", "success": True, "mode": "up_to_date", "last_seq": last_seq}
+    elif change_feed and change_feed[0][0] - 1 <= resume_from < last_seq:
+        # O buffer cobre todos os eventos em falta: envia só o delta que o cliente subscreve
+        patterns = connected_clients.get(websocket, {}).get('patterns', set())
+
+        def subscrito(event, routing_key):
+            routing_keys = event_routing_keys(event, routing_key)
+            return any(matches_any(pattern, routing_keys) for pattern in patterns)
+
+        events = [event for seq, routing_key, event in change_feed
+                  if seq > resume_from and subscrito(event, routing_key)]
+        result = {"action": "resume", "success": True, "mode": "delta", "last_seq": last_seq, "events": events}
+    else:
+        # Intervalo maior que o buffer (ou gateway reiniciado): snapshot completo do catálogo
+        snapshot_seq = last_seq
+        try:
+            produtos = await backends.run(fetch_catalog_snapshot)
+            result = {"action": "resume", "success": True, "mode": "snapshot", "last_seq": snapshot_seq, "data": produtos}
+        except Exception as e:
+            result = {"action": "resume", "success": False, "error": f"Snapshot error: {str(e)}"}
+
+    await websocket.send(dumps(result))
+
 async def handle_api_request(websocket, action, data):
     """Processa pedidos API com autorização OAuth2"""
     try:
@@ -191,13 +432,14 @@ async def handle_api_request(websocket, action, data):
         scope_mapping = {
             "create_rest": "create_product",
             "list_soap": "read_product",
+            "search_soap": "read_product",
             "update_grpc": "update_product", 
             "delete_graphql": "delete_product"
         }
         
         required_scope = scope_mapping.get(action)
         if not required_scope:
-            await websocket.send(json.dumps({
+            await websocket.send(dumps({
                 "error": "invalid_request",
                 "error_description": f"Unknown action: {action}"
             }))
@@ -206,7 +448,7 @@ async def handle_api_request(websocket, action, data):
         # Verifica autorização OAuth2
         authorized, error_code, error_description = await verify_bearer_token(websocket, required_scope)
         if not authorized:
-            await websocket.send(json.dumps({
+            await websocket.send(dumps({
                 "error": error_code,
                 "error_description": error_description,
                 "required_scope": required_scope
@@ -217,34 +459,45 @@ async def handle_api_request(websocket, action, data):
         client_info = connected_clients.get(websocket, {})
         user_id = client_info.get('user_id', 'unknown_user')
 
+        # Chave de idempotência opcional do cliente: repetições do mesmo pedido não repetem a escrita
+        idempotency_key = data.pop('idempotency_key', None)
+
         # Executa chamadas API conforme a acção solicitada
         if action == "create_rest":
             # REST API - adiciona user_id directamente aos dados
             data['user_id'] = user_id
-            response = requests.post("http://rest:8001/create", json=data, timeout=10)
-            result = {"action": "create_rest", "success": True, "data": response.json()}
+            headers = {IDEMPOTENCY_HEADER: idempotency_key} if idempotency_key else None
+            response = await backends.run(backends.post_json, f"{REST_URL}/create", data, headers)
+            result = {"action": "create_rest", "success": True, "data": response}
         
         elif action == "list_soap":
             try:
                 # SOAP API - utiliza cliente Zeep para comunicação
-                from zeep import Client as SoapClient
-                client = SoapClient("http://soap:8002/?wsdl")
-                produtos = client.service.read_all()
                 result = {
                     "action": "list_soap", 
                     "success": True, 
-                    "data": json.loads(produtos),
+                    **await backends.run(fetch_catalog, data),
                     "requested_by": user_id
                 }
             except Exception as soap_error:
                 result = {"action": "list_soap", "success": False, "error": f"SOAP error: {str(soap_error)}"}
         
+        elif action == "search_soap":
+            try:
+                # Filtros, projecção, ordenação e limite aplicados pelo MongoDB (índices por filtro)
+                result = {
+                    "action": "search_soap",
+                    "success": True,
+                    **await backends.run(search_catalog, data),
+                    "requested_by": user_id
+                }
+            except Exception as soap_error:
+                result = {"action": "search_soap", "success": False, "error": f"SOAP error: {str(soap_error)}"}
+        
         elif action == "update_grpc":
             try:
                 # gRPC API - filtra dados para o formato esperado pelo Produto message
-                import grpc
                 import produtos_pb2
-                import produtos_pb2_grpc
                 
                 grpc_data = {
                     "id": data.get("id"),
@@ -256,14 +509,15 @@ async def handle_api_request(websocket, action, data):
                 # Remove valores None para conformidade gRPC
                 grpc_data = {k: v for k, v in grpc_data.items() if v is not None}
                 
-                channel = grpc.insecure_channel('grpc:8003')
-                stub = produtos_pb2_grpc.ProdutoServiceStub(channel)
-                
                 # Envia user_id via metadados gRPC
                 metadata = [('user_id', user_id)]
+                if idempotency_key:
+                    metadata.append((IDEMPOTENCY_METADATA, idempotency_key))
                 
                 req = produtos_pb2.Produto(**grpc_data)
-                res = stub.UpdateProduto(req, metadata=metadata)
+                res = await backends.run(
+                    lambda: backends.grpc_stub().UpdateProduto(req, metadata=metadata, timeout=BACKEND_TIMEOUT)
+                )
                 
                 result = {
                     "action": "update_grpc", 
@@ -286,23 +540,84 @@ async def handle_api_request(websocket, action, data):
                     }}
                 '''
             }
-            response = requests.post("http://graphql:8004/graphql", json=query, timeout=10)
+            response = await backends.run(backends.post_json, GRAPHQL_URL, query)
             result = {
                 "action": "delete_graphql", 
                 "success": True, 
-                "data": response.json(),
+                "data": response,
                 "deleted_by": user_id
             }
         
-        await websocket.send(json.dumps(result))
+        await websocket.send(dumps(result))
             
     except Exception as e:
         logger.error(f"Error handling API request {action}: {str(e)}")
-        await websocket.send(json.dumps({
+        await websocket.send(dumps({
             "error": "server_error",
             "error_description": str(e)
         }))
 
+async def handle_subscription_request(websocket, action, data):
+    """Gere pedidos subscribe/unsubscribe com padrões de routing key (product.<action>.<id>)"""
+    authorized, error_code, error_description = await verify_bearer_token(websocket, "read_product")
+    if not authorized:
+        await websocket.send(dumps({
+            "error": error_code,
+            "error_description": error_description,
+            "required_scope": "read_product"
+        }))
+        return
+
+    patterns = data.get("patterns", [])
+    if not isinstance(patterns, list):
+        patterns = [patterns]
+    invalid = [p for p in patterns if not is_valid_pattern(p)]
+    if invalid or (action == "subscribe" and not patterns):
+        await websocket.send(dumps({
+            "error": "invalid_request",
+            "error_description": f"Invalid subscription patterns: {invalid or patterns}"
+        }))
+        return
+
+    client_info = connected_clients[websocket]
+    if action == "subscribe":
+        # A primeira subscrição explícita substitui a subscrição por omissão (todos os eventos);
+        # o limite é verificado antes, para que um pedido rejeitado não deixe o cliente sem subscrições
+        default_subscription = client_info.get('default_subscription', False)
+        current = set() if default_subscription else client_info.get('patterns', set())
+        if len(current | set(patterns)) > MAX_SUBSCRIPTIONS_PER_CLIENT:
+            await websocket.send(dumps({
+                "error": "invalid_request",
+                "error_description": f"At most {MAX_SUBSCRIPTIONS_PER_CLIENT} subscriptions per client"
+            }))
+            return
+        if default_subscription:
+            client_info.pop('default_subscription')
+            remove_subscriptions(websocket)
+        add_subscriptions(websocket, patterns)
+    else:
+        # Sem padrões, remove todas as subscrições do cliente
+        client_info.pop('default_subscription', None)
+        remove_subscriptions(websocket, patterns or None)
+
+    await websocket.send(dumps({
+        "action": action,
+        "success": True,
+        "patterns": sorted(client_info.get('patterns', set()))
+    }))
+
+async def handle_metrics_request(websocket):
+    """Devolve as métricas das filas de envio a clientes com âmbito admin_access"""
+    authorized, error_code, error_description = await verify_bearer_token(websocket, "admin_access")
+    if not authorized:
+        await websocket.send(dumps({
+            "error": error_code,
+            "error_description": error_description,
+            "required_scope": "admin_access"
+        }))
+        return
+    await websocket.send(dumps({"action": "metrics", "success": True, "data": get_metrics()}))
+
 async def handle_legacy_auth(websocket, data):
     """Processa autenticação legada para compatibilidade com versões anteriores"""
     try:
@@ -311,7 +626,7 @@ async def handle_legacy_auth(websocket, data):
         password = auth_data.get('password')
         
         if not username or not password:
-            await websocket.send(json.dumps({
+            await websocket.send(dumps({
                 "action": "auth",
                 "success": False,
                 "error": "Missing username or password"
@@ -331,7 +646,7 @@ async def handle_legacy_auth(websocket, data):
         
     except Exception as e:
         logger.error(f"Legacy auth error: {str(e)}")
-        await websocket.send(json.dumps({
+        await websocket.send(dumps({
             "action": "auth", 
             "success": False,
             "error": str(e)
@@ -343,7 +658,7 @@ async def handle_websocket(websocket):
     try:
         async for message in websocket:
             try:
-                data = json.loads(message)
+                data = loads(message)
                 logger.info(f"Received message: {data}")
                 
                 if "grant_type" in data:
@@ -352,24 +667,33 @@ async def handle_websocket(websocket):
                 elif data.get("action") == "auth":
                     # Formato de autenticação legada
                     await handle_legacy_auth(websocket, data)
+                elif data.get("action") == "resume":
+                    # Retoma do change feed após reconexão ({"resume_from": <seq>})
+                    await handle_resume_request(websocket, data.get("data", {}))
+                elif data.get("action") == "metrics":
+                    # Métricas das filas de envio (requer acesso administrativo)
+                    await handle_metrics_request(websocket)
+                elif data.get("action") in ("subscribe", "unsubscribe"):
+                    # Filtros de subscrição de eventos (ex.: "product.delete.*", "product.*.42")
+                    await handle_subscription_request(websocket, data["action"], data.get("data", {}))
                 elif "action" in data:
                     # Pedido API (requer autorização OAuth2)
                     action = data["action"]
                     await handle_api_request(websocket, action, data.get("data", {}))
                 else:
-                    await websocket.send(json.dumps({
+                    await websocket.send(dumps({
                         "error": "invalid_request",
                         "error_description": "Missing grant_type or action"
                     }))
                     
             except json.JSONDecodeError:
-                await websocket.send(json.dumps({
+                await websocket.send(dumps({
                     "error": "invalid_request",
                     "error_description": "Invalid JSON format"
                 }))
             except Exception as e:
                 logger.error(f"Error in message handling: {str(e)}")
-                await websocket.send(json.dumps({
+                await websocket.send(dumps({
                     "error": "server_error",
                     "error_description": str(e)
                 }))
@@ -381,69 +705,104 @@ async def handle_websocket(websocket):
     finally:
         await unregister(websocket)
 
-def rabbitmq_callback(message):
-    """Reencaminha mensagens RabbitMQ para clientes WebSocket"""
+async def ack_pending_messages():
+    """Confirma de uma só vez (multiple=True) todas as mensagens já reencaminhadas"""
+    global last_unacked_message, unacked_count
+    message, last_unacked_message, unacked_count = last_unacked_message, None, 0
+    if message is not None:
+        try:
+            await message.ack(multiple=True)
+        except Exception as e:
+            # Canal perdido: as mensagens não confirmadas serão reentregues pelo broker
+            logger.error(f"Error acknowledging RabbitMQ messages: {str(e)}")
+
+async def periodic_ack_flush():
+    """Confirma mensagens pendentes mesmo quando o lote não chega a encher"""
+    while True:
+        await asyncio.sleep(RABBITMQ_ACK_INTERVAL)
+        await ack_pending_messages()
+
+async def handle_rabbitmq_message(message):
+    """Reencaminha uma mensagem RabbitMQ para os clientes WebSocket"""
+    global last_unacked_message, unacked_count
     try:
-        loop = asyncio.get_event_loop()
-        if loop.is_running():
-            asyncio.run_coroutine_threadsafe(notify_clients(message), loop)
+        # O payload original é reencaminhado tal como chegou aos clientes do mesmo formato
+        if message.content_type == PROTOBUF_CONTENT_TYPE:
+            payload = decode_event(message.body)
+            json_data, protobuf_data = None, message.body
         else:
-            logger.error("Event loop is not running, cannot notify clients")
+            json_data, protobuf_data = message.body.decode('utf-8'), None
+            payload = loads(json_data)
+        logger.debug(f"Received RabbitMQ message: {payload}")
+        # Mensagens antigas publicadas no exchange por omissão não têm routing key de produto
+        routing_key = message.routing_key if (message.routing_key or '').startswith('product.') else None
+        if routing_key is None:
+            routing_key = routing_key_for(payload)
+        if record_change(payload, routing_key):
+            await notify_clients(payload, routing_key, json_data, protobuf_data)
     except Exception as e:
-        logger.error(f"Error in rabbitmq_callback: {str(e)}")
+        logger.error(f"Error processing RabbitMQ message: {str(e)}")
+
+    # Acks acumulados: um só round-trip por lote em vez de um por evento
+    last_unacked_message = message
+    unacked_count += 1
+    if unacked_count >= RABBITMQ_ACK_BATCH:
+        await ack_pending_messages()
 
-def start_rabbitmq_consumer():
-    """Inicia consumidor RabbitMQ com tentativas de reconexão automática"""
+async def start_rabbitmq_consumer():
+    """Inicia consumidor RabbitMQ asyncio no mesmo event loop do servidor WebSocket"""
     retry_count = 0
     max_retries = 10
-    
+
     while retry_count < max_retries:
         try:
             logger.info(f"Attempting to connect to RabbitMQ (attempt {retry_count + 1}/{max_retries})")
-            credentials = pika.PlainCredentials('admin', 'admin')
-            connection = pika.BlockingConnection(
-                pika.ConnectionParameters('rabbitmq', credentials=credentials)
-            )
-            channel = connection.channel()
-            channel.queue_declare(queue='product_updates', durable=True)
-
-            def on_message(ch, method, properties, body):
-                """Processa mensagens recebidas do RabbitMQ"""
-                try:
-                    message = json.loads(body)
-                    logger.info(f"Received RabbitMQ message: {message}")
-                    rabbitmq_callback(message)
-                    ch.basic_ack(delivery_tag=method.delivery_tag)
-                except Exception as e:
-                    logger.error(f"Error processing RabbitMQ message: {str(e)}")
-
-            # Configura QoS para processamento sequencial
-            channel.basic_qos(prefetch_count=1)
-            channel.basic_consume(queue='product_updates', on_message_callback=on_message)
-            logger.info('RabbitMQ consumer started, waiting for messages...')
-            retry_count = 0
-            channel.start_consuming()
-            
+            # Ligação robusta: reconecta e retoma o consumo automaticamente após a ligação inicial
+            connection = await aio_pika.connect_robust(host=RABBITMQ_HOST, login=RABBITMQ_USER, password=RABBITMQ_PASS)
+            break
         except Exception as e:
             retry_count += 1
             logger.error(f"RabbitMQ connection error (attempt {retry_count}): {str(e)}")
             if retry_count < max_retries:
                 wait_time = min(30, 5 * retry_count)
                 logger.info(f"Retrying in {wait_time} seconds...")
-                time.sleep(wait_time)
+                await asyncio.sleep(wait_time)
             else:
                 logger.error("Max retries reached. RabbitMQ consumer will not be available.")
-                break
+                return
+
+    async with connection:
+        channel = await connection.channel()
+        # Prefetch permite ter várias mensagens em trânsito enquanto se reencaminham as anteriores
+        await channel.set_qos(prefetch_count=RABBITMQ_PREFETCH)
+        exchange = await channel.declare_exchange(PRODUCT_EXCHANGE, aio_pika.ExchangeType.TOPIC, durable=True)
+        queue = await channel.declare_queue('product_updates', durable=True)
+        await queue.bind(exchange, routing_key=ALL_PRODUCT_EVENTS)
+
+        flush_task = asyncio.create_task(periodic_ack_flush())
+        logger.info('RabbitMQ consumer started, waiting for messages...')
+        try:
+            async with queue.iterator() as queue_iter:
+                async for message in queue_iter:
+                    await handle_rabbitmq_message(message)
+        finally:
+            flush_task.cancel()
 
 async def main():
     """Função principal que inicia o servidor WebSocket e consumidor RabbitMQ"""
-    server = await websockets.serve(handle_websocket, "0.0.0.0", 6789)
+    # Clientes dos serviços criados uma vez (WSDL descarregado no arranque, fora do event loop)
+    await backends.run(backends.warm_up)
+
+    server = await websockets.serve(handle_websocket, "0.0.0.0", 6789, select_subprotocol=select_subprotocol)
     logger.info("OAuth2 + JWT WebSocket server started on ws://0.0.0.0:6789")
 
-    # Inicia consumidor RabbitMQ numa thread separada
-    threading.Thread(target=start_rabbitmq_consumer, daemon=True).start()
+    # Inicia consumidor RabbitMQ no mesmo event loop
+    consumer_task = asyncio.create_task(start_rabbitmq_consumer())
 
-    await server.wait_closed()
+    try:
+        await server.wait_closed()
+    finally:
+        backends.close()
 
 if __name__ == "__main__":
     # Executa o servidor se o script for executado directamente
@@ -0,0 +1 @@
+"""Módulos partilhados pelos serviços backend (REST, SOAP, gRPC, GraphQL)"""
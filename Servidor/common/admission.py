@@ -0,0 +1,280 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from common.serialization import dumps_bytes
+
+# Controlo de admissão (sobreponível por variáveis de ambiente, por serviço)
+ADMISSION_MAX_CONCURRENCY = int(os.getenv('ADMISSION_MAX_CONCURRENCY', '32'))  # Pedidos em execução em simultâneo
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', '1.0'))  # Espera máxima por um lugar (segundos)
+ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', '64'))  # Pedidos em espera acima disto são rejeitados de imediato
+
+WAIT_SAMPLES = 1024  # Tempos de espera recentes usados nos percentis
+
+
+class Overloaded(Exception):
+    """O pedido não obteve lugar dentro do tempo de espera (ou a fila está cheia)"""
+
+    def __init__(self, name, queue_wait):
+        super().__init__(f"{name} overloaded: request shed after {queue_wait * 1000:.1f} ms in queue")
+        self.queue_wait = queue_wait
+
+
+class _AdmissionBase:
+    """Contadores e tempos de espera partilhados pelas variantes síncrona e assíncrona"""
+
+    def __init__(self, name, max_concurrency=ADMISSION_MAX_CONCURRENCY,
+                 queue_timeout=ADMISSION_QUEUE_TIMEOUT, max_queue=ADMISSION_MAX_QUEUE):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self._counters_lock = threading.Lock()
+        self._counters = {'admitted': 0, 'rejected': 0, 'in_flight': 0, 'queued': 0}
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+
+    def _count(self, name, amount=1):
+        with self._counters_lock:
+            self._counters[name] += amount
+
+    def _try_enqueue(self):
+        """Ocupa um lugar na fila de espera; False se a fila estiver cheia"""
+        with self._counters_lock:
+            if self._counters['queued'] >= self.max_queue:
+                return False
+            self._counters['queued'] += 1
+            return True
+
+    def _admitted(self, queue_wait):
+        with self._counters_lock:
+            self._counters['admitted'] += 1
+            self._counters['in_flight'] += 1
+            self._waits.append(queue_wait)
+
+    def _rejected(self, queue_wait):
+        self._count('rejected')
+        return Overloaded(self.name, queue_wait)
+
+    def stats(self):
+        """Devolve os contadores e o tempo de espera em fila (ms) dos pedidos recentes"""
+        with self._counters_lock:
+            stats = dict(self._counters)
+            waits = sorted(self._waits)
+        stats['max_concurrency'] = self.max_concurrency
+        if waits:
+            stats['queue_wait_ms'] = {
+                'avg': round(sum(waits) / len(waits) * 1000, 3),
+                'p50': round(waits[len(waits) // 2] * 1000, 3),
+                'p99': round(waits[min(len(waits) - 1, int(len(waits) * 0.99))] * 1000, 3),
+                'max': round(waits[-1] * 1000, 3),
+            }
+        return stats
+
+
+class AdmissionController(_AdmissionBase):
+    """Limita os pedidos em execução num serviço síncrono (threads).
+
+    Até max_concurrency pedidos executam em simultâneo; os seguintes esperam
+    no máximo queue_timeout segundos por um lugar e, com max_queue pedidos já
+    em espera, são rejeitados de imediato. Um pedido rejeitado falha logo
+    (Overloaded) em vez de alongar uma fila cuja latência só cresceria.
+    """
+
+    def __init__(self, name, **kwargs):
+        super().__init__(name, **kwargs)
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+
+    def acquire(self, enqueued_at=None):
+        """
+        Obtém um lugar para o pedido
+
+        Args:
+            enqueued_at (float): time.monotonic() da chegada, quando o pedido já
+                esperou noutra fila (ex.: a do ThreadPoolExecutor do gRPC)
+
+        Returns:
+            float: Tempo de espera em fila (segundos)
+
+        Raises:
+            Overloaded: Se o pedido não obtiver lugar a tempo
+        """
+        now = time.monotonic()
+        arrived = enqueued_at if enqueued_at is not None else now
+        remaining = self.queue_timeout - (now - arrived)
+        if remaining <= 0:
+            raise self._rejected(now - arrived)
+        if not self._slots.acquire(blocking=False):
+            if not self._try_enqueue():
+                raise self._rejected(now - arrived)
+            try:
+                acquired = self._slots.acquire(timeout=remaining)
+            finally:
+                self._count('queued', -1)
+            if not acquired:
+                raise self._rejected(time.monotonic() - arrived)
+        queue_wait = time.monotonic() - arrived
+        self._admitted(queue_wait)
+        return queue_wait
+
+    def release(self):
+        self._count('in_flight', -1)
+        self._slots.release()
+
+    @contextmanager
+    def admit(self, enqueued_at=None):
+        """Executa o bloco com um lugar ocupado; devolve o tempo de espera em fila"""
+        queue_wait = self.acquire(enqueued_at)
+        try:
+            yield queue_wait
+        finally:
+            self.release()
+
+
+class AsyncAdmissionController(_AdmissionBase):
+    """Equivalente de AdmissionController para serviços asyncio (FastAPI)"""
+
+    def __init__(self, name, **kwargs):
+        super().__init__(name, **kwargs)
+        self._slots = None  # Criado no event loop do servidor, no primeiro pedido
+
+    async def acquire(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        arrived = time.monotonic()
+        if self._slots.locked():
+            if not self._try_enqueue():
+                raise self._rejected(0.0)
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise self._rejected(time.monotonic() - arrived)
+            finally:
+                self._count('queued', -1)
+        else:
+            await self._slots.acquire()
+        queue_wait = time.monotonic() - arrived
+        self._admitted(queue_wait)
+        return queue_wait
+
+    def release(self):
+        self._count('in_flight', -1)
+        self._slots.release()
+
+    @asynccontextmanager
+    async def admit(self):
+        queue_wait = await self.acquire()
+        try:
+            yield queue_wait
+        finally:
+            self.release()
+
+
+def server_timing(queue_wait):
+    """Cabeçalho Server-Timing com o tempo de espera em fila do pedido"""
+    return ('Server-Timing', f"queue;dur={queue_wait * 1000:.3f}")
+
+
+OVERLOADED_BODY = dumps_bytes({'erro': 'Servico sobrecarregado, tente novamente'})
+
+
+def reject_json(environ, start_response, error):
+    """Resposta WSGI por omissão a um pedido rejeitado: 429 com Retry-After"""
+    start_response('429 Too Many Requests', [
+        ('Content-Type', 'application/json'),
+        ('Content-Length', str(len(OVERLOADED_BODY))),
+        ('Retry-After', '1'),
+        server_timing(error.queue_wait),
+    ])
+    return [OVERLOADED_BODY]
+
+
+class _ReleaseOnClose:
+    """Iterável WSGI que liberta o lugar quando o servidor termina de enviar a resposta"""
+
+    def __init__(self, result, release):
+        self._result = result
+        self._release = release
+
+    def __iter__(self):
+        return iter(self._result)
+
+    def close(self):
+        try:
+            if hasattr(self._result, 'close'):
+                self._result.close()
+        finally:
+            self._release()
+
+
+class WSGIAdmissionMiddleware:
+    """Controlo de admissão para aplicações WSGI (Flask, Spyne)
+
+    Args:
+        reject: Função (environ, start_response, Overloaded) que produz a resposta de rejeição
+        exempt_paths: Caminhos GET nunca rejeitados (health checks)
+    """
+
+    def __init__(self, app, controller, reject=reject_json, exempt_paths=()):
+        self.app = app
+        self.controller = controller
+        self.reject = reject
+        self.exempt_paths = exempt_paths
+
+    def __call__(self, environ, start_response):
+        if environ.get('REQUEST_METHOD') == 'GET' and environ.get('PATH_INFO') in self.exempt_paths:
+            return self.app(environ, start_response)
+        try:
+            queue_wait = self.controller.acquire()
+        except Overloaded as e:
+            return self.reject(environ, start_response, e)
+
+        def start_with_timing(status, headers, exc_info=None):
+            return start_response(status, list(headers) + [server_timing(queue_wait)], exc_info)
+
+        try:
+            result = self.app(environ, start_with_timing)
+        except BaseException:
+            self.controller.release()
+            raise
+        return _ReleaseOnClose(result, self.controller.release)
+
+
+class ASGIAdmissionMiddleware:
+    """Controlo de admissão para aplicações ASGI (FastAPI)"""
+
+    def __init__(self, app, controller, exempt_paths=()):
+        self.app = app
+        self.controller = controller
+        self.exempt_paths = exempt_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or (scope['method'] == 'GET' and scope['path'] in self.exempt_paths):
+            await self.app(scope, receive, send)
+            return
+        try:
+            queue_wait = await self.controller.acquire()
+        except Overloaded as e:
+            name, value = server_timing(e.queue_wait)
+            await send({'type': 'http.response.start', 'status': 429, 'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(OVERLOADED_BODY)).encode('latin-1')),
+                (b'retry-after', b'1'),
+                (name.lower().encode('latin-1'), value.encode('latin-1')),
+            ]})
+            await send({'type': 'http.response.body', 'body': OVERLOADED_BODY})
+            return
+
+        async def send_with_timing(message):
+            if message['type'] == 'http.response.start':
+                name, value = server_timing(queue_wait)
+                message = dict(message, headers=list(message.get('headers', []))
+                               + [(name.lower().encode('latin-1'), value.encode('latin-1'))])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            self.controller.release()
@@ -0,0 +1,112 @@
+import os
+import re
+
+from pymongo import ASCENDING, DESCENDING
+
+# Pesquisa filtrada no catálogo (sobreponível por variáveis de ambiente)
+SEARCH_LIMIT_DEFAULT = int(os.getenv('SEARCH_LIMIT_DEFAULT', '100'))
+SEARCH_LIMIT_MAX = int(os.getenv('SEARCH_LIMIT_MAX', '1000'))
+
+PRODUTO_FIELDS = ('id', 'name', 'price', 'stock')
+TEXT_SCORE = {'$meta': 'textScore'}
+
+
+def build_filter(min_price=None, max_price=None, stock_below=None, name_prefix=None, text=None):
+    """
+    Constrói o filtro MongoDB a partir dos critérios indicados (todos opcionais, combinados com E)
+
+    Args:
+        min_price, max_price: Intervalo de preço (inclusivo), índice (price, id)
+        stock_below: Produtos com stock estritamente abaixo deste valor, índice (stock, id)
+        name_prefix: Início do nome (sensível a maiúsculas), índice (name, id)
+        text: Pesquisa de palavras no nome, índice de texto name_text
+
+    Raises:
+        ValueError: Se o intervalo de preço for inválido
+    """
+    filtro = {}
+    if min_price is not None or max_price is not None:
+        if min_price is not None and max_price is not None and min_price > max_price:
+            raise ValueError('min_price nao pode ser maior do que max_price')
+        filtro['price'] = {}
+        if min_price is not None:
+            filtro['price']['$gte'] = float(min_price)
+        if max_price is not None:
+            filtro['price']['$lte'] = float(max_price)
+    if stock_below is not None:
+        filtro['stock'] = {'$lt': stock_below}
+    if name_prefix:
+        # Expressão ancorada e sem opções: o MongoDB percorre só o intervalo do índice
+        filtro['name'] = {'$regex': '^' + re.escape(name_prefix)}
+    if text:
+        filtro['$text'] = {'$search': text}
+    return filtro
+
+
+def build_projection(fields):
+    """
+    Converte fields=name,price numa projecção MongoDB (o id é sempre incluído)
+
+    Raises:
+        ValueError: Se algum campo não existir no schema do produto
+    """
+    projecao = {'_id': 0}
+    if not fields:
+        projecao.update({field: 1 for field in PRODUTO_FIELDS})
+        return projecao
+    for field in fields.split(','):
+        field = field.strip()
+        if field not in PRODUTO_FIELDS:
+            raise ValueError(f'Campo desconhecido: {field}')
+        projecao[field] = 1
+    projecao['id'] = 1
+    return projecao
+
+
+def build_sort(sort, text=None):
+    """
+    Converte sort=price ou sort=-price na ordenação MongoDB
+
+    O id desempata (e corresponde aos índices compostos (campo, id)); sem sort,
+    uma pesquisa de texto é ordenada por relevância e as restantes por id.
+
+    Raises:
+        ValueError: Se o campo de ordenação não existir
+    """
+    if not sort:
+        if text:
+            return [('score', TEXT_SCORE), ('id', ASCENDING)]
+        return [('id', ASCENDING)]
+    direction = DESCENDING if sort.startswith('-') else ASCENDING
+    field = sort.lstrip('+-')
+    if field not in PRODUTO_FIELDS:
+        raise ValueError(f'Campo de ordenacao desconhecido: {field}')
+    if field == 'id':
+        return [('id', direction)]
+    return [(field, direction), ('id', direction)]
+
+
+def build_limit(limit):
+    """
+    Raises:
+        ValueError: Se limit não for positivo
+    """
+    if limit is None:
+        return SEARCH_LIMIT_DEFAULT
+    if limit < 1:
+        raise ValueError('limit deve ser positivo')
+    return min(limit, SEARCH_LIMIT_MAX)
+
+
+def search(collection, min_price=None, max_price=None, stock_below=None, name_prefix=None, text=None,
+           fields=None, sort=None, limit=None):
+    """
+    Devolve o cursor com os produtos que satisfazem os critérios
+
+    Raises:
+        ValueError: Se algum parâmetro for inválido
+    """
+    filtro = build_filter(min_price, max_price, stock_below, name_prefix, text)
+    return (collection.find(filtro, build_projection(fields))
+            .sort(build_sort(sort, text))
+            .limit(build_limit(limit)))
@@ -0,0 +1,179 @@
+import gzip
+import os
+
+# Brotli é opcional: sem o módulo só é negociado gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Respostas mais pequenas do que isto não compensam o custo de compressão
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', '4'))  # 11 (omissão do brotli) é demasiado lento por pedido
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/xml', 'application/soap+xml', 'text/')
+ENCODINGS = ('br', 'gzip')
+
+
+def etag_for_encoding(etag, encoding):
+    """
+    ETag da representação comprimida: o valor forte recebe o sufixo -<codificação>
+
+    Um ETag forte identifica os bytes exactos do corpo; sem o sufixo as versões
+    identity, gzip e br teriam o mesmo validador e caches ou pedidos Range
+    podiam misturá-las. Os ETags fracos (W/) ficam inalterados.
+    """
+    if etag.startswith('W/') or not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def strip_encoding_suffix(etag):
+    """Valor base de um ETag (sem aspas), sem o sufixo acrescentado por etag_for_encoding"""
+    for encoding in ENCODINGS:
+        if etag.endswith(f'-{encoding}'):
+            return etag[:-len(encoding) - 1]
+    return etag
+
+
+def choose_encoding(accept_encoding):
+    """
+    Escolhe a codificação a partir do cabeçalho Accept-Encoding (valores q incluídos)
+
+    Returns:
+        str: 'br', 'gzip' ou None se o cliente não aceitar nenhuma
+    """
+    if not accept_encoding:
+        return None
+    preferences = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        preferences[name.strip().lower()] = quality
+
+    def quality_of(encoding):
+        return preferences.get(encoding, preferences.get('*', 0.0))
+
+    candidates = [encoding for encoding in ENCODINGS
+                  if (encoding != 'br' or brotli is not None) and quality_of(encoding) > 0]
+    # Em caso de empate prevalece brotli (melhor compressão de JSON/XML)
+    return max(candidates, key=quality_of, default=None)
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def _compress_response(status_code, headers, body, encoding, min_size):
+    """
+    Comprime o corpo se for elegível e ajusta os cabeçalhos
+
+    Args:
+        headers (list): Pares (nome, valor) em str
+
+    Returns:
+        tuple: (headers, body)
+    """
+    names = {name.lower(): value for name, value in headers}
+    content_type = names.get('content-type', '').lower()
+    if not content_type.startswith(COMPRESSIBLE_TYPES):
+        return headers, body
+    # O corpo depende do Accept-Encoding: indicado às caches intermédias
+    vary = names.get('vary')
+    headers = [(name, value) for name, value in headers if name.lower() != 'vary']
+    headers.append(('Vary', f"{vary}, Accept-Encoding" if vary else 'Accept-Encoding'))
+    if (encoding is None or status_code in (204, 304) or len(body) < min_size
+            or 'content-encoding' in names):
+        return headers, body
+    body = compress(body, encoding)
+    headers = [
+        (name, etag_for_encoding(value, encoding) if name.lower() == 'etag' else value)
+        for name, value in headers if name.lower() != 'content-length'
+    ]
+    headers += [('Content-Encoding', encoding), ('Content-Length', str(len(body)))]
+    return headers, body
+
+
+class WSGICompressionMiddleware:
+    """Compressão gzip/brotli negociada para aplicações WSGI (Flask, Spyne)
+
+    A resposta é lida por completo antes de ser comprimida, pelo que não deve
+    envolver respostas em streaming.
+    """
+
+    def __init__(self, app, min_size=COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.min_size = min_size
+
+    def __call__(self, environ, start_response):
+        encoding = choose_encoding(environ.get('HTTP_ACCEPT_ENCODING'))
+        captured = {}
+        chunks = []
+
+        def capture(status, headers, exc_info=None):
+            captured['status'], captured['headers'], captured['exc_info'] = status, headers, exc_info
+            return chunks.append
+
+        result = self.app(environ, capture)
+        try:
+            chunks.extend(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+        status = captured['status']
+        headers, body = _compress_response(
+            int(status.split(' ', 1)[0]), list(captured['headers']), b''.join(chunks), encoding, self.min_size
+        )
+        start_response(status, headers, captured['exc_info'])
+        return [body]
+
+
+class ASGICompressionMiddleware:
+    """Compressão gzip/brotli negociada para aplicações ASGI (FastAPI)
+
+    Tal como a versão WSGI, junta o corpo da resposta antes de o comprimir.
+    """
+
+    def __init__(self, app, min_size=COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.min_size = min_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        encoding = None
+        for name, value in scope.get('headers', []):
+            if name == b'accept-encoding':
+                encoding = choose_encoding(value.decode('latin-1'))
+        start = None
+        chunks = []
+
+        async def capture(message):
+            nonlocal start
+            if message['type'] == 'http.response.start':
+                start = message
+                return
+            if message['type'] != 'http.response.body':
+                await send(message)
+                return
+            chunks.append(message.get('body', b''))
+            if message.get('more_body', False):
+                return
+            headers = [(name.decode('latin-1'), value.decode('latin-1')) for name, value in start.get('headers', [])]
+            headers, body = _compress_response(start['status'], headers, b''.join(chunks), encoding, self.min_size)
+            await send(dict(start, headers=[(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                            for name, value in headers]))
+            await send({'type': 'http.response.body', 'body': body})
+
+        await self.app(scope, receive, capture)
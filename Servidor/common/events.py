@@ -0,0 +1,94 @@
+import json
+from datetime import datetime
+
+import produtos_pb2
+
+# Versão actual do formato ProductEvent
+EVENT_VERSION = 1
+
+# Content types do payload AMQP
+PROTOBUF_CONTENT_TYPE = 'application/x-protobuf'
+JSON_CONTENT_TYPE = 'application/json'
+
+
+def build_event(action, produto_id=None, produto=None, user_id=None, count=None, produto_ids=None):
+    """
+    Constrói a notificação de um evento de produto (dicionário serializável em JSON)
+
+    Args:
+        action (str): create, bulk_create, update, bulk_update, delete ou read_all
+        produto_id (int): ID do produto afectado
+        produto (dict): Dados do produto (sem o _id do MongoDB)
+        user_id (str): Utilizador que originou o evento
+        count (int): Número de produtos (read_all, bulk_create, bulk_update)
+        produto_ids (list): IDs dos produtos afectados por uma operação em lote
+    """
+    event = {'version': EVENT_VERSION, 'action': action}
+    if produto_id is not None:
+        event['produto_id'] = produto_id
+    if produto is not None:
+        event['produto'] = produto
+    if user_id is not None:
+        event['user_id'] = user_id
+    if count is not None:
+        event['count'] = count
+    if produto_ids is not None:
+        event['produto_ids'] = list(produto_ids)
+    event['timestamp'] = datetime.utcnow().isoformat() + 'Z'
+    return event
+
+
+def encode_event(event):
+    """Serializa a notificação como mensagem protobuf ProductEvent"""
+    message = produtos_pb2.ProductEvent(
+        version=event.get('version', EVENT_VERSION),
+        action=event.get('action', ''),
+        user_id=event.get('user_id', ''),
+        timestamp=event.get('timestamp', '')
+    )
+    if event.get('produto_id') is not None:
+        message.produto_id = event['produto_id']
+    if event.get('count') is not None:
+        message.count = event['count']
+    if event.get('seq') is not None:
+        message.seq = event['seq']
+    if event.get('produto_ids'):
+        message.produto_ids.extend(event['produto_ids'])
+    produto = event.get('produto')
+    if produto:
+        message.produto.CopyFrom(produtos_pb2.Produto(
+            id=produto.get('id', 0),
+            name=produto.get('name', ''),
+            price=produto.get('price', 0.0),
+            stock=produto.get('stock', 0)
+        ))
+    return message.SerializeToString()
+
+
+def decode_event(body, content_type=PROTOBUF_CONTENT_TYPE):
+    """Converte o payload AMQP (protobuf ou JSON legado) na notificação em dicionário"""
+    if content_type != PROTOBUF_CONTENT_TYPE:
+        return json.loads(body)
+
+    message = produtos_pb2.ProductEvent.FromString(body)
+    event = {'version': message.version, 'action': message.action}
+    if message.HasField('produto_id'):
+        event['produto_id'] = message.produto_id
+    if message.HasField('produto'):
+        event['produto'] = {
+            'id': message.produto.id,
+            'name': message.produto.name,
+            # price é float32 no protobuf: arredonda à precisão do tipo (19.99 e não 19.9899997)
+            'price': float(f"{message.produto.price:.7g}"),
+            'stock': message.produto.stock
+        }
+    if message.user_id:
+        event['user_id'] = message.user_id
+    if message.HasField('count'):
+        event['count'] = message.count
+    if message.HasField('seq'):
+        event['seq'] = message.seq
+    if message.produto_ids:
+        event['produto_ids'] = list(message.produto_ids)
+    event['timestamp'] = message.timestamp
+    return event
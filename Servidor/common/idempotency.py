@@ -0,0 +1,271 @@
+import hashlib
+import logging
+import os
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Colecção com as respostas já enviadas para cada Idempotency-Key (expiram por TTL)
+IDEMPOTENCY_COLLECTION = 'idempotency_keys'
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', str(24 * 3600)))
+# Um pedido 'pending' mais antigo do que isto é considerado abandonado (ex.: processo terminado)
+IDEMPOTENCY_PENDING_TIMEOUT = int(os.getenv('IDEMPOTENCY_PENDING_TIMEOUT', '60'))
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_METADATA = 'idempotency-key'  # Metadados gRPC têm de estar em minúsculas
+MAX_KEY_LENGTH = 255
+# Erros por item guardados com a resposta de uma importação em lote (os contadores ficam completos);
+# sem limite um lote com muitos rejeitados excederia os 16 MB de um documento MongoDB
+IDEMPOTENCY_MAX_STORED_ERRORS = int(os.getenv('IDEMPOTENCY_MAX_STORED_ERRORS', '100'))
+
+
+class InvalidIdempotencyKey(ValueError):
+    """Chave vazia ou demasiado longa"""
+
+
+class RequestInProgress(Exception):
+    """Outro pedido com a mesma chave ainda não terminou"""
+
+
+class IdempotencyKeyReused(ValueError):
+    """A chave já foi usada num pedido com outro conteúdo"""
+
+
+def request_hasher(scope):
+    """
+    Hash incremental que identifica o pedido associado a uma chave
+
+    Começa com o âmbito; o chamador acrescenta os bytes do corpo tal como foram
+    enviados (uma repetição envia os mesmos bytes) à medida que os lê.
+    """
+    hasher = hashlib.sha256(scope.encode('utf-8'))
+    hasher.update(b'\0')
+    return hasher
+
+
+def request_fingerprint(scope, body):
+    """Impressão digital de um pedido cujo corpo já está todo em memória (ex.: mensagem gRPC)"""
+    hasher = request_hasher(scope)
+    hasher.update(body)
+    return hasher.hexdigest()
+
+
+def verify_fingerprint(response, fingerprint):
+    """
+    Confirma que a resposta guardada pertence a um pedido com o mesmo conteúdo
+
+    Raises:
+        IdempotencyKeyReused: Se a chave foi usada com outro corpo
+    """
+    guardada = response.get('fingerprint')
+    if guardada is not None and guardada != fingerprint:
+        raise IdempotencyKeyReused("Idempotency key was already used for a different request")
+
+
+class HashingReader:
+    """Stream do corpo de um pedido WSGI que actualiza o hash com os bytes lidos"""
+
+    def __init__(self, stream, hasher):
+        self.stream = stream
+        self.hasher = hasher
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.hasher.update(data)
+        return data
+
+    def readline(self, size=-1):
+        line = self.stream.readline(size)
+        self.hasher.update(line)
+        return line
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+    def drain(self, chunk_size=65536):
+        """Lê (e inclui no hash) o resto do corpo que a rota não consumiu"""
+        while self.read(chunk_size):
+            pass
+
+
+class HashingReceive:
+    """Canal receive de um pedido ASGI que actualiza o hash com o corpo recebido"""
+
+    def __init__(self, receive, hasher):
+        self.receive = receive
+        self.hasher = hasher
+        self.complete = False
+
+    async def __call__(self):
+        message = await self.receive()
+        if message['type'] == 'http.request':
+            self.hasher.update(message.get('body', b''))
+            self.complete = not message.get('more_body', False)
+        elif message['type'] == 'http.disconnect':
+            self.complete = True
+        return message
+
+    async def drain(self):
+        """Recebe (e inclui no hash) o resto do corpo que a rota não consumiu"""
+        while not self.complete:
+            await self()
+
+
+def _doc_id(scope, key):
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise InvalidIdempotencyKey(f"Idempotency key must have 1 to {MAX_KEY_LENGTH} characters")
+    return f"{scope}:{key}"
+
+
+def claim(db, scope, key, fingerprint=None):
+    """
+    Reserva a chave para o pedido actual
+
+    Args:
+        scope (str): Operação a que a chave pertence (ex.: rest:/create, grpc:UpdateProduto)
+        key (str): Valor do cabeçalho Idempotency-Key ou dos metadados gRPC
+        fingerprint (str): Impressão digital do pedido, se já for conhecida; sem
+            ela o chamador verifica a resposta devolvida com verify_fingerprint
+
+    Returns:
+        dict: None se o pedido deve ser executado; caso contrário a resposta
+            guardada da primeira execução ({'status_code', 'body', 'fingerprint'})
+
+    Raises:
+        InvalidIdempotencyKey: Se a chave for inválida
+        RequestInProgress: Se um pedido com a mesma chave ainda estiver em curso
+        IdempotencyKeyReused: Se a chave foi usada num pedido com outro conteúdo
+    """
+    doc_id = _doc_id(scope, key)
+    collection = db[IDEMPOTENCY_COLLECTION]
+    now = datetime.utcnow()
+    try:
+        collection.insert_one({'_id': doc_id, 'state': 'pending', 'created_at': now})
+        return None
+    except DuplicateKeyError:
+        pass
+
+    # Retoma um pedido abandonado a meio (a reserva expirou sem resposta guardada)
+    retomado = collection.find_one_and_update(
+        {'_id': doc_id, 'state': 'pending', 'created_at': {'$lt': now - timedelta(seconds=IDEMPOTENCY_PENDING_TIMEOUT)}},
+        {'$set': {'created_at': now}},
+        return_document=ReturnDocument.AFTER
+    )
+    if retomado is not None:
+        return None
+    doc = collection.find_one({'_id': doc_id})
+    if doc is None:
+        # Expirou pelo TTL entre as duas operações
+        return claim(db, scope, key, fingerprint)
+    if doc['state'] == 'done':
+        if fingerprint is not None:
+            verify_fingerprint(doc['response'], fingerprint)
+        return doc['response']
+    raise RequestInProgress(f"Request with idempotency key {key} is still in progress")
+
+
+def stored_body(body):
+    """
+    Corpo da resposta a guardar para as repetições
+
+    A lista erros (ex.: POST /create/bulk) fica limitada às primeiras
+    IDEMPOTENCY_MAX_STORED_ERRORS entradas e erros_truncados indica o corte.
+    """
+    erros = body.get('erros') if isinstance(body, dict) else None
+    if isinstance(erros, list) and len(erros) > IDEMPOTENCY_MAX_STORED_ERRORS:
+        body = dict(body, erros=erros[:IDEMPOTENCY_MAX_STORED_ERRORS], erros_truncados=True)
+    return body
+
+
+def _response(status_code, body, fingerprint):
+    return {'status_code': status_code, 'body': stored_body(body), 'fingerprint': fingerprint}
+
+
+def store(db, scope, key, status_code, body, fingerprint=None):
+    """
+    Guarda a resposta enviada, devolvida tal e qual a pedidos repetidos com a mesma chave
+
+    A impressão digital do pedido fica com a resposta: uma repetição com outro
+    conteúdo é recusada em vez de receber a resposta de um pedido diferente.
+    """
+    db[IDEMPOTENCY_COLLECTION].update_one(
+        {'_id': _doc_id(scope, key)},
+        {'$set': {'state': 'done', 'response': _response(status_code, body, fingerprint)}}
+    )
+
+
+def release(db, scope, key):
+    """Liberta a chave após uma falha inesperada, para que uma repetição volte a executar o pedido"""
+    db[IDEMPOTENCY_COLLECTION].delete_one({'_id': _doc_id(scope, key), 'state': 'pending'})
+
+
+def store_or_release(db, scope, key, status_code, body, fingerprint=None):
+    """
+    Guarda a resposta de um pedido já executado sem nunca falhar
+
+    A escrita já foi confirmada: se não for possível guardar a resposta, o
+    erro é registado, a chave é libertada e o cliente recebe na mesma a
+    resposta verdadeira (em vez de um 500 por uma escrita bem sucedida).
+    """
+    try:
+        store(db, scope, key, status_code, body, fingerprint)
+    except Exception as e:  # PyMongoError ou DocumentTooLarge (erro BSON)
+        logger.error(f"Could not store idempotent response for {scope}: {e}")
+        try:
+            release(db, scope, key)
+        except PyMongoError:
+            pass
+
+
+async def claim_async(db, scope, key, fingerprint=None):
+    """Equivalente de claim para o cliente assíncrono (AsyncMongoClient)"""
+    doc_id = _doc_id(scope, key)
+    collection = db[IDEMPOTENCY_COLLECTION]
+    now = datetime.utcnow()
+    try:
+        await collection.insert_one({'_id': doc_id, 'state': 'pending', 'created_at': now})
+        return None
+    except DuplicateKeyError:
+        pass
+
+    retomado = await collection.find_one_and_update(
+        {'_id': doc_id, 'state': 'pending', 'created_at': {'$lt': now - timedelta(seconds=IDEMPOTENCY_PENDING_TIMEOUT)}},
+        {'$set': {'created_at': now}},
+        return_document=ReturnDocument.AFTER
+    )
+    if retomado is not None:
+        return None
+    doc = await collection.find_one({'_id': doc_id})
+    if doc is None:
+        return await claim_async(db, scope, key, fingerprint)
+    if doc['state'] == 'done':
+        if fingerprint is not None:
+            verify_fingerprint(doc['response'], fingerprint)
+        return doc['response']
+    raise RequestInProgress(f"Request with idempotency key {key} is still in progress")
+
+
+async def store_async(db, scope, key, status_code, body, fingerprint=None):
+    await db[IDEMPOTENCY_COLLECTION].update_one(
+        {'_id': _doc_id(scope, key)},
+        {'$set': {'state': 'done', 'response': _response(status_code, body, fingerprint)}}
+    )
+
+
+async def release_async(db, scope, key):
+    await db[IDEMPOTENCY_COLLECTION].delete_one({'_id': _doc_id(scope, key), 'state': 'pending'})
+
+
+async def store_or_release_async(db, scope, key, status_code, body, fingerprint=None):
+    """Equivalente de store_or_release para o cliente assíncrono"""
+    try:
+        await store_async(db, scope, key, status_code, body, fingerprint)
+    except Exception as e:
+        logger.error(f"Could not store idempotent response for {scope}: {e}")
+        try:
+            await release_async(db, scope, key)
+        except PyMongoError:
+            pass
@@ -0,0 +1,89 @@
+import logging
+
+from pymongo import ASCENDING, TEXT
+from pymongo.errors import PyMongoError
+from common.idempotency import IDEMPOTENCY_COLLECTION, IDEMPOTENCY_TTL
+from common.mongo_outbox import OUTBOX_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+PRODUTOS_COLLECTION = 'produtos'
+
+# Índices sem os quais os serviços não podem arrancar: o id_unique é a única
+# garantia de id único na criação de produtos (não há verificação prévia)
+REQUIRED_INDEXES = ('id_unique',)
+DUPLICATE_IDS_SHOWN = 20
+
+
+class IndiceEssencialError(RuntimeError):
+    """Não foi possível criar um índice de REQUIRED_INDEXES"""
+
+# Índices por colecção: pares (chaves, opções de create_index)
+INDEXES = {
+    PRODUTOS_COLLECTION: [
+        # Pesquisas por id (REST, gRPC, GraphQL) e garantia de id único na inserção
+        ([('id', ASCENDING)], {'unique': True, 'name': 'id_unique'}),
+        # Filtros da pesquisa (common/catalog_query.py): intervalo de preço, stock baixo e
+        # prefixo do nome; o id no índice serve a ordenação (campo, id) sem ordenar em memória
+        ([('price', ASCENDING), ('id', ASCENDING)], {}),
+        ([('stock', ASCENDING), ('id', ASCENDING)], {}),
+        ([('name', ASCENDING), ('id', ASCENDING)], {}),
+        # Pesquisa de palavras no nome ($text)
+        ([('name', TEXT)], {'name': 'name_text', 'default_language': 'portuguese'}),
+    ],
+    OUTBOX_COLLECTION: [
+        # Pesquisa de eventos pendentes por ordem de inserção (relay e health checks)
+        ([('status', ASCENDING), ('_id', ASCENDING)], {}),
+    ],
+    IDEMPOTENCY_COLLECTION: [
+        # Respostas guardadas expiram ao fim de IDEMPOTENCY_TTL segundos
+        ([('created_at', ASCENDING)], {'expireAfterSeconds': IDEMPOTENCY_TTL}),
+    ],
+}
+
+
+def duplicate_ids(collection, limit=DUPLICATE_IDS_SHOWN):
+    """Devolve até limit ids repetidos na colecção, com o número de produtos de cada um"""
+    pipeline = [
+        {'$group': {'_id': '$id', 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}},
+        {'$sort': {'_id': ASCENDING}},
+        {'$limit': limit},
+    ]
+    return [(doc['_id'], doc['count']) for doc in collection.aggregate(pipeline, allowDiskUse=True)]
+
+
+def ensure_indexes(db):
+    """
+    Cria os índices de que as APIs dependem (idempotente, executado no arranque de cada serviço)
+
+    A falha de um índice auxiliar é registada e não impede o arranque. A falha
+    de um índice de REQUIRED_INDEXES é fatal: sem o id_unique as criações
+    aceitariam ids repetidos sem erro. A causa mais comum é a colecção já ter
+    produtos com id repetido, que são indicados na mensagem.
+
+    Raises:
+        IndiceEssencialError: Se não for possível criar um índice essencial
+    """
+    for collection_name, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                db[collection_name].create_index(keys, **options)
+            except PyMongoError as e:
+                if options.get('name') not in REQUIRED_INDEXES:
+                    logger.error(f"Could not create index {keys} on {collection_name}: {str(e)}")
+                    continue
+                raise IndiceEssencialError(_required_index_message(db[collection_name], options['name'], e)) from e
+
+
+def _required_index_message(collection, name, error):
+    message = f"Could not create required index {name} on {collection.name}: {error}"
+    try:
+        repetidos = duplicate_ids(collection)
+    except PyMongoError:
+        return message
+    if repetidos:
+        listed = ', '.join(f"{produto_id} ({count}x)" for produto_id, count in repetidos)
+        message += (f". Duplicate ids (first {len(repetidos)}): {listed}. "
+                    f"Remove or renumber the duplicates and restart the service")
+    return message
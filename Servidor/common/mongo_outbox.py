@@ -0,0 +1,77 @@
+import os
+from contextlib import contextmanager, asynccontextmanager
+from datetime import datetime
+
+# Colecção onde os eventos ficam até o relay os publicar no RabbitMQ
+OUTBOX_COLLECTION = 'outbox'
+
+# Transacções multi-documento exigem MongoDB em replica set (o docker-compose
+# arranca o rs0). MONGO_TRANSACTIONS=0 só para correr contra um MongoDB
+# standalone: a escrita do produto e a do evento passam a ser feitas em
+# sequência e uma falha entre as duas perde o evento
+MONGO_TRANSACTIONS = os.getenv('MONGO_TRANSACTIONS', '1') == '1'
+
+
+@contextmanager
+def outbox_session(client):
+    """
+    Sessão em que a escrita do produto e o registo do evento são confirmados juntos
+
+    Abre uma transacção (commit à saída do bloco, abort em caso de
+    excepção). Com MONGO_TRANSACTIONS=0 devolve None e as operações correm
+    sem sessão, sem garantia de que o evento acompanha a escrita.
+    """
+    if not MONGO_TRANSACTIONS:
+        yield None
+        return
+    with client.start_session() as session:
+        with session.start_transaction():
+            yield session
+
+
+@asynccontextmanager
+async def outbox_session_async(client):
+    """Equivalente de outbox_session para o cliente assíncrono (AsyncMongoClient)"""
+    if not MONGO_TRANSACTIONS:
+        yield None
+        return
+    async with client.start_session() as session:
+        async with await session.start_transaction():
+            yield session
+
+
+def _outbox_document(message):
+    return {
+        'message': message,
+        'status': 'pending',
+        'created_at': datetime.utcnow()
+    }
+
+
+def record_event(db, message, session=None):
+    """
+    Regista uma notificação na outbox da base de dados
+
+    O envio para o RabbitMQ fica a cargo do relay (OutboxRelay), pelo que a
+    escrita não depende da disponibilidade do broker.
+
+    Args:
+        db: Base de dados MongoDB (produtos_db)
+        message (dict): Notificação a publicar
+        session: Sessão devolvida por outbox_session (opcional)
+    """
+    db[OUTBOX_COLLECTION].insert_one(_outbox_document(message), session=session)
+
+
+async def record_event_async(db, message, session=None):
+    """Equivalente de record_event para o cliente assíncrono"""
+    await db[OUTBOX_COLLECTION].insert_one(_outbox_document(message), session=session)
+
+
+def pending_event_count(db):
+    """Número de eventos ainda por publicar"""
+    return db[OUTBOX_COLLECTION].count_documents({'status': 'pending'})
+
+
+async def pending_event_count_async(db):
+    return await db[OUTBOX_COLLECTION].count_documents({'status': 'pending'})
@@ -0,0 +1,173 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from common.rabbitmq_publisher import get_publisher
+
+logger = logging.getLogger(__name__)
+
+# Configuração da outbox (sobreponível por variáveis de ambiente)
+OUTBOX_MAX_SIZE = int(os.getenv('OUTBOX_MAX_SIZE', '10000'))
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '100'))
+OUTBOX_FLUSH_INTERVAL = float(os.getenv('OUTBOX_FLUSH_INTERVAL', '0.2'))
+OUTBOX_OVERFLOW_POLICY = os.getenv('OUTBOX_OVERFLOW_POLICY', 'drop_newest')
+
+OVERFLOW_POLICIES = ('drop_newest', 'drop_oldest', 'block')
+
+
+class NotificationOutbox:
+    """Outbox em memória que desacopla os handlers da publicação no RabbitMQ.
+
+    Os handlers chamam enqueue() e retornam de imediato; uma thread de fundo
+    publica as notificações em lotes quando o lote atinge batch_size mensagens
+    ou quando passam flush_interval segundos desde a primeira mensagem do lote.
+
+    Política de overflow quando a fila (limitada a max_size) está cheia:
+        - drop_newest: a notificação nova é descartada (por omissão; nunca bloqueia o pedido)
+        - drop_oldest: a notificação mais antiga em fila é descartada para dar lugar à nova
+        - block: o handler espera até block_timeout segundos e descarta se a fila não libertar
+
+    Em caso de falha do broker o lote é repetido com backoff até max_retries vezes
+    e depois descartado. Ao terminar o processo a fila é esvaziada (flush-on-shutdown).
+    """
+
+    def __init__(self, publisher=None, max_size=OUTBOX_MAX_SIZE, batch_size=OUTBOX_BATCH_SIZE,
+                 flush_interval=OUTBOX_FLUSH_INTERVAL, overflow_policy=OUTBOX_OVERFLOW_POLICY,
+                 block_timeout=0.05, max_retries=5):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.publisher = publisher or get_publisher()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize=max_size)
+        self._stopping = threading.Event()
+        self._counters_lock = threading.Lock()
+        self._counters = {'queued': 0, 'published': 0, 'dropped': 0}
+        self._thread = threading.Thread(target=self._run, name='notification-outbox', daemon=True)
+        self._thread.start()
+
+    def _count(self, name, amount=1):
+        with self._counters_lock:
+            self._counters[name] += amount
+
+    def enqueue(self, message):
+        """
+        Coloca uma notificação na outbox sem esperar pelo broker
+
+        Returns:
+            bool: True se a notificação ficou em fila, False se foi descartada
+        """
+        if self._stopping.is_set():
+            self._count('dropped')
+            return False
+        try:
+            if self.overflow_policy == 'block':
+                self._queue.put(message, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(message)
+        except queue.Full:
+            if self.overflow_policy != 'drop_oldest':
+                self._count('dropped')
+                return False
+            # Descarta a mais antiga e tenta novamente (outro produtor pode ter ocupado o lugar)
+            try:
+                self._queue.get_nowait()
+                self._count('dropped')
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(message)
+            except queue.Full:
+                self._count('dropped')
+                return False
+        self._count('queued')
+        return True
+
+    def _take_batch(self):
+        """Espera pela primeira mensagem e junta as seguintes até ao limite de tamanho ou tempo"""
+        try:
+            first = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # Durante o shutdown não se espera pelo prazo: publica o que já existe
+                if remaining <= 0 or self._stopping.is_set():
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _publish(self, batch):
+        """Publica um lote, repetindo com backoff exponencial em caso de falha"""
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                self.publisher.publish_batch(batch)
+                self._count('published', len(batch))
+                return
+            except Exception as e:
+                logger.error(f"Error publishing notification batch of {len(batch)} (attempt {attempt}/{self.max_retries}): {e}")
+                # No shutdown não se insiste: o processo vai terminar
+                if self._stopping.is_set() or attempt == self.max_retries:
+                    break
+                self._stopping.wait(min(5.0, 0.1 * 2 ** attempt))
+        self._count('dropped', len(batch))
+
+    def _run(self):
+        """Ciclo da thread de fundo: corre até ao shutdown e à fila estar vazia"""
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._take_batch()
+            if batch:
+                self._publish(batch)
+
+    def shutdown(self, timeout=5.0):
+        """Pára de aceitar notificações e publica as que ainda estão em fila"""
+        self._stopping.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning(f"Notification outbox shutdown timed out with {self._queue.qsize()} pending")
+
+    def stats(self):
+        """Devolve os contadores da outbox e o número de notificações pendentes"""
+        with self._counters_lock:
+            stats = dict(self._counters)
+        stats['pending'] = self._queue.qsize()
+        return stats
+
+
+_outbox = None
+_outbox_pid = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox():
+    """Devolve a outbox partilhada do processo (a thread de fundo arranca na primeira utilização)"""
+    global _outbox, _outbox_pid
+    with _outbox_lock:
+        # A thread de fundo não sobrevive a um fork: cada processo tem a sua outbox
+        if _outbox is None or _outbox_pid != os.getpid():
+            _outbox = NotificationOutbox()
+            _outbox_pid = os.getpid()
+        return _outbox
+
+
+def enqueue_notification(message):
+    """Coloca a notificação na outbox do processo; a publicação ocorre em segundo plano"""
+    return get_outbox().enqueue(message)
+
+
+@atexit.register
+def _shutdown_outbox():
+    if _outbox is not None and _outbox_pid == os.getpid():
+        _outbox.shutdown()
@@ -0,0 +1,193 @@
+import atexit
+import json
+import logging
+import os
+import threading
+
+import pika
+from pika.exceptions import AMQPConnectionError, ChannelClosed, ChannelWrongStateError
+from common.topics import PRODUCT_EXCHANGE, ALL_PRODUCT_EVENTS, routing_key_for
+from common.events import encode_event, PROTOBUF_CONTENT_TYPE, JSON_CONTENT_TYPE
+
+logger = logging.getLogger(__name__)
+
+# Configuração do broker (sobreponível por variáveis de ambiente)
+RABBITMQ_HOST = os.getenv('RABBITMQ_HOST', 'rabbitmq')
+RABBITMQ_USER = os.getenv('RABBITMQ_USER', 'admin')
+RABBITMQ_PASS = os.getenv('RABBITMQ_PASS', 'admin')
+PRODUCT_UPDATES_QUEUE = 'product_updates'
+# Formato do payload: protobuf (ProductEvent) ou json (consumidores legados)
+EVENT_ENCODING = os.getenv('EVENT_ENCODING', 'protobuf')
+
+# Propriedades comuns: mensagem persistente com o content type do formato escolhido
+_MESSAGE_PROPERTIES = pika.BasicProperties(
+    delivery_mode=2,
+    content_type=PROTOBUF_CONTENT_TYPE if EVENT_ENCODING == 'protobuf' else JSON_CONTENT_TYPE,
+    type='ProductEvent'
+)
+
+# Erros após os quais a ligação é descartada e o envio repetido numa ligação nova
+_RECONNECT_ERRORS = (AMQPConnectionError, ChannelClosed, ChannelWrongStateError)
+
+
+def _encode(message):
+    """Serializa a notificação no formato configurado em EVENT_ENCODING"""
+    if EVENT_ENCODING == 'protobuf':
+        return encode_event(message)
+    return json.dumps(message)
+
+
+class RabbitMQPublisher:
+    """Publicador RabbitMQ com ligação e canal persistentes, partilhados por todo o processo.
+
+    O BlockingConnection do pika não é thread-safe, por isso todos os envios são
+    serializados por um lock. Isto permite usar a mesma instância a partir das
+    threads do Flask, dos workers do ThreadPoolExecutor do gRPC e do FastAPI.
+    """
+
+    def __init__(self, host=RABBITMQ_HOST, queue=PRODUCT_UPDATES_QUEUE, max_attempts=2):
+        self.host = host
+        self.queue = queue
+        self.max_attempts = max_attempts  # Tentativas por mensagem (inclui reconexões)
+        self._connection = None
+        self._channel = None
+        self._tx_channel = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Abre a ligação, declara exchange e fila e activa publisher confirms no canal"""
+        credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
+        self._connection = pika.BlockingConnection(
+            pika.ConnectionParameters(self.host, credentials=credentials)
+        )
+        self._channel = self._connection.channel()
+        # Exchange topic (product.<action>.<id>); a fila recebe todos os eventos de produtos
+        self._channel.exchange_declare(exchange=PRODUCT_EXCHANGE, exchange_type='topic', durable=True)
+        self._channel.queue_declare(queue=self.queue, durable=True)
+        self._channel.queue_bind(queue=self.queue, exchange=PRODUCT_EXCHANGE, routing_key=ALL_PRODUCT_EVENTS)
+        # Com confirms, basic_publish só retorna depois de o broker aceitar a mensagem
+        self._channel.confirm_delivery()
+        logger.info(f"RabbitMQ publisher connected to {self.host}")
+
+    def _ensure_channel(self):
+        """Garante que existe um canal aberto, reconectando se necessário"""
+        if (self._connection is None or self._connection.is_closed
+                or self._channel is None or self._channel.is_closed):
+            self._reset()
+            self._connect()
+
+    def _ensure_tx_channel(self):
+        """Garante um segundo canal, em modo transaccional, para envios em lote"""
+        self._ensure_channel()
+        if self._tx_channel is None or self._tx_channel.is_closed:
+            self._tx_channel = self._connection.channel()
+            self._tx_channel.tx_select()
+
+    def _reset(self):
+        """Descarta a ligação actual (ignorando erros de fecho)"""
+        try:
+            if self._connection is not None and self._connection.is_open:
+                self._connection.close()
+        except Exception:
+            pass
+        self._connection = None
+        self._channel = None
+        self._tx_channel = None
+
+    def publish(self, message):
+        """
+        Publica uma mensagem persistente no exchange e aguarda a confirmação do broker
+
+        Args:
+            message (dict): Notificação a enviar (serializada como ProductEvent ou JSON)
+
+        Raises:
+            pika.exceptions.AMQPError: Se o broker rejeitar a mensagem ou não for
+                possível publicar após todas as tentativas
+        """
+        body = _encode(message)
+        routing_key = routing_key_for(message)
+        with self._lock:
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    self._ensure_channel()
+                    self._channel.basic_publish(
+                        exchange=PRODUCT_EXCHANGE,
+                        routing_key=routing_key,
+                        body=body,
+                        properties=_MESSAGE_PROPERTIES,
+                        mandatory=True
+                    )
+                    return
+                except _RECONNECT_ERRORS as e:
+                    # Ligação perdida (ex.: heartbeat expirado em período inactivo)
+                    logger.warning(f"RabbitMQ publish failed (attempt {attempt}/{self.max_attempts}): {e}")
+                    self._reset()
+                    if attempt == self.max_attempts:
+                        raise
+
+    def publish_batch(self, messages):
+        """
+        Publica várias mensagens numa única transacção AMQP
+
+        O canal de confirms exige um round-trip por mensagem; aqui o lote inteiro
+        é confirmado por um só tx.commit. Se a ligação cair a meio, o lote é
+        repetido por completo numa ligação nova (entrega at-least-once).
+
+        Args:
+            messages (list): Notificações a enviar (serializadas como ProductEvent ou JSON)
+        """
+        bodies = [(routing_key_for(message), _encode(message)) for message in messages]
+        with self._lock:
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    self._ensure_tx_channel()
+                    for routing_key, body in bodies:
+                        self._tx_channel.basic_publish(
+                            exchange=PRODUCT_EXCHANGE,
+                            routing_key=routing_key,
+                            body=body,
+                            properties=_MESSAGE_PROPERTIES
+                        )
+                    self._tx_channel.tx_commit()
+                    return
+                except _RECONNECT_ERRORS as e:
+                    logger.warning(f"RabbitMQ batch publish failed (attempt {attempt}/{self.max_attempts}): {e}")
+                    self._reset()
+                    if attempt == self.max_attempts:
+                        raise
+
+    def close(self):
+        """Fecha a ligação ao broker"""
+        with self._lock:
+            self._reset()
+
+
+_publisher = None
+_publisher_pid = None
+_publisher_lock = threading.Lock()
+
+
+def get_publisher():
+    """Devolve o publicador partilhado do processo (criado na primeira utilização)"""
+    global _publisher, _publisher_pid
+    with _publisher_lock:
+        # Processos criados por fork não podem reutilizar a socket do processo pai
+        if _publisher is None or _publisher_pid != os.getpid():
+            _publisher = RabbitMQPublisher()
+            _publisher_pid = os.getpid()
+        return _publisher
+
+
+def send_rabbitmq_notification(message):
+    """Envia notificação para o RabbitMQ através da ligação persistente do processo"""
+    try:
+        get_publisher().publish(message)
+    except Exception as e:
+        logger.error(f"Error sending RabbitMQ notification: {e}")
+
+
+@atexit.register
+def _close_publisher():
+    if _publisher is not None and _publisher_pid == os.getpid():
+        _publisher.close()
@@ -0,0 +1,38 @@
+import json
+from datetime import datetime
+
+# Backend JSON mais rápido quando disponível (orjson); caso contrário a biblioteca standard
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+
+
+def _default(obj):
+    # Tipos que o json standard não serializa e que aparecem nos documentos (ex.: created_at)
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps_bytes(obj):
+    """Serializa em JSON compacto (UTF-8), pronto a enviar como corpo HTTP"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, default=_default).encode('utf-8')
+
+
+def dumps(obj):
+    """Serializa em JSON compacto como str (ex.: frames de texto WebSocket, resposta SOAP)"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default).decode('utf-8')
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, default=_default)
+
+
+def loads(data):
+    """Converte JSON (str ou bytes) em objectos Python"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,75 @@
+from functools import lru_cache
+
+# Exchange topic onde são publicados os eventos de produtos
+PRODUCT_EXCHANGE = 'product_events'
+
+# Padrão com que a fila product_updates é ligada ao exchange (todos os eventos)
+ALL_PRODUCT_EVENTS = 'product.#'
+
+MAX_PATTERN_WORDS = 8
+BULK_PREFIX = 'bulk_'  # Acções em lote: bulk_create, bulk_update
+
+
+def routing_key_for(message):
+    """
+    Calcula a routing key de uma notificação no formato product.<action>.<id>
+
+    Eventos que não dizem respeito a um só produto (ex.: read_all) usam 'all' como id.
+    """
+    action = message.get('action', 'unknown')
+    produto_id = message.get('produto_id')
+    if produto_id is None and isinstance(message.get('produto'), dict):
+        produto_id = message['produto'].get('id')
+    return f"product.{action}.{produto_id if produto_id is not None else 'all'}"
+
+
+def event_routing_keys(message, routing_key=None):
+    """
+    Routing keys com que um evento é comparado com as subscrições
+
+    Um evento em lote (bulk_create, bulk_update) é publicado uma só vez com id
+    'all', mas corresponde também, para cada id de produto_ids, a
+    product.<action>.<id> e à acção individual equivalente (product.create.<id>,
+    product.update.<id>): subscrições por produto (ex.: product.*.42) ou por
+    acção (ex.: product.create.#) continuam a recebê-lo.
+    """
+    if routing_key is None:
+        routing_key = routing_key_for(message)
+    keys = [routing_key]
+    produto_ids = message.get('produto_ids')
+    if produto_ids:
+        action = message.get('action', 'unknown')
+        actions = [action]
+        if action.startswith(BULK_PREFIX):
+            actions.append(action[len(BULK_PREFIX):])
+        keys.extend(f"product.{name}.{produto_id}" for produto_id in produto_ids for name in actions)
+    return keys
+
+
+def matches_any(pattern, routing_keys):
+    """Indica se o padrão corresponde a alguma das routing keys do evento"""
+    return any(topic_matches(pattern, routing_key) for routing_key in routing_keys)
+
+
+def is_valid_pattern(pattern):
+    """Verifica se um padrão de subscrição tem o formato de binding AMQP (palavras, '*' e '#')"""
+    if not isinstance(pattern, str) or not pattern:
+        return False
+    words = pattern.split('.')
+    return len(words) <= MAX_PATTERN_WORDS and all(words)
+
+
+@lru_cache(maxsize=4096)
+def topic_matches(pattern, routing_key):
+    """Indica se a routing key corresponde ao padrão ('*' = uma palavra, '#' = zero ou mais)"""
+    return _match(tuple(pattern.split('.')), tuple(routing_key.split('.')))
+
+
+def _match(pattern, words):
+    if not pattern:
+        return not words
+    if pattern[0] == '#':
+        return any(_match(pattern[1:], words[i:]) for i in range(len(words) + 1))
+    if not words:
+        return False
+    return pattern[0] in ('*', words[0]) and _match(pattern[1:], words[1:])
@@ -0,0 +1,109 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from jsonschema import Draft7Validator
+from jsonschema.exceptions import best_match
+
+logger = logging.getLogger(__name__)
+
+# Schema do produto partilhado por REST e gRPC
+SCHEMA_DIR = os.path.join(os.path.dirname(__file__), 'schemas')
+JSON_SCHEMA_FILE = os.getenv('PRODUTO_JSON_SCHEMA', os.path.join(SCHEMA_DIR, 'produto.schema.json'))
+
+# Recarregamento automático quando os ficheiros mudam (desligado por omissão)
+SCHEMA_HOT_RELOAD = os.getenv('SCHEMA_HOT_RELOAD', '0') == '1'
+SCHEMA_RELOAD_INTERVAL = float(os.getenv('SCHEMA_RELOAD_INTERVAL', '2'))  # Segundos entre verificações
+
+
+class ProdutoInvalido(ValueError):
+    """Produto que não cumpre o schema; message descreve o erro mais relevante"""
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+_json_validator = None
+_mtimes = {}
+_last_check = 0.0
+_lock = threading.Lock()
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def load_schemas():
+    """
+    Lê e compila o JSON Schema do produto
+
+    Chamado no arranque de cada serviço; o validador compilado é
+    reutilizado por todos os pedidos. Um schema inválido levanta excepção
+    e, num recarregamento, mantém-se a versão anterior.
+    """
+    global _json_validator, _mtimes
+    with _lock:
+        with open(JSON_SCHEMA_FILE, 'r') as f:
+            schema = json.load(f)
+        Draft7Validator.check_schema(schema)
+        _json_validator = Draft7Validator(schema)
+        _mtimes = {JSON_SCHEMA_FILE: _mtime(JSON_SCHEMA_FILE)}
+    logger.info(f"Product schema loaded from {JSON_SCHEMA_FILE}")
+
+
+def _reload_if_changed():
+    """Recompila o schema se o ficheiro mudou (no máximo uma verificação por intervalo)"""
+    global _last_check
+    now = time.monotonic()
+    if now - _last_check < SCHEMA_RELOAD_INTERVAL:
+        return
+    _last_check = now
+    if any(_mtime(path) != mtime for path, mtime in _mtimes.items()):
+        try:
+            load_schemas()
+        except Exception as e:
+            logger.error(f"Schema reload failed, keeping previous version: {str(e)}")
+
+
+def _validator():
+    if SCHEMA_HOT_RELOAD:
+        _reload_if_changed()
+    if _json_validator is None:
+        load_schemas()
+    return _json_validator
+
+
+def _first_error(validator, produto):
+    # is_valid pára no primeiro erro; só se procura o erro mais relevante quando falha
+    if validator.is_valid(produto):
+        return None
+    return best_match(validator.iter_errors(produto)).message
+
+
+def validate_produto(produto):
+    """
+    Valida um produto (dicionário) contra o JSON Schema compilado
+
+    Raises:
+        ProdutoInvalido: Se o produto não cumprir o schema
+    """
+    erro = _first_error(_validator(), produto)
+    if erro is not None:
+        raise ProdutoInvalido(erro)
+
+
+def validate_produtos(produtos):
+    """
+    Valida um lote de produtos com o mesmo validador
+
+    Returns:
+        list: Por cada produto, None se for válido ou a mensagem de erro
+    """
+    validator = _validator()
+    return [_first_error(validator, produto) for produto in produtos]
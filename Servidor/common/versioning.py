@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Contador de versão da colecção de produtos, incrementado a cada escrita
+# (base dos ETags da API REST e da invalidação de caches de leitura)
+COUNTERS_COLLECTION = 'counters'
+PRODUTOS_VERSION_ID = 'produtos_version'
+
+# Tentativas de incremento após uma escrita (a espera duplica a cada tentativa)
+VERSION_BUMP_RETRIES = int(os.getenv('VERSION_BUMP_RETRIES', '3'))
+VERSION_BUMP_RETRY_DELAY = float(os.getenv('VERSION_BUMP_RETRY_DELAY', '0.1'))  # Segundos
+
+# Incrementos que falharam neste processo, aplicados na operação de versão seguinte
+_pending_bumps = 0
+_pending_lock = threading.Lock()
+
+
+class VersaoIndisponivel(RuntimeError):
+    """Há incrementos de versão por aplicar e o MongoDB continua a recusá-los"""
+
+
+def _take_pending():
+    global _pending_bumps
+    with _pending_lock:
+        amount, _pending_bumps = _pending_bumps, 0
+    return amount
+
+
+def _restore_pending(amount):
+    global _pending_bumps
+    with _pending_lock:
+        _pending_bumps += amount
+
+
+def pending_version_bumps():
+    """Incrementos de versão por aplicar neste processo (health checks: > 0 indica serviço degradado)"""
+    with _pending_lock:
+        return _pending_bumps
+
+
+def _inc(db, amount):
+    return db[COUNTERS_COLLECTION].update_one(
+        {'_id': PRODUTOS_VERSION_ID},
+        {'$inc': {'value': amount}},
+        upsert=True
+    )
+
+
+def _failed(amount, error):
+    _restore_pending(amount)
+    logger.error(f"Could not bump product collection version after {VERSION_BUMP_RETRIES} attempts "
+                 f"({amount} increments pending): {str(error)}")
+    return False
+
+
+def bump_version(db):
+    """
+    Incrementa a versão da colecção de produtos
+
+    Chamado depois de a escrita estar confirmada (fora de transacções, para
+    que escritas concorrentes não entrem em conflito no mesmo documento).
+    Assim um leitor que lê a versão antes dos dados nunca associa dados
+    antigos a uma versão nova.
+
+    Uma falha não anula a escrita já feita, mas também não pode ficar
+    escondida: uma versão antiga levaria a respostas 304 com dados
+    desactualizados. O incremento é repetido até VERSION_BUMP_RETRIES vezes;
+    se continuar a falhar fica pendente neste processo, os health checks
+    passam a indicar o serviço como degradado e current_version falha até o
+    incremento ser aplicado (na operação de versão seguinte).
+
+    Returns:
+        bool: True se a versão (com os incrementos pendentes) foi actualizada
+    """
+    amount = 1 + _take_pending()
+    error = None
+    for attempt in range(VERSION_BUMP_RETRIES):
+        if attempt:
+            time.sleep(VERSION_BUMP_RETRY_DELAY * 2 ** (attempt - 1))
+        try:
+            _inc(db, amount)
+            return True
+        except PyMongoError as e:
+            error = e
+    return _failed(amount, error)
+
+
+async def bump_version_async(db):
+    """Equivalente de bump_version para o cliente assíncrono (AsyncMongoClient)"""
+    amount = 1 + _take_pending()
+    error = None
+    for attempt in range(VERSION_BUMP_RETRIES):
+        if attempt:
+            await asyncio.sleep(VERSION_BUMP_RETRY_DELAY * 2 ** (attempt - 1))
+        try:
+            await _inc(db, amount)
+            return True
+        except PyMongoError as e:
+            error = e
+    return _failed(amount, error)
+
+
+def _unavailable(amount, error):
+    _restore_pending(amount)
+    return VersaoIndisponivel(f"Product collection version is out of date ({amount} increments pending): {str(error)}")
+
+
+def current_version(db):
+    """
+    Versão actual da colecção de produtos (0 se nunca houve escritas)
+
+    Raises:
+        VersaoIndisponivel: Se houver incrementos pendentes que não seja possível aplicar
+    """
+    amount = _take_pending()
+    if amount:
+        try:
+            _inc(db, amount)
+        except PyMongoError as e:
+            raise _unavailable(amount, e) from e
+    doc = db[COUNTERS_COLLECTION].find_one({'_id': PRODUTOS_VERSION_ID})
+    return doc['value'] if doc else 0
+
+
+async def current_version_async(db):
+    amount = _take_pending()
+    if amount:
+        try:
+            await _inc(db, amount)
+        except PyMongoError as e:
+            raise _unavailable(amount, e) from e
+    doc = await db[COUNTERS_COLLECTION].find_one({'_id': PRODUTOS_VERSION_ID})
+    return doc['value'] if doc else 0